@@ -0,0 +1,78 @@
+"""Benchmark JSON decode and encode throughput for each installed backend.
+
+Decodes a realistic query_range response (log streams plus Loki's "stats"
+block) the way _unwrap_loki_response does, and encodes the unwrapped result
+the way _format_response does. Backends that are not installed are skipped.
+
+    python benchmarks/bench_json.py [--lines N] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import generated.server as srv  # noqa: E402
+
+
+def make_body(lines: int) -> bytes:
+    streams = [
+        {
+            "stream": {"host": f"host-{s}", "job": "api", "level": "info"},
+            "values": [
+                [
+                    str(1_700_000_000_000_000_000 + i),
+                    f'{{"level":"info","msg":"request {i}","path":"/api/v1/items/{i}","status":200,"ms":{i % 97}}}',
+                ]
+                for i in range(s, lines, 20)
+            ],
+        }
+        for s in range(20)
+    ]
+    stats = {
+        "summary": {"bytesProcessedPerSecond": 123456789, "linesProcessedPerSecond": 654321, "totalBytesProcessed": 1},
+        "querier": {"store": {"totalChunksRef": 120, "chunk": {"decompressedBytes": 987654, "headChunkBytes": 0}}},
+        "ingester": {"totalReached": 3, "store": {"chunk": {"decompressedLines": lines, "totalDuplicates": 0}}},
+    }
+    body = {"status": "success", "data": {"resultType": "streams", "result": streams, "stats": stats}}
+    return json.dumps(body).encode()
+
+
+def throughput(fn, arg, size: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - started)
+    return size / best / 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    body = make_body(args.lines)
+    data = srv._json_loads(body)["data"]
+    encoded = len(json.dumps(data, indent=2).encode())
+    print(f"query_range body: {args.lines} lines, {len(body) / 1e6:.1f} MB; output {encoded / 1e6:.1f} MB")
+    print(f"{'backend':<10}{'decode MB/s':>13}{'typed MB/s':>12}{'encode MB/s':>13}")
+    for backend in ("stdlib", "orjson", "msgspec"):
+        if backend != "stdlib" and getattr(srv, backend) is None:
+            print(f"{backend:<10}{'not installed':>13}")
+            continue
+        srv._JSON_DECODER = srv._JSON_ENCODER = backend
+        decode = throughput(srv._json_loads, body, len(body), args.repeat)
+        typed = f"{'-':>12}"
+        if backend == "msgspec":
+            typed = f"{throughput(srv._loads_loki_body, body, len(body), args.repeat):>12.0f}"
+        encode = throughput(srv._json_dumps, data, encoded, args.repeat)
+        print(f"{backend:<10}{decode:>13.0f}{typed}{encode:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
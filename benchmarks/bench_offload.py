@@ -0,0 +1,92 @@
+"""Benchmark small-request latency while one large result is being processed.
+
+Runs one large loki_query_range call (decode, filter and format of N log
+lines) and, at the same time, a stream of small calls. Reports the small
+calls' latency for each LOKI_OFFLOAD mode: with "off", they wait behind the
+large call's CPU work on the event loop.
+
+    python benchmarks/bench_offload.py [--lines N] [--modes off,thread,process]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import generated.server as srv  # noqa: E402
+
+
+def make_body(lines: int) -> bytes:
+    streams = [
+        {
+            "stream": {"host": f"host-{s}", "job": "big"},
+            "values": [
+                [str(1_700_000_000_000_000_000 + i), f'level=info msg="request {i}" path=/api/v1/items/{i} status=200']
+                for i in range(s, lines, 20)
+            ],
+        }
+        for s in range(20)
+    ]
+    return json.dumps({"status": "success", "data": {"resultType": "streams", "result": streams}}).encode()
+
+
+SMALL_BODY = json.dumps({"status": "success", "data": {"resultType": "streams", "result": []}}).encode()
+
+
+def use_mock_loki(big_body: bytes) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = big_body if "big" in request.url.params.get("query", "") else SMALL_BODY
+        return httpx.Response(200, content=body, headers={"content-type": "application/json"})
+
+    client = srv.LokiClient()
+    client._client = httpx.AsyncClient(base_url="http://loki.test", transport=httpx.MockTransport(handler))
+    srv._client = client
+    srv._split_interval = 0.0
+
+
+async def scenario(lines: int) -> tuple[float, list[float]]:
+    query_range = getattr(srv.loki_query_range, "fn", srv.loki_query_range)
+    started = time.perf_counter()
+    big = asyncio.create_task(query_range(query='{job="big"}', limit=lines, fields="host"))
+    await asyncio.sleep(0)
+    latencies = []
+    while not big.done():
+        t0 = time.perf_counter()
+        await query_range(query='{job="small"}')
+        latencies.append((time.perf_counter() - t0) * 1000)
+        await asyncio.sleep(0.002)
+    await big
+    return (time.perf_counter() - started) * 1000, latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=200_000)
+    parser.add_argument("--modes", default="off,thread,process")
+    args = parser.parse_args()
+
+    use_mock_loki(make_body(args.lines))
+    print(f"1 large call ({args.lines} lines) alongside small calls; small-call latency in ms")
+    print(f"{'mode':<10}{'large ms':>10}{'small calls':>13}{'p50':>8}{'p95':>8}{'max':>8}")
+    for mode in args.modes.split(","):
+        srv.LOKI_OFFLOAD = mode
+        srv._executor = None
+        large, latencies = asyncio.run(scenario(args.lines))
+        if srv._executor is not None:
+            srv._executor.shutdown()
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+        print(
+            f"{mode:<10}{large:>10.0f}{len(latencies):>13}"
+            f"{statistics.median(latencies):>8.1f}{p95:>8.1f}{max(latencies):>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
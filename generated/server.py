@@ -1,23 +1,56 @@
 """Loki MCP Server (auto-generated).
 
 Generated for Loki 3.x.
-Total tools: ~42
+Total tools: ~46
 
 DO NOT EDIT THIS FILE. All changes must be made in the generator or templates.
 """
 
 from __future__ import annotations
 
+import asyncio
+import atexit
+import concurrent.futures
+import contextvars
+import cProfile
+import functools
+import heapq
+import itertools
 import json
+import logging
+import logging.handlers
+import math
+import operator
 import os
+import pstats
+import queue
+import random
 import re
+import sys
+import tempfile
 import time
+import tracemalloc
+from array import array
+from collections import deque
 from datetime import datetime, timezone
-from typing import Any
+from typing import Any, Callable
 
 import httpx
 from fastmcp import FastMCP
 
+try:
+    import numpy as np
+except ImportError:  # optional: pip install 'loki-mcp[numpy]'
+    np = None
+try:
+    import orjson
+except ImportError:  # optional: pip install 'loki-mcp[orjson]'
+    orjson = None
+try:
+    import msgspec
+except ImportError:  # optional: pip install 'loki-mcp[msgspec]'
+    msgspec = None
+
 # ---------------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------------
@@ -31,12 +64,65 @@ LOKI_VERIFY_SSL = os.environ.get("LOKI_VERIFY_SSL", "false").lower() == "true"
 LOKI_MODULES = os.environ.get("LOKI_MODULES", "")
 LOKI_READ_ONLY = os.environ.get("LOKI_READ_ONLY", "false").lower() == "true"
 LOKI_TIMEOUT = int(os.environ.get("LOKI_TIMEOUT", "30"))
+LOKI_TOOL_TIMEOUT = float(os.environ.get("LOKI_TOOL_TIMEOUT", str(LOKI_TIMEOUT)))
+LOKI_MCP_PROFILE = os.environ.get("LOKI_MCP_PROFILE", "")
+LOKI_MCP_PROFILE_MODE = os.environ.get("LOKI_MCP_PROFILE_MODE", "cprofile")
+LOKI_MCP_PROFILE_DIR = os.environ.get(
+    "LOKI_MCP_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "loki-mcp-profiles")
+)
+LOKI_MCP_PROFILE_RATE = float(os.environ.get("LOKI_MCP_PROFILE_RATE", "1.0"))
+LOKI_MCP_PROFILE_TOP = int(os.environ.get("LOKI_MCP_PROFILE_TOP", "10"))
+LOKI_SLOW_QUERY_LOG = os.environ.get("LOKI_SLOW_QUERY_LOG", "")
+LOKI_SLOW_QUERY_MS = int(os.environ.get("LOKI_SLOW_QUERY_MS", "2000"))
+LOKI_SLOW_QUERY_BYTES = int(os.environ.get("LOKI_SLOW_QUERY_BYTES", str(5 * 1024 * 1024)))
+LOKI_SLOW_QUERY_LOG_MAX_BYTES = int(os.environ.get("LOKI_SLOW_QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOKI_SLOW_QUERY_LOG_BACKUPS = int(os.environ.get("LOKI_SLOW_QUERY_LOG_BACKUPS", "5"))
+LOKI_QUERY_PLANNER = os.environ.get("LOKI_QUERY_PLANNER", "false").lower() == "true"
+LOKI_PLANNER_MAX_BYTES = int(os.environ.get("LOKI_PLANNER_MAX_BYTES", str(100 * 1024**3)))
+LOKI_PLANNER_SHARD_BYTES = int(os.environ.get("LOKI_PLANNER_SHARD_BYTES", str(1024**3)))
+LOKI_PLANNER_MAX_SHARDS = int(os.environ.get("LOKI_PLANNER_MAX_SHARDS", "8"))
+LOKI_SINGLE_FLIGHT = os.environ.get("LOKI_SINGLE_FLIGHT", "true").lower() == "true"
+LOKI_TENANTS = os.environ.get("LOKI_TENANTS", "")
+LOKI_TENANT_CONCURRENCY = int(os.environ.get("LOKI_TENANT_CONCURRENCY", "4"))
+LOKI_HEDGE = os.environ.get("LOKI_HEDGE", "false").lower() == "true"
+LOKI_HEDGE_PERCENTILE = float(os.environ.get("LOKI_HEDGE_PERCENTILE", "95"))
+LOKI_HEDGE_BUDGET = float(os.environ.get("LOKI_HEDGE_BUDGET", "0.05"))
+LOKI_HEDGE_MIN_SAMPLES = int(os.environ.get("LOKI_HEDGE_MIN_SAMPLES", "20"))
+LOKI_ADAPTIVE_CONCURRENCY = os.environ.get("LOKI_ADAPTIVE_CONCURRENCY", "false").lower() == "true"
+LOKI_CONCURRENCY_INITIAL = int(os.environ.get("LOKI_CONCURRENCY_INITIAL", "16"))
+LOKI_CONCURRENCY_MAX = int(os.environ.get("LOKI_CONCURRENCY_MAX", "64"))
+LOKI_MAX_QUEUE = int(os.environ.get("LOKI_MAX_QUEUE", "256"))
+LOKI_LATENCY_TOLERANCE = float(os.environ.get("LOKI_LATENCY_TOLERANCE", "3"))
+LOKI_HEALTH_INTERVAL = float(os.environ.get("LOKI_HEALTH_INTERVAL", "10"))
+LOKI_EJECT_FAILURES = int(os.environ.get("LOKI_EJECT_FAILURES", "3"))
+LOKI_SPLIT_INTERVAL = os.environ.get("LOKI_SPLIT_INTERVAL", "auto").strip().lower()
+LOKI_DRILLDOWN_MAX_REQUESTS = int(os.environ.get("LOKI_DRILLDOWN_MAX_REQUESTS", "200"))
+LOKI_BATCH_CONCURRENCY = int(os.environ.get("LOKI_BATCH_CONCURRENCY", "4"))
+LOKI_BATCH_MAX_CALLS = int(os.environ.get("LOKI_BATCH_MAX_CALLS", "20"))
+LOKI_OFFLOAD = os.environ.get("LOKI_OFFLOAD", "thread").strip().lower()
+LOKI_OFFLOAD_BYTES = int(os.environ.get("LOKI_OFFLOAD_BYTES", str(256 * 1024)))
+LOKI_OFFLOAD_WORKERS = int(os.environ.get("LOKI_OFFLOAD_WORKERS", "2"))
+LOKI_JSON = os.environ.get("LOKI_JSON", "auto").strip().lower()
 
 # Parse enabled modules
 _enabled_modules: set[str] | None = None
 if LOKI_MODULES:
     _enabled_modules = {m.strip() for m in LOKI_MODULES.split(",") if m.strip()}
 
+# Parse federated backends: LOKI_URL="eu=https://loki-eu:3100,us=https://loki-us:3100"
+_BACKEND_RE = re.compile(r"^([A-Za-z0-9_.-]+)=(\S+)$")
+_backend_entries = [e.strip() for e in LOKI_URL.split(",") if e.strip()]
+_backend_urls: dict[str, str] = {"default": LOKI_URL}
+if len(_backend_entries) > 1 and all(_BACKEND_RE.match(e) for e in _backend_entries):
+    _backend_urls = {m.group(1): m.group(2) for m in (_BACKEND_RE.match(e) for e in _backend_entries) if m}
+
+# Parse configured tenants for multi-tenant fan-out
+_tenants: list[str] = [t.strip() for t in LOKI_TENANTS.split(",") if t.strip()]
+
+# Parse profiled tools ("all" or "*" profiles every tool)
+_profiled_tools: set[str] = {t.strip() for t in LOKI_MCP_PROFILE.split(",") if t.strip()}
+_profile_modes: set[str] = {m.strip().lower() for m in LOKI_MCP_PROFILE_MODE.split(",") if m.strip()}
+
 ALL_MODULES = ['admin', 'delete', 'format', 'index', 'ingest', 'patterns', 'query', 'rules', 'status']
 
 
@@ -53,29 +139,85 @@ def _module_enabled(module: str | None) -> bool:
 # Timestamp helper
 # ---------------------------------------------------------------------------
 
-_DURATION_RE = re.compile(r"^(\d+)([smhdw])$")
 _DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+_DURATION_PART_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h|d|w)")
+_RELATIVE_TIME_RE = re.compile(r"(?:now\s*-\s*)?((?:\d+(?:\.\d+)?(?:ms|s|m|h|d|w))+)")
+# Grid steps for relative times; the step used always divides the split interval.
+_SNAP_STEPS = (1, 5, 10, 15, 30, 60, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400)
+_DEFAULT_SPLIT_INTERVAL = 3600.0  # Loki 3.x default for split_queries_by_interval
+_SPLIT_INTERVAL_RE = re.compile(r"^\s*split_queries_by_interval:\s*[\"']?([0-9a-z.]+)", re.MULTILINE)
+
+
+def _parse_duration(value: str) -> float | None:
+    """Seconds in a (compound) duration such as '90s', '1h30m' or Go's '1h0m0s'; None if invalid."""
+    value = value.strip().lower()
+    if not value or "".join(m.group() for m in _DURATION_PART_RE.finditer(value)) != value:
+        return None
+    return sum(
+        float(m.group(1)) * (0.001 if m.group(2) == "ms" else _DURATION_UNITS[m.group(2)])
+        for m in _DURATION_PART_RE.finditer(value)
+    )
+
 
+# Loki's split_queries_by_interval in seconds: None until read from /config
+# (see _load_split_interval), 0 when time snapping is disabled.
+_split_interval: float | None = None
+if LOKI_SPLIT_INTERVAL in ("0", "off", "false"):
+    _split_interval = 0.0
+elif LOKI_SPLIT_INTERVAL != "auto":
+    _split_interval = _parse_duration(LOKI_SPLIT_INTERVAL)
 
-def _parse_timestamp(value: str) -> str:
+
+def _snap_step(lookback: float) -> int:
+    """Grid step for a time `lookback` seconds ago: the largest step dividing the
+    split interval that is at most a tenth of the lookback (0 = do not snap)."""
+    if not _split_interval:
+        return 0
+    split = int(_split_interval)
+    limit = max(1.0, lookback / 10)
+    steps = [s for s in (*_SNAP_STEPS, split) if s <= limit and split % s == 0]
+    return max(steps, default=1)
+
+
+def _rfc3339(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _parse_timestamp(value: str, round_up: bool = False) -> str:
     """Convert a human-friendly timestamp to RFC3339 or pass through.
 
     Accepts:
       - RFC3339 strings (passed through)
       - Unix epoch seconds (converted to RFC3339)
-      - Duration strings like '1h', '30m', '2d' (converted to RFC3339 relative to now)
+      - Durations like '1h', '30m', '1h30m' or 'now-2h' (relative to now)
+      - 'now', 'today' and 'yesterday' (midnight UTC)
+
+    Relative times are snapped to a grid aligned with Loki's query split
+    interval, so repeated calls produce identical ranges that hit Loki's
+    results cache: down for a start, up (round_up=True) for an end. The
+    grid step is at most a tenth of the lookback.
     """
-    if not value:
+    if not value or not value.strip():
         return ""
 
-    # Duration like "1h", "30m"
-    match = _DURATION_RE.match(value.strip())
+    value = value.strip()
+    lowered = value.lower()
+    now = time.time()
+    if lowered in ("today", "yesterday"):
+        midnight = now - now % 86400
+        return _rfc3339(midnight - (86400 if lowered == "yesterday" else 0))
+    if lowered == "now":
+        return _rfc3339(now)
+
+    # Duration like "1h", "30m", "now-1h30m"
+    match = _RELATIVE_TIME_RE.fullmatch(lowered)
     if match:
-        amount = int(match.group(1))
-        unit = match.group(2)
-        seconds_ago = amount * _DURATION_UNITS[unit]
-        ts = datetime.now(timezone.utc).timestamp() - seconds_ago
-        return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        seconds_ago = _parse_duration(match.group(1)) or 0.0
+        ts = now - seconds_ago
+        step = _snap_step(seconds_ago)
+        if step:
+            ts = (math.ceil(ts / step) if round_up else math.floor(ts / step)) * step
+        return _rfc3339(ts)
 
     # Unix epoch (integer or float)
     try:
@@ -84,7 +226,7 @@ def _parse_timestamp(value: str) -> str:
             epoch = epoch / 1e9
         elif epoch > 1e9:  # milliseconds
             epoch = epoch / 1e3
-        return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return _rfc3339(epoch)
     except ValueError:
         pass
 
@@ -92,6 +234,40 @@ def _parse_timestamp(value: str) -> str:
     return value
 
 
+def _timestamp_to_epoch(value: str, default: float) -> float:
+    """Convert a _parse_timestamp() result (RFC3339 or epoch) to epoch seconds.
+
+    Returns default when value is empty or unparseable.
+    """
+    if not value:
+        return default
+    try:
+        epoch = float(value)
+        if epoch > 1e17:  # nanoseconds
+            return epoch / 1e9
+        if epoch > 1e11:  # milliseconds
+            return epoch / 1e3
+        return epoch
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return default
+
+
+def _format_duration(seconds: float) -> str:
+    """Render seconds as the largest whole duration unit, e.g. 7200 -> '2h'."""
+    seconds = max(1, int(seconds))
+    for unit in ("w", "d", "h", "m"):
+        if seconds % _DURATION_UNITS[unit] == 0:
+            return f"{seconds // _DURATION_UNITS[unit]}{unit}"
+    for unit in ("w", "d", "h", "m"):
+        if seconds >= _DURATION_UNITS[unit]:
+            return f"{seconds // _DURATION_UNITS[unit]}{unit}"
+    return f"{seconds}s"
+
+
 def _format_ns_timestamp(ns_str: str) -> str:
     """Convert a nanosecond timestamp string to human-readable RFC3339.
 
@@ -120,32 +296,325 @@ def _format_log_values(result: Any) -> None:
                 entry[0] = _format_ns_timestamp(entry[0])
 
 
+def _with_log_values_formatted(result: Any) -> Any:
+    """_format_log_values that returns the result (for the offload executor)."""
+    _format_log_values(result)
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Tool call context
+# ---------------------------------------------------------------------------
+
+# Name of the tool whose invocation is currently running (set by _instrument).
+_current_tool: contextvars.ContextVar[str] = contextvars.ContextVar("loki_mcp_tool", default="")
+
+# Tenant (X-Scope-OrgID) for requests made in this context; "" = LOKI_ORG_ID.
+_current_tenant: contextvars.ContextVar[str] = contextvars.ContextVar("loki_mcp_tenant", default="")
+
+# time.monotonic() by which the current tool call must finish (set by _instrument);
+# every Loki request made on its behalf gets only the remaining budget.
+_current_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("loki_mcp_deadline", default=None)
+
+
+class DeadlineExceeded(httpx.TimeoutException):
+    """The tool call's deadline passed before a Loki request could complete."""
+
+
+def _remaining_budget() -> float | None:
+    """Seconds left before the current tool call's deadline (None = no deadline)."""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded(f"Tool deadline of {LOKI_TOOL_TIMEOUT:g}s exceeded")
+    return remaining
+
+
+async def _gather_cancelling(*awaitables: Any) -> list[Any]:
+    """Like asyncio.gather, but the first failure cancels the rest and is re-raised as-is."""
+    try:
+        async with asyncio.TaskGroup() as group:
+            tasks = [group.create_task(aw) for aw in awaitables]
+    except ExceptionGroup as failures:
+        raise failures.exceptions[0] from None
+    return [task.result() for task in tasks]
+
+
+# Scheduling class for requests made in this context: "interactive" or "bulk".
+_current_priority: contextvars.ContextVar[str] = contextvars.ContextVar("loki_mcp_priority", default="interactive")
+
+
+async def _as_bulk(awaitable: Any) -> Any:
+    """Await a request as bulk work (queued behind interactive requests)."""
+    _current_priority.set("bulk")
+    return await awaitable
+
+
+# ---------------------------------------------------------------------------
+# Slow-query log
+# ---------------------------------------------------------------------------
+
+
+def _setup_slow_query_log() -> tuple[logging.Logger, logging.handlers.QueueListener] | tuple[None, None]:
+    """Build the NDJSON slow-query logger and its writer, or (None, None) when LOKI_SLOW_QUERY_LOG is unset.
+
+    Records go through a QueueHandler to a QueueListener thread that owns the
+    size-rotated file, so disk writes never block the event loop.
+    """
+    if not LOKI_SLOW_QUERY_LOG:
+        return None, None
+    file_handler = logging.handlers.RotatingFileHandler(
+        LOKI_SLOW_QUERY_LOG,
+        maxBytes=LOKI_SLOW_QUERY_LOG_MAX_BYTES,
+        backupCount=LOKI_SLOW_QUERY_LOG_BACKUPS,
+        encoding="utf-8",
+        delay=True,
+    )
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, file_handler)
+    listener.start()
+
+    logger = logging.getLogger("loki_mcp.slow_query")
+    logger.handlers.clear()
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger, listener
+
+
+_slow_query_logger, _slow_query_listener = _setup_slow_query_log()
+_slow_query_count = 0
+
+
+def _close_slow_query_log() -> None:
+    """Flush pending slow-query records and stop the writer thread (idempotent)."""
+    global _slow_query_logger, _slow_query_listener
+    if _slow_query_listener is not None:
+        _slow_query_listener.stop()
+    _slow_query_logger = _slow_query_listener = None
+
+
+atexit.register(_close_slow_query_log)
+
+
+def _record_slow_query(
+    method: str,
+    path: str,
+    params: dict | None,
+    duration: float,
+    size: int,
+    status: int | str,
+) -> None:
+    """Log a Loki request to the slow-query log if it crossed a threshold."""
+    global _slow_query_count
+    if _slow_query_logger is None:
+        return
+    if duration * 1000 < LOKI_SLOW_QUERY_MS and size < LOKI_SLOW_QUERY_BYTES:
+        return
+    params = params or {}
+    record = {
+        "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+        "tool": _current_tool.get(),
+        "method": method,
+        "path": path,
+        "query": params.get("query", params.get("match[]", "")),
+        "start": params.get("start", ""),
+        "end": params.get("end", ""),
+        "duration_ms": round(duration * 1000, 1),
+        "bytes": size,
+        "status": status,
+    }
+    _slow_query_count += 1
+    _slow_query_logger.info(json.dumps(record, default=str))
+
+
 # ---------------------------------------------------------------------------
 # HTTP Client
 # ---------------------------------------------------------------------------
 
 
-class LokiClient:
-    """Async HTTP client for Loki API with auth support."""
+class _Flight:
+    """One in-flight GET shared by every caller that asked for the same thing."""
+
+    __slots__ = ("task", "waiters", "deadline")
+
+    def __init__(self, task: asyncio.Future, deadline: float | None) -> None:
+        self.task = task
+        self.waiters = 0
+        # The deadline of the caller that started it, which the request runs under.
+        self.deadline = deadline
+
+
+class _Limiter:
+    """AIMD concurrency limit with a priority queue, one per LokiClient.
+
+    The limit grows by about one per limit's worth of successful requests
+    and halves (at most once per smoothed round trip) on 429/5xx, transport
+    errors, or when an endpoint's short-term latency exceeds
+    LOKI_LATENCY_TOLERANCE times its own long-term average (endpoints are
+    tracked separately, so a mix of fast and slow calls is not a spike). Requests over the limit wait in a queue ordered
+    by priority class, then arrival; a full queue rejects new requests.
+    """
+
+    PRIORITIES = {"interactive": 0, "bulk": 1}
+    BACKOFF = 0.5
 
     def __init__(self) -> None:
+        self.limit = float(max(1, min(LOKI_CONCURRENCY_INITIAL, LOKI_CONCURRENCY_MAX)))
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.decreases = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        # Smoothed round trip across all requests: the minimum gap between decreases.
+        self._rtt: float | None = None
+        # Per path: [short-term latency, long-term latency, samples].
+        self._latency: dict[str, list[float]] = {}
+        self._last_decrease = 0.0
+
+    async def acquire(self, priority: str) -> None:
+        if self.in_flight < int(self.limit) and not self.queued:
+            self.in_flight += 1
+            return
+        if self.queued >= LOKI_MAX_QUEUE:
+            self.rejected += 1
+            raise RuntimeError(
+                f"Loki MCP is overloaded ({self.queued} requests queued at limit {int(self.limit)}); "
+                "retry shortly or narrow the query"
+            )
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (self.PRIORITIES.get(priority, 0), next(self._seq), waiter))
+        self.queued += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                self.queued -= 1
+            else:
+                self.release()  # granted a slot just as we were cancelled
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            _rank, _seq, waiter = heapq.heappop(self._waiters)
+            if waiter.done():
+                continue
+            self.queued -= 1
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def on_success(self, latency: float, path: str = "") -> None:
+        self._rtt = latency if self._rtt is None else self._rtt + 0.3 * (latency - self._rtt)
+        ewma = self._latency.get(path)
+        if ewma is None:
+            ewma = self._latency[path] = [latency, latency, 0]
+        else:
+            ewma[0] += 0.3 * (latency - ewma[0])
+            ewma[1] += 0.02 * (latency - ewma[1])
+        ewma[2] += 1
+        if ewma[2] >= 10 and ewma[0] > LOKI_LATENCY_TOLERANCE * ewma[1]:
+            self.on_overload()
+            return
+        self.limit = min(float(LOKI_CONCURRENCY_MAX), self.limit + 1 / self.limit)
+        self._wake()
+
+    def on_overload(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < (self._rtt or 0.0):
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        self.limit = max(1.0, self.limit * self.BACKOFF)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "enabled": LOKI_ADAPTIVE_CONCURRENCY,
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "decreases": self.decreases,
+            "latency_ms": {path: round(ewma[0] * 1000, 1) for path, ewma in self._latency.items()},
+        }
+
+
+class _Replica:
+    """One query-frontend replica behind a backend, with its health and load."""
+
+    __slots__ = ("url", "healthy", "outstanding", "requests", "failures", "last_error")
+
+    def __init__(self, url: str) -> None:
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_error = ""
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "consecutive_failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class LokiClient:
+    """Async HTTP client for Loki API with auth support.
+
+    base_url may list several query-frontend replicas separated by "|".
+    Requests then go to the healthy replica with the fewest outstanding
+    requests; replicas are ejected after LOKI_EJECT_FAILURES consecutive
+    failures and readmitted by a background /ready probe.
+    """
+
+    def __init__(self, base_url: str | None = None, name: str = "default") -> None:
         auth = None
         if LOKI_USERNAME and LOKI_PASSWORD:
             auth = httpx.BasicAuth(LOKI_USERNAME, LOKI_PASSWORD)
 
+        self.name = name
+        self.replicas = [
+            _Replica(url) for url in (base_url or next(iter(_backend_urls.values()))).split("|") if url.strip()
+        ]
         self._client = httpx.AsyncClient(
-            base_url=LOKI_URL,
+            base_url=self.replicas[0].url,
             auth=auth,
             verify=LOKI_VERIFY_SSL,
             timeout=float(LOKI_TIMEOUT),
         )
+        self._probe: asyncio.Task | None = None
+        self._probe_loop: asyncio.AbstractEventLoop | None = None
+        self._inflight: dict[tuple, _Flight] = {}
+        self.get_requests = 0
+        self.coalesced = 0
+        # Recent GET latencies per API path: /labels and query_range differ by orders of magnitude.
+        self._latencies: dict[str, deque[float]] = {}
+        self.label_names: dict[str, tuple[float, set[str]]] = {}
+        self.level_sources: dict[tuple[str, str], tuple[float, str]] = {}
+        self.limiter = _Limiter()
+        self.hedge_eligible = 0
+        self.hedged = 0
+        self.hedge_wins = 0
 
     def _headers(self) -> dict[str, str]:
         headers: dict[str, str] = {}
         if LOKI_TOKEN:
             headers["Authorization"] = f"Bearer {LOKI_TOKEN}"
-        if LOKI_ORG_ID:
-            headers["X-Scope-OrgID"] = LOKI_ORG_ID
+        org_id = _current_tenant.get() or LOKI_ORG_ID
+        if org_id:
+            headers["X-Scope-OrgID"] = org_id
         return headers
 
     async def request(
@@ -158,39 +627,392 @@ class LokiClient:
         content: str | bytes | None = None,
         content_type: str | None = None,
     ) -> httpx.Response:
-        """Make an HTTP request to Loki."""
+        """Make an HTTP request to Loki.
+
+        Concurrent identical GETs (same path, params, tenant and priority class)
+        are coalesced into one HTTP request whose response every caller shares
+        (see _single_flight). With
+        LOKI_HEDGE, slow GETs are hedged (see _hedged_get).
+        """
         headers = self._headers()
         if content_type:
             headers["Content-Type"] = content_type
 
-        resp = await self._client.request(
-            method,
-            path,
-            params=params,
-            json=json_data,
-            data=data,
-            content=content,
-            headers=headers,
+        if method == "GET":
+            send = (
+                (lambda: self._hedged_get(path, params, headers))
+                if LOKI_HEDGE
+                else (lambda: self._send(method, path, params, headers))
+            )
+            if not LOKI_SINGLE_FLIGHT:
+                return await send()
+            self.get_requests += 1
+            key = (
+                path,
+                # Canonical queries, so {a="1", b="2"} and {b="2", a="1"} share a flight.
+                tuple(
+                    sorted((k, _canonical_logql(v) if k == "query" else str(v)) for k, v in (params or {}).items())
+                ),
+                headers.get("X-Scope-OrgID", ""),
+                _current_priority.get(),
+            )
+            return await self._single_flight(key, send)
+        return await self._send(
+            method, path, params, headers, json_data=json_data, data=data, content=content
+        )
+
+    async def _single_flight(self, key: tuple, send: Any) -> httpx.Response:
+        """Join the in-flight request for key, or start it.
+
+        The HTTP request runs as its own task so that one caller being
+        cancelled does not fail the others; it is cancelled only once every
+        caller waiting on it has gone away. It runs under the deadline of the
+        caller that started it: each joiner waits only for its own budget, and
+        one with a looser deadline retries with its own request if the shared
+        one runs out of time.
+        """
+        while True:
+            budget = _remaining_budget()
+            deadline = _current_deadline.get()
+            flight = self._inflight.get(key)
+            if flight is None:
+                flight = _Flight(asyncio.ensure_future(send()), deadline)
+                self._inflight[key] = flight
+                flight.task.add_done_callback(
+                    lambda _task, flight=flight: self._inflight.pop(key) if self._inflight.get(key) is flight else None
+                )
+            else:
+                self.coalesced += 1
+            flight.waiters += 1
+            try:
+                return await asyncio.wait_for(asyncio.shield(flight.task), budget)
+            except TimeoutError:
+                if flight.task.done():
+                    raise
+                raise DeadlineExceeded(f"Tool deadline of {LOKI_TOOL_TIMEOUT:g}s exceeded") from None
+            except httpx.TimeoutException:
+                looser = flight.deadline is not None and (deadline is None or deadline > flight.deadline)
+                if not looser:
+                    raise
+                # The starter's budget ran out, not ours: retry on a request of our own.
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+            finally:
+                flight.waiters -= 1
+                if flight.waiters == 0 and not flight.task.done():
+                    # Forget the flight now: a caller arriving before the task
+                    # finishes cancelling must start a new request, not join this one.
+                    if self._inflight.get(key) is flight:
+                        del self._inflight[key]
+                    flight.task.cancel()
+
+    def _hedge_delay(self, path: str) -> float | None:
+        """Seconds to wait before hedging: LOKI_HEDGE_PERCENTILE of recent latencies for path."""
+        samples = self._latencies.get(path, ())
+        if len(samples) < LOKI_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(LOKI_HEDGE_PERCENTILE / 100 * (len(ordered) - 1)))]
+
+    async def _hedged_get(self, path: str, params: dict | None, headers: dict[str, str]) -> httpx.Response:
+        """Send a GET, duplicating it if no response arrives within the hedge delay.
+
+        The duplicate goes to another replica when one is configured. The
+        first successful (non-5xx) response wins and the other request is
+        cancelled. Hedges are capped at LOKI_HEDGE_BUDGET of eligible GETs so
+        they add only a small fraction of extra load.
+        """
+        self.hedge_eligible += 1
+        delay = self._hedge_delay(path)
+        multi = len(self.replicas) > 1
+        primary = self._pick_replica() if multi else None
+        first = asyncio.ensure_future(self._send("GET", path, params, headers, replica=primary))
+        if delay is None:
+            return await first
+        try:
+            done, _pending = await asyncio.wait({first}, timeout=delay)
+        except asyncio.CancelledError:
+            first.cancel()
+            raise
+        if done or self.hedged + 1 > LOKI_HEDGE_BUDGET * self.hedge_eligible:
+            return await first
+
+        self.hedged += 1
+        second = asyncio.ensure_future(
+            self._send("GET", path, params, headers, replica=self._pick_replica(exclude=primary) if multi else None)
         )
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code < 500:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+            # Neither succeeded: report the original request's outcome.
+            return first.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _pick_replica(self, exclude: _Replica | None = None) -> _Replica:
+        """Least-outstanding healthy replica (any replica if none are healthy)."""
+        candidates = [r for r in self.replicas if r.healthy and r is not exclude]
+        if not candidates:
+            candidates = [r for r in self.replicas if r is not exclude] or self.replicas
+        return min(candidates, key=lambda r: (r.outstanding, random.random()))
+
+    def _record_outcome(self, replica: _Replica, error: str) -> None:
+        if not error:
+            replica.failures = 0
+            return
+        replica.failures += 1
+        replica.last_error = error
+        if replica.failures >= LOKI_EJECT_FAILURES and len(self.replicas) > 1:
+            replica.healthy = False
+
+    def _ensure_health_probe(self) -> None:
+        """Start the background /ready probe on the running loop, once."""
+        loop = asyncio.get_running_loop()
+        if len(self.replicas) < 2 or LOKI_HEALTH_INTERVAL <= 0:
+            return
+        if self._probe is not None and self._probe_loop is loop and not self._probe.done():
+            return
+        self._probe_loop = loop
+        # Fresh context: the probe must not inherit the triggering call's deadline.
+        self._probe = loop.create_task(self._health_probe(), context=contextvars.Context())
+
+    async def _health_probe(self) -> None:
+        while True:
+            await asyncio.sleep(LOKI_HEALTH_INTERVAL)
+            await asyncio.gather(*(self._check_replica(r) for r in self.replicas))
+
+    async def _check_replica(self, replica: _Replica) -> None:
+        try:
+            resp = await self._client.get(
+                f"{replica.url}/ready",
+                headers=self._headers(),
+                timeout=min(float(LOKI_TIMEOUT), 5.0),
+            )
+            ready = resp.status_code == 200
+            error = "" if ready else f"/ready returned HTTP {resp.status_code}"
+        except httpx.HTTPError as e:
+            ready, error = False, type(e).__name__
+        replica.healthy = ready
+        if ready:
+            replica.failures = 0
+        else:
+            replica.last_error = error
+
+    async def _send(
+        self,
+        method: str,
+        path: str,
+        params: dict | None,
+        headers: dict[str, str],
+        json_data: Any = None,
+        data: Any = None,
+        content: str | bytes | None = None,
+        replica: _Replica | None = None,
+    ) -> httpx.Response:
+        # With one replica the client's base_url is used as-is; with several,
+        # each request is addressed to its replica explicitly.
+        if len(self.replicas) > 1:
+            self._ensure_health_probe()
+            replica = replica or self._pick_replica()
+            url = f"{replica.url}{path}"
+        else:
+            replica = self.replicas[0]
+            url = path
+        if LOKI_ADAPTIVE_CONCURRENCY:
+            budget = _remaining_budget()
+            try:
+                await asyncio.wait_for(self.limiter.acquire(_current_priority.get()), budget)
+            except TimeoutError:
+                raise DeadlineExceeded(f"Tool deadline of {LOKI_TOOL_TIMEOUT:g}s exceeded while queued") from None
+        try:
+            remaining = _remaining_budget()
+        except DeadlineExceeded:
+            if LOKI_ADAPTIVE_CONCURRENCY:
+                self.limiter.release()
+            raise
+        # Only the tool call's remaining budget is handed down as the timeout.
+        cut_short = remaining is not None and remaining < LOKI_TIMEOUT
+        replica.outstanding += 1
+        replica.requests += 1
+        started = time.perf_counter()
+        try:
+            resp = await self._client.request(
+                method,
+                url,
+                params=params,
+                json=json_data,
+                data=data,
+                content=content,
+                headers=headers,
+                timeout=remaining if cut_short else float(LOKI_TIMEOUT),
+            )
+        except httpx.HTTPError as e:
+            self._record_outcome(replica, type(e).__name__)
+            if LOKI_ADAPTIVE_CONCURRENCY and not (cut_short and isinstance(e, httpx.TimeoutException)):
+                self.limiter.on_overload()
+            _record_slow_query(method, path, params, time.perf_counter() - started, 0, type(e).__name__)
+            raise
+        finally:
+            replica.outstanding -= 1
+            if LOKI_ADAPTIVE_CONCURRENCY:
+                self.limiter.release()
+        elapsed = time.perf_counter() - started
+        if LOKI_ADAPTIVE_CONCURRENCY:
+            if resp.status_code == 429 or resp.status_code >= 500:
+                self.limiter.on_overload()
+            else:
+                self.limiter.on_success(elapsed, path)
+        if method == "GET" and resp.status_code < 500:
+            self._latencies.setdefault(path, deque(maxlen=500)).append(elapsed)
+        self._record_outcome(replica, f"HTTP {resp.status_code}" if resp.status_code in (502, 503, 504) else "")
+        _record_slow_query(method, path, params, elapsed, len(resp.content), resp.status_code)
         return resp
 
+    def stats(self) -> dict[str, Any]:
+        return {
+            "single_flight": {
+                "enabled": LOKI_SINGLE_FLIGHT,
+                "get_requests": self.get_requests,
+                "coalesced": self.coalesced,
+                "coalesced_rate": round(self.coalesced / self.get_requests, 4) if self.get_requests else 0.0,
+                "in_flight": len(self._inflight),
+            },
+            "hedging": {
+                "enabled": LOKI_HEDGE,
+                "percentile": LOKI_HEDGE_PERCENTILE,
+                "delay_ms": {
+                    path: round(delay * 1000, 1)
+                    for path in self._latencies
+                    if (delay := self._hedge_delay(path)) is not None
+                },
+                "budget": LOKI_HEDGE_BUDGET,
+                "eligible": self.hedge_eligible,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+            },
+            "concurrency": self.limiter.stats(),
+            "replicas": [r.stats() for r in self.replicas],
+        }
+
     async def close(self) -> None:
+        if self._probe is not None:
+            self._probe.cancel()
         await self._client.aclose()
 
 
-# Singleton client
-_client = LokiClient()
+# One pooled client per federated backend (empty unless LOKI_URL names several)
+_federation: dict[str, LokiClient] = (
+    {name: LokiClient(url, name) for name, url in _backend_urls.items()} if len(_backend_urls) > 1 else {}
+)
+
+# Singleton client (the first backend when federated)
+_client = next(iter(_federation.values())) if _federation else LokiClient()
 
 
 async def _get_client() -> LokiClient:
+    if _split_interval is None:
+        await _load_split_interval(_client)
     return _client
 
 
+async def _load_split_interval(client: LokiClient) -> None:
+    """Read split_queries_by_interval from Loki's /config once, for time snapping."""
+    global _split_interval
+    try:
+        resp = await client.request("GET", "/config")
+    except httpx.HTTPError:
+        resp = None
+    match = _SPLIT_INTERVAL_RE.search(resp.text) if resp is not None and resp.status_code == 200 else None
+    if _split_interval is None:
+        _split_interval = (_parse_duration(match.group(1)) if match else None) or _DEFAULT_SPLIT_INTERVAL
+
+
 # ---------------------------------------------------------------------------
 # Response formatting
 # ---------------------------------------------------------------------------
 
 
+def _json_backend(preferred: tuple[str, ...]) -> str:
+    """The JSON library to use: LOKI_JSON if installed, else the first installed of preferred."""
+    installed = {"orjson": orjson is not None, "msgspec": msgspec is not None, "stdlib": True}
+    if LOKI_JSON != "auto":
+        return LOKI_JSON if installed.get(LOKI_JSON) else "stdlib"
+    return next((name for name in preferred if installed[name]), "stdlib")
+
+
+# msgspec decodes fastest (and can skip "stats" entirely); orjson encodes fastest.
+_JSON_DECODER = _json_backend(("msgspec", "orjson"))
+_JSON_ENCODER = _json_backend(("orjson", "msgspec"))
+
+if msgspec is not None:
+
+    class _QueryData(msgspec.Struct):
+        """The data of a query/query_range response; "stats" is never built."""
+
+        resultType: str
+        result: list
+        encodingFlags: list | None = None
+
+    class _QueryEnvelope(msgspec.Struct):
+        status: str
+        data: _QueryData
+
+    _query_decoder = msgspec.json.Decoder(_QueryEnvelope)
+    _generic_decoder = msgspec.json.Decoder()
+
+
+def _json_loads(content: bytes | str) -> Any:
+    """Decode JSON with the configured backend (errors are ValueErrors, as with json.loads)."""
+    if _JSON_DECODER == "msgspec":
+        try:
+            return _generic_decoder.decode(content)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+    if _JSON_DECODER == "orjson":
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def _loads_loki_body(content: bytes) -> Any:
+    """Decode a Loki response body; query envelopes decode typed under msgspec."""
+    if _JSON_DECODER == "msgspec":
+        try:
+            envelope = _query_decoder.decode(content)
+        except msgspec.DecodeError:
+            pass  # not a query result (or not JSON) — decode generically
+        else:
+            data = {"resultType": envelope.data.resultType, "result": envelope.data.result}
+            if envelope.data.encodingFlags is not None:
+                data["encodingFlags"] = envelope.data.encodingFlags
+            return {"status": envelope.status, "data": data}
+    return _json_loads(content)
+
+
+def _json_dumps(data: Any) -> str:
+    """Encode tool output as indented JSON (unknown types via str()) with the configured backend.
+
+    Every backend writes non-ASCII text as-is, so output does not depend on what is installed.
+    """
+    if _JSON_ENCODER == "orjson":
+        try:
+            return orjson.dumps(data, default=str, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass  # e.g. integers wider than 64 bits — json handles them
+    elif _JSON_ENCODER == "msgspec":
+        try:
+            return msgspec.json.format(msgspec.json.encode(data, enc_hook=str), indent=2).decode()
+        except (TypeError, ValueError, msgspec.EncodeError):
+            pass
+    return json.dumps(data, indent=2, default=str, ensure_ascii=False)
+
+
 def _format_response(data: Any, summary: str | None = None) -> str:
     """Format API response data for tool output."""
     if isinstance(data, str):
@@ -198,8 +1020,8 @@ def _format_response(data: Any, summary: str | None = None) -> str:
             return f"{summary}\n\n{data}"
         return data
     if summary:
-        return f"{summary}\n\n{json.dumps(data, indent=2, default=str)}"
-    return json.dumps(data, indent=2, default=str)
+        return f"{summary}\n\n{_json_dumps(data)}"
+    return _json_dumps(data)
 
 
 def _unwrap_loki_response(resp: httpx.Response) -> Any:
@@ -219,7 +1041,7 @@ def _unwrap_loki_response(resp: httpx.Response) -> Any:
 
     # Try JSON
     try:
-        body = resp.json()
+        body = _loads_loki_body(resp.content)
     except Exception:
         return resp.text
 
@@ -236,105 +1058,2035 @@ def _unwrap_loki_response(resp: httpx.Response) -> Any:
     return body
 
 
-def _handle_error(resp: httpx.Response, tool_name: str) -> str | None:
-    """Check for HTTP errors and return a friendly message, or None if OK.
+def _handle_error(resp: httpx.Response, tool_name: str) -> str | None:
+    """Check for HTTP errors and return a friendly message, or None if OK.
+
+    Distinguishes between Loki API errors (4xx/5xx with JSON body) and
+    connection/transport errors. Returns a formatted error string instead
+    of raising, so the LLM gets actionable feedback instead of a traceback.
+    """
+    if resp.is_success:
+        return None
+
+    # Try to extract Loki's error message from JSON body
+    detail = ""
+    try:
+        body = _json_loads(resp.content)
+        detail = body.get("message", body.get("error", ""))
+    except Exception:
+        detail = resp.text[:500] if resp.text else ""
+
+    error_data = {
+        "error": True,
+        "tool": tool_name,
+        "status_code": resp.status_code,
+        "message": detail or f"HTTP {resp.status_code} {resp.reason_phrase}",
+    }
+
+    if resp.status_code == 400:
+        error_data["hint"] = "Bad request — check query syntax and parameter values."
+    elif resp.status_code == 404:
+        error_data["hint"] = "Not found — the resource or endpoint does not exist."
+    elif resp.status_code == 422:
+        error_data["hint"] = "Unprocessable — the request was well-formed but semantically invalid."
+    elif resp.status_code == 429:
+        error_data["hint"] = "Rate limited — wait and retry."
+    elif resp.status_code >= 500:
+        error_data["hint"] = "Loki server error — the instance may be overloaded or misconfigured."
+
+    return _format_response(error_data, f"Error from {tool_name}: HTTP {resp.status_code}")
+
+
+_NUMERIC_OPS: dict[str, Callable[[float, float], bool]] = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+_FILTER_OPS = ("=", "!=", "=~", "!~", "in", *_NUMERIC_OPS)
+
+
+def _compile_check(key: str, op: str, operand: Any) -> Callable[[dict], bool]:
+    """Compile one `key op operand` filter into a predicate over a label/field dict."""
+    if op in ("=", "!="):
+        expected = str(operand)
+
+        def equals(labels: dict) -> bool:
+            value = labels.get(key, "")
+            return value == expected if type(value) is str else str(value) == expected
+
+        return equals if op == "=" else (lambda labels: not equals(labels))
+    if op in ("=~", "!~"):
+        try:
+            fullmatch = re.compile(str(operand)).fullmatch
+        except re.error as e:
+            raise ValueError(f"invalid regex for {key!r}: {e}") from None
+        if op == "=~":
+            return lambda labels: fullmatch(str(labels.get(key, ""))) is not None
+        return lambda labels: fullmatch(str(labels.get(key, ""))) is None
+    if op == "in":
+        if not isinstance(operand, (list, tuple, set)):
+            raise ValueError(f"'in' for {key!r} needs a list of values")
+        allowed = frozenset(str(v) for v in operand)
+        return lambda labels: str(labels.get(key, "")) in allowed
+    if op in _NUMERIC_OPS:
+        compare = _NUMERIC_OPS[op]
+        try:
+            bound = float(operand)
+        except (TypeError, ValueError):
+            raise ValueError(f"{op!r} for {key!r} needs a number, got {operand!r}") from None
+
+        def numeric(labels: dict) -> bool:
+            try:
+                return compare(float(labels.get(key, "")), bound)
+            except (TypeError, ValueError):
+                return False
+
+        return numeric
+    raise ValueError(f"unknown operator {op!r} for {key!r} (use one of {', '.join(_FILTER_OPS)})")
+
+
+def _compile_filter(query: dict | None) -> Callable[[dict], bool] | None:
+    """Compile a filter_query dict into a single predicate, once per call.
+
+    A plain value means equality ({"host": "doc1"}). A dict applies each of
+    its operators ({"status": {">=": 500, "<": 600}}, {"level": {"in":
+    ["error", "warn"]}}). Regex operators must match the whole value, as in
+    LogQL; a missing key compares as "". Raises ValueError for unknown
+    operators, invalid regexes and non-numeric comparison bounds.
+    """
+    if not query:
+        return None
+    checks = [
+        _compile_check(str(key), op, operand)
+        for key, spec in query.items()
+        for op, operand in (spec.items() if isinstance(spec, dict) else [("=", spec)])
+    ]
+    if len(checks) == 1:
+        return checks[0]
+
+    def match_all(labels: dict) -> bool:
+        for check in checks:
+            if not check(labels):
+                return False
+        return True
+
+    return match_all
+
+
+def _count_lines(result: Any) -> int:
+    """Number of log lines in a streams result (0 for anything else)."""
+    if not isinstance(result, dict) or not isinstance(result.get("result"), list):
+        return 0
+    return sum(len(s.get("values", [])) for s in result["result"] if isinstance(s, dict))
+
+
+def _error_message(err: str) -> str:
+    """The message from an error returned by _handle_error (or its summary line)."""
+    summary, _, body = err.partition("\n\n")
+    try:
+        return str(json.loads(body).get("message") or summary)
+    except (ValueError, AttributeError):
+        return summary
+
+
+def _error_status(err: str) -> int | None:
+    """The HTTP status of an error returned by _handle_error (None for other errors)."""
+    try:
+        status = json.loads(err.partition("\n\n")[2]).get("status_code")
+    except (ValueError, AttributeError):
+        return None
+    return status if isinstance(status, int) else None
+
+
+def _filter_results(
+    data: Any,
+    fields: str = "",
+    query: dict | None = None,
+    filter_path: str | None = None,
+    filter_label_key: str | None = None,
+) -> Any:
+    """Apply client-side filtering to list results.
+
+    Args:
+        data: The unwrapped API response data.
+        fields: Comma-separated field names to keep (empty = all).
+        query: filter_query dict (see _compile_filter); only matching items are kept.
+        filter_path: Dot path to the list within data (e.g. "result"). None = data is the list.
+        filter_label_key: If items are Loki-style {stream: {labels}, values: [...]},
+                          this is the key holding the label dict (e.g. "stream", "metric").
+                          None = items are flat dicts.
+    """
+    if not fields and not query:
+        return data
+
+    # Extract the list to filter
+    items = data
+    if filter_path and isinstance(data, dict):
+        items = data.get(filter_path, data)
+
+    if not isinstance(items, list):
+        return data
+
+    predicate = _compile_filter(query)
+    field_list = [f for f in dict.fromkeys(f.strip() for f in fields.split(",")) if f] if fields else []
+
+    # Non-dict items (strings, etc.) can't be filtered and are kept as-is.
+    if predicate is not None:
+        if filter_label_key:
+            items = [i for i in items if not isinstance(i, dict) or predicate(i.get(filter_label_key, {}))]
+        else:
+            items = [i for i in items if not isinstance(i, dict) or predicate(i)]
+
+    # Apply field projection (iterating the few wanted fields, not every key)
+    if field_list:
+        if filter_label_key:
+            items = [
+                {**i, filter_label_key: {f: labels[f] for f in field_list if f in labels}}
+                if isinstance(i, dict) and isinstance(labels := i.get(filter_label_key, {}), dict)
+                else i
+                for i in items
+            ]
+        else:
+            items = [{f: i[f] for f in field_list if f in i} if isinstance(i, dict) else i for i in items]
+
+    if filter_path and isinstance(data, dict):
+        return {**data, filter_path: items}
+    return items
+
+
+# ---------------------------------------------------------------------------
+# CPU offload
+# ---------------------------------------------------------------------------
+
+# Executor for CPU-bound post-processing of large results (see _offload).
+_executor: concurrent.futures.Executor | None = None
+_offloaded = 0
+
+
+def _get_executor() -> concurrent.futures.Executor:
+    global _executor
+    if _executor is None:
+        if LOKI_OFFLOAD == "process":
+            _executor = concurrent.futures.ProcessPoolExecutor(max_workers=LOKI_OFFLOAD_WORKERS)
+        else:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=LOKI_OFFLOAD_WORKERS, thread_name_prefix="loki-mcp-offload"
+            )
+        atexit.register(_executor.shutdown, wait=False, cancel_futures=True)
+    return _executor
+
+
+async def _offload(fn: Callable[..., Any], *args: Any, size: int, **kwargs: Any) -> Any:
+    """Run fn(*args, **kwargs) in the offload executor when size >= LOKI_OFFLOAD_BYTES.
+
+    Smaller jobs, and every job with LOKI_OFFLOAD=off, run inline. Offloading
+    keeps the event loop serving other tool calls while a large result is
+    decoded, filtered or serialized. With LOKI_OFFLOAD=process, fn's
+    arguments are copied to the worker, so fn must return what it changes.
+    """
+    global _offloaded
+    if LOKI_OFFLOAD == "off" or size < LOKI_OFFLOAD_BYTES:
+        return fn(*args, **kwargs)
+    _offloaded += 1
+    call = functools.partial(fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), call)
+
+
+def _result_bytes(result: Any) -> int:
+    """Rough serialized size of a tool result, sampling one entry per series (O(series), not O(entries))."""
+    if isinstance(result, dict):
+        series = result.get("result", result.get("results"))
+        if isinstance(series, dict):
+            return _result_bytes(series)
+        if not isinstance(series, list):
+            return 0
+        size = 0
+        for item in series:
+            values = item.get("values") if isinstance(item, dict) else None
+            if values:
+                sample = values[0][1] if isinstance(values[0], list) and len(values[0]) > 1 else values[0]
+                size += len(values) * (48 + (len(sample) if isinstance(sample, str) else 32))
+            size += 160
+        return size
+    if isinstance(result, list):
+        return len(result) * 64
+    return len(result) if isinstance(result, str) else 0
+
+
+async def _unwrap_offloaded(resp: httpx.Response) -> Any:
+    """_unwrap_loki_response, decoding large bodies in the offload executor."""
+    return await _offload(_unwrap_loki_response, resp, size=len(resp.content))
+
+
+# ---------------------------------------------------------------------------
+# Result merging
+# ---------------------------------------------------------------------------
+
+
+def _keyed_entries(key: tuple, values: list) -> Any:
+    """Yield (timestamp_ns, stream_key, entry) for one stream's values."""
+    for entry in values:
+        yield int(entry[0]), key, entry
+
+
+def _merge_stream_results(
+    results: list[Any],
+    direction: str = "backward",
+    limit: int = 0,
+) -> dict:
+    """Merge several Loki `streams` results into one, ordered by timestamp.
+
+    Each stream's values are already sorted in query direction, so this is a
+    lazy k-way heap merge: with a limit only the newest (backward) or oldest
+    (forward) `limit` entries overall are materialized. Streams with the same
+    label set are combined. limit=0 keeps everything.
+    """
+    reverse = direction == "backward"
+    sources: list[Any] = []
+    labels_by_key: dict[tuple, dict] = {}
+    for result in results:
+        if not isinstance(result, dict):
+            continue
+        for stream in result.get("result", []):
+            labels = stream.get("stream", {})
+            key = tuple(sorted(labels.items()))
+            labels_by_key.setdefault(key, labels)
+            sources.append(_keyed_entries(key, stream.get("values", [])))
+
+    merged = heapq.merge(*sources, key=lambda item: item[0], reverse=reverse)
+    if limit > 0:
+        merged = itertools.islice(merged, limit)
+
+    streams: dict[tuple, dict] = {}
+    for _ts, key, entry in merged:
+        if key not in streams:
+            streams[key] = {"stream": labels_by_key[key], "values": []}
+        streams[key]["values"].append(entry)
+    return {"resultType": "streams", "result": list(streams.values())}
+
+
+def _tag_result(result: Any, label: str, value: str) -> Any:
+    """Add label=value to every stream/series in a Loki query result (in place)."""
+    if isinstance(result, dict):
+        for item in result.get("result", []):
+            if isinstance(item, dict):
+                key = "stream" if "stream" in item else "metric"
+                item[key] = {**item.get(key, {}), label: value}
+    return result
+
+
+def _combine_results(results: list[Any], direction: str = "backward", limit: int = 0) -> dict:
+    """Combine query results from several sources into one result.
+
+    Stream results are k-way merged by timestamp under the global limit;
+    matrix/vector results are concatenated.
+    """
+    results = [r for r in results if isinstance(r, dict)]
+    result_type = next((r.get("resultType") for r in results if r.get("resultType")), "streams")
+    if result_type == "streams":
+        return _merge_stream_results(results, direction=direction, limit=limit)
+    return {"resultType": result_type, "result": [item for r in results for item in r.get("result", [])]}
+
+
+# ---------------------------------------------------------------------------
+# Fan-out: tenants and federated backends
+# ---------------------------------------------------------------------------
+
+
+async def _fan_out(
+    targets: list[tuple[str, Any]],
+    label: str,
+    kind: str,
+    concurrency: int,
+    direction: str = "backward",
+    limit: int = 0,
+) -> tuple[Any, str | None]:
+    """Run (result, error) query coroutines for several targets concurrently.
+
+    targets pairs a name with a zero-argument callable returning the
+    coroutine. Targets fail independently. Results are tagged with
+    label=<name>, combined by _combine_results under the global limit, and
+    per-target status and timing are reported under kind (e.g. "tenants").
+    """
+    gate = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(name: str, run: Any) -> tuple[Any, dict]:
+        async with gate:
+            started = time.perf_counter()
+            try:
+                result, err = await run()
+            except (httpx.HTTPError, RuntimeError) as e:
+                result, err = None, f"{type(e).__name__}: {e}"
+            status: dict[str, Any] = {"elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+            if err:
+                status.update(status="error", error=err.split("\n")[0])
+            else:
+                status["status"] = "ok"
+                if isinstance(result, dict):
+                    details = {k: v for k, v in result.items() if k not in ("resultType", "result")}
+                    if details:
+                        status["details"] = details
+            return _tag_result(result, label, name), status
+
+    outcomes = await asyncio.gather(*(one(name, run) for name, run in targets))
+    statuses = {name: status for (name, _run), (_result, status) in zip(targets, outcomes)}
+    if all(status["status"] == "error" for status in statuses.values()):
+        return None, _format_response(
+            {"error": True, "message": f"Query failed for every {kind[:-1]}.", kind: statuses},
+            f"Error: all {len(targets)} {kind[:-1]}(s) failed",
+        )
+    combined = _combine_results([result for result, _status in outcomes], direction=direction, limit=limit)
+    combined[kind] = statuses
+    return combined, None
+
+
+def _resolve_tenants(tenants: str) -> list[str]:
+    """Turn a tool's tenants argument into org IDs ("*"/"all" = every LOKI_TENANTS entry)."""
+    requested = [t.strip() for t in tenants.split(",") if t.strip()]
+    if any(t in ("*", "all") for t in requested):
+        return list(_tenants)
+    return requested
+
+
+async def _for_tenants(
+    tenants: str,
+    run: Any,
+    direction: str = "backward",
+    limit: int = 0,
+) -> tuple[Any, str | None]:
+    """Run a (result, error) query coroutine once per tenant, concurrently.
+
+    run is a zero-argument callable returning the coroutine; each tenant's
+    copy runs with _current_tenant set, so every request it makes carries
+    that X-Scope-OrgID. At most LOKI_TENANT_CONCURRENCY tenants run at once,
+    and lines are labelled __tenant_id__. With no tenants the query runs once.
+    """
+    org_ids = _resolve_tenants(tenants)
+    if not org_ids:
+        return await run()
+
+    def as_tenant(org_id: str) -> Any:
+        async def run_as_tenant() -> tuple[Any, str | None]:
+            _current_tenant.set(org_id)
+            return await run()
+        return run_as_tenant
+
+    return await _fan_out(
+        [(org_id, as_tenant(org_id)) for org_id in org_ids],
+        "__tenant_id__",
+        "tenants",
+        LOKI_TENANT_CONCURRENCY,
+        direction=direction,
+        limit=limit,
+    )
+
+
+async def _for_backends(run: Any, direction: str = "backward", limit: int = 0) -> tuple[Any, str | None]:
+    """Run a (result, error) query against every federated backend, concurrently.
+
+    run takes the backend's LokiClient. Without federation it runs once
+    against the default client; otherwise lines are labelled __backend__
+    and per-backend latency and status are reported under "backends".
+    """
+    if not _federation:
+        return await run(await _get_client())
+    return await _fan_out(
+        [(name, functools.partial(run, backend)) for name, backend in _federation.items()],
+        "__backend__",
+        "backends",
+        len(_federation),
+        direction=direction,
+        limit=limit,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Partial results
+# ---------------------------------------------------------------------------
+
+
+async def _run_sections(runs: dict[str, Any], timeout: float = 0) -> tuple[dict[str, Any], dict[str, str]]:
+    """Run named sections concurrently and keep whatever finishes in time.
+
+    runs maps a section name to a zero-argument callable returning its
+    coroutine. Waiting stops after timeout seconds, or 90% of the tool
+    call's remaining budget (whichever is sooner) so there is time left to
+    answer. Unfinished sections are cancelled. Returns (done, missing), where
+    missing maps each section that did not complete to the reason.
+    """
+    try:
+        remaining = _remaining_budget()
+    except DeadlineExceeded as e:
+        return {}, {name: str(e) for name in runs}
+    budgets = [b for b in (timeout, remaining * 0.9 if remaining is not None else 0) if b > 0]
+    budget = min(budgets) if budgets else None
+
+    tasks = {name: asyncio.ensure_future(run()) for name, run in runs.items()}
+    try:
+        await asyncio.wait(tasks.values(), timeout=budget)
+    finally:
+        stragglers = [task for task in tasks.values() if not task.done()]
+        for task in stragglers:
+            task.cancel()
+        await asyncio.gather(*stragglers, return_exceptions=True)
+
+    done: dict[str, Any] = {}
+    missing: dict[str, str] = {}
+    for name, task in tasks.items():
+        if task.cancelled():
+            missing[name] = f"deadline exceeded after {budget:.1f}s" if budget else "cancelled"
+        elif (exc := task.exception()) is not None:
+            missing[name] = f"{type(exc).__name__}: {exc}"
+        else:
+            done[name] = task.result()
+    return done, missing
+
+
+def _partial(missing: dict[str, str], resume_param: str) -> dict[str, Any]:
+    """Describe missing sections and how to fetch only those on a follow-up call."""
+    return {"missing": missing, "resume": {resume_param: ",".join(missing)}}
+
+
+# ---------------------------------------------------------------------------
+# Metric series
+# ---------------------------------------------------------------------------
+
+
+# Steps auto-step chooses from. The ladder is finer than _SNAP_STEPS, so the point count lands
+# closer to max_points; time snapping keeps its own grid.
+_AUTO_STEPS = (1, 2, 5, 10, 15, 20, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400)
+
+
+def _auto_step(start: float, end: float, max_points: int) -> str:
+    """Smallest step in _AUTO_STEPS giving at most max_points points over [start, end]."""
+    raw = max(1.0, (end - start) / max_points)
+    step = next((s for s in _AUTO_STEPS if s >= raw), math.ceil(raw / 86400) * 86400)
+    return _format_duration(step)
+
+
+def _series_arrays(values: list, drop_non_finite: bool = False) -> tuple[array, array] | None:
+    """Timestamps and values of a matrix series as float arrays.
+
+    None when the series holds anything but finite numbers (NaN and Inf are
+    left as Loki sent them), unless drop_non_finite skips those points.
+    """
+    try:
+        ts = array("d", [float(v[0]) for v in values])
+        vs = array("d", [float(v[1]) for v in values])
+    except (TypeError, ValueError, IndexError):
+        return None
+    if not all(map(math.isfinite, vs)):
+        if not drop_non_finite:
+            return None
+        finite = [i for i, v in enumerate(vs) if math.isfinite(v)]
+        ts = array("d", [ts[i] for i in finite])
+        vs = array("d", [vs[i] for i in finite])
+    return ts, vs
+
+
+def _lttb(ts: array, vs: array, threshold: int) -> list[int]:
+    """Indices of the points Largest-Triangle-Three-Buckets keeps (always the first and last)."""
+    n = len(ts)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    bucket = (n - 2) / (threshold - 2)
+    keep = [0]
+    a = 0
+    for i in range(threshold - 2):
+        lo = int(i * bucket) + 1
+        hi = int((i + 1) * bucket) + 1
+        # The third triangle vertex is the average of the next bucket
+        # (just the last point for the final bucket).
+        next_hi = min(int((i + 2) * bucket) + 1, n)
+        avg_x = sum(ts[hi:next_hi]) / (next_hi - hi)
+        avg_y = sum(vs[hi:next_hi]) / (next_hi - hi)
+        ax, ay = ts[a], vs[a]
+        best, best_area = lo, -1.0
+        for j in range(lo, hi):
+            area = abs((ax - avg_x) * (vs[j] - ay) - (ax - ts[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        keep.append(best)
+        a = best
+    keep.append(n - 1)
+    return keep
+
+
+def _downsample_matrix(result: dict, max_points: int) -> dict:
+    """Convert matrix values to numbers and LTTB-downsample longer series, in place.
+
+    Returns point counts before and after for the tool response.
+    """
+    before = after = downsampled = 0
+    for series in result.get("result", []):
+        values = series.get("values") or []
+        before += len(values)
+        arrays = _series_arrays(values)
+        if arrays is None:
+            after += len(values)
+            continue
+        keep = _lttb(*arrays, max_points)
+        vs = arrays[1]
+        series["values"] = [[values[i][0], vs[i]] for i in keep]
+        after += len(keep)
+        downsampled += len(keep) < len(values)
+    return {
+        "max_points": max_points,
+        "series_downsampled": downsampled,
+        "points_before": before,
+        "points_after": after,
+    }
+
+
+_SUMMARY_COLUMNS = ["series", "points", "min", "max", "mean", "p50", "p95", "last", "trend"]
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    """Linearly interpolated percentile of sorted values (NumPy's default method)."""
+    pos = q / 100 * (len(ordered) - 1)
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def _series_stats(ts: array, vs: array) -> list[float]:
+    """min, max, mean, p50, p95, last and trend of a non-empty series.
+
+    trend is the least-squares linear change across the series' time span,
+    in the series' own units (positive = rising).
+    """
+    if np is not None:
+        t = np.frombuffer(ts, dtype=np.float64)
+        v = np.frombuffer(vs, dtype=np.float64)
+        p50, p95 = np.percentile(v, [50, 95])
+        mean = float(v.mean())
+        centered = t - t.mean()
+        spread = float(centered @ centered)
+        slope = float(centered @ (v - mean)) / spread if spread else 0.0
+        stats = [float(v.min()), float(v.max()), mean, float(p50), float(p95)]
+    else:
+        ordered = sorted(vs)
+        mean = math.fsum(vs) / len(vs)
+        t_mean = math.fsum(ts) / len(ts)
+        spread = math.fsum((x - t_mean) ** 2 for x in ts)
+        slope = math.fsum((x - t_mean) * (y - mean) for x, y in zip(ts, vs)) / spread if spread else 0.0
+        stats = [ordered[0], ordered[-1], mean, _percentile(ordered, 50), _percentile(ordered, 95)]
+    return [*stats, vs[-1], slope * (ts[-1] - ts[0])]
+
+
+def _summarize_series(result: dict) -> dict:
+    """Replace matrix/vector series with one row of statistics per series (see _SUMMARY_COLUMNS)."""
+    rows = []
+    points = 0
+    for series in result.pop("result", []):
+        labels = series.get("metric", {})
+        name = "{" + ", ".join(f"{k}={_logql_string(str(v))}" for k, v in labels.items()) + "}"
+        values = series.get("values") or ([series["value"]] if "value" in series else [])
+        arrays = _series_arrays(values, drop_non_finite=True)
+        points += len(values)
+        if arrays is None or not arrays[1]:
+            rows.append([name, 0] + [None] * (len(_SUMMARY_COLUMNS) - 2))
+            continue
+        rows.append([name, len(arrays[1]), *(float(f"{x:.6g}") for x in _series_stats(*arrays))])
+    result["summary"] = {"columns": _SUMMARY_COLUMNS, "rows": rows, "points": points}
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Volume analysis
+# ---------------------------------------------------------------------------
+
+
+def _volume_series(result: Any, label: str) -> dict[str, dict[int, float]]:
+    """Map each series' `label` value to {bucket timestamp: bytes} from a volume_range matrix."""
+    series: dict[str, dict[int, float]] = {}
+    items = result.get("result", []) if isinstance(result, dict) else []
+    for item in items:
+        buckets = series.setdefault(str(item.get("metric", {}).get(label, "")), {})
+        for ts, value in item.get("values", []):
+            bucket = int(float(ts))
+            buckets[bucket] = buckets.get(bucket, 0.0) + float(value)
+    return series
+
+
+def _anomaly_scores(rows: list[list[float]], baseline: int, method: str) -> list[list[float]]:
+    """z-scores of the buckets after the first `baseline` in each row.
+
+    "zscore" scores against the baseline buckets' mean and standard deviation.
+    "ewma" scores each bucket against an exponentially weighted mean and
+    variance of everything before it (alpha = 2 / (baseline + 1)), so a
+    level shift stops counting once it becomes the new normal. The standard
+    deviation is floored at 10% of the mean and 1 byte, so flat series do
+    not flag noise. Vectorized across series with NumPy when available.
+    """
+    if not rows:
+        return []
+    alpha = 2 / (baseline + 1)
+    if np is not None:
+        data = np.array(rows, dtype=np.float64)
+        if method == "zscore":
+            mean = data[:, :baseline].mean(axis=1)
+            sd = np.maximum(data[:, :baseline].std(axis=1), np.maximum(0.1 * mean, 1.0))
+            return ((data[:, baseline:] - mean[:, None]) / sd[:, None]).tolist()
+        mean = data[:, 0].copy()
+        var = np.zeros(len(rows))
+        scores = np.empty((len(rows), data.shape[1] - baseline))
+        for i in range(1, data.shape[1]):
+            x = data[:, i]
+            if i >= baseline:
+                scores[:, i - baseline] = (x - mean) / np.maximum(np.sqrt(var), np.maximum(0.1 * mean, 1.0))
+            diff = x - mean
+            mean += alpha * diff
+            var = (1 - alpha) * (var + alpha * diff * diff)
+        return scores.tolist()
+
+    out = []
+    for row in rows:
+        if method == "zscore":
+            mean = math.fsum(row[:baseline]) / baseline
+            sd = max(math.sqrt(math.fsum((x - mean) ** 2 for x in row[:baseline]) / baseline), 0.1 * mean, 1.0)
+            out.append([(x - mean) / sd for x in row[baseline:]])
+            continue
+        mean, var, scores = row[0], 0.0, []
+        for i, x in enumerate(row[1:], 1):
+            if i >= baseline:
+                scores.append((x - mean) / max(math.sqrt(var), 0.1 * mean, 1.0))
+            diff = x - mean
+            mean += alpha * diff
+            var = (1 - alpha) * (var + alpha * diff * diff)
+        out.append(scores)
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Query builder
+# ---------------------------------------------------------------------------
+
+_SEVERITY_LEVELS = {"debug": 0, "info": 1, "warn": 2, "warning": 2, "error": 3, "critical": 4, "fatal": 5}
+_REGEX_SYNTAX_RE = re.compile(r"[\\.+*?()|\[\]{}^$]")
+
+
+def _severity_at_least(severity: str) -> list[str]:
+    """Level names at or above a minimum severity ([] if the severity is unknown)."""
+    floor = _SEVERITY_LEVELS.get(severity.lower())
+    if floor is None:
+        return []
+    return [name for name, rank in _SEVERITY_LEVELS.items() if rank >= floor and name != "warning"]
+
+
+def _literal_alternatives(pattern: str) -> list[str] | None:
+    """Split a regex that is only literal text (optionally a|b|c) into its literals, else None."""
+    alternatives = pattern.split("|")
+    if any(not alt or _REGEX_SYNTAX_RE.search(alt) for alt in alternatives):
+        return None
+    return alternatives
+
+
+def _build_log_query(
+    labels: dict[str, str] | None = None,
+    regex_labels: dict[str, str] | None = None,
+    pattern: str = "",
+    pattern_ci: str = "",
+    exclude: str = "",
+    levels: list[str] | None = None,
+    level_source: str = "detected_level",
+) -> str:
+    """Build a canonical LogQL log query from structured parts.
+
+    Values are quoted and escaped, selector matchers are sorted by label
+    name, and line filters are ordered cheapest first: literal |= and !=
+    filters (a literal-only pattern such as 'healthcheck|ping' in exclude
+    becomes one != per alternative) ahead of |~ and !~ regexes. pattern_ci
+    is matched case-insensitively. levels filters by severity, on the
+    detected_level structured metadata when level_source is
+    'detected_level', otherwise with a case-insensitive line regex.
+    """
+    matchers = [f"{k}={_logql_string(str(v))}" for k, v in sorted((labels or {}).items())]
+    matchers += [f"{k}=~{_logql_string(str(v))}" for k, v in sorted((regex_labels or {}).items())]
+    selector = "{" + ", ".join(matchers) + "}"
+
+    contains: list[str] = []
+    not_contains: list[str] = []
+    regexes: list[str] = []
+    if pattern:
+        literals = _literal_alternatives(pattern)
+        if literals and len(literals) == 1:
+            contains.append(f"|= {_logql_string(pattern)}")
+        else:
+            regexes.append(f"|~ {_logql_string(pattern)}")
+    if pattern_ci:
+        regexes.append(f"|~ {_logql_string(f'(?i)({pattern_ci})')}")
+    if levels and level_source != "detected_level":
+        regexes.append(f"|~ {_logql_string('(?i)(' + '|'.join(levels) + ')')}")
+    if exclude:
+        literals = _literal_alternatives(exclude)
+        if literals:
+            not_contains.extend(f"!= {_logql_string(lit)}" for lit in literals)
+        else:
+            regexes.append(f"!~ {_logql_string(exclude)}")
+
+    stages = contains + not_contains + sorted(regexes, key=lambda f: f.startswith("!~"))
+    if levels and level_source == "detected_level":
+        stages.append(f"| detected_level=~{_logql_string('|'.join(levels))}")
+    return " ".join([selector, *stages])
+
+
+# ---------------------------------------------------------------------------
+# Query planner
+# ---------------------------------------------------------------------------
+
+_SELECTOR_MATCHER_RE = re.compile(r"([A-Za-z_][A-Za-z0-9_]*)\s*(=~|!~|!=|=)")
+_SUGGESTED_LABELS = ("namespace", "service_name", "app", "job", "host", "container", "unit")
+
+
+def _extract_selector(query: str) -> str:
+    """Return the first stream selector ({...}) in a LogQL query, or "" if none."""
+    start = query.find("{")
+    if start < 0:
+        return ""
+    quote = ""
+    i = start + 1
+    while i < len(query):
+        ch = query[i]
+        if quote:
+            if ch == "\\" and quote != "`":
+                i += 1
+            elif ch == quote:
+                quote = ""
+        elif ch in "\"`":
+            quote = ch
+        elif ch == "}":
+            return query[start : i + 1]
+        i += 1
+    return ""
+
+
+def _logql_string(value: str) -> str:
+    """Quote a value as a LogQL double-quoted string literal."""
+    return json.dumps(value, ensure_ascii=False)
+
+
+_REGEX_META_RE = re.compile(r"([\\.+*?()|\[\]{}^$])")
+
+
+def _regex_escape(value: str) -> str:
+    """Escape RE2 metacharacters (Go's regexp.QuoteMeta) for LogQL regex matchers."""
+    return _REGEX_META_RE.sub(r"\\\1", value)
+
+
+def _narrow_selector(query: str, selector: str, matchers: list[str]) -> str:
+    """Add matchers to a query's stream selector (selector as found by _extract_selector)."""
+    inner = selector[1:-1].strip()
+    narrowed = "{" + ", ".join(([inner] if inner else []) + matchers) + "}"
+    return query.replace(selector, narrowed, 1)
+
+
+def _is_log_query(query: str) -> bool:
+    """Log queries start with a stream selector; metric queries start with a function."""
+    return query.lstrip().startswith("{")
+
+
+def _format_bytes(n: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if n < 1024 or unit == "TiB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TiB"
+
+
+async def _plan_query(client: LokiClient, query: str, start: float, end: float) -> dict | None:
+    """Estimate a query's cost from /index/stats (and /index/shards) before running it.
+
+    Returns a plan dict with the estimate, a shard count sized to
+    LOKI_PLANNER_SHARD_BYTES, the split interval in seconds, and a verdict:
+    'ok' (run as-is), 'shard' (split the time range) or 'reject' (over
+    LOKI_PLANNER_MAX_BYTES). Returns None when no estimate is available, in
+    which case the query runs unplanned.
+    """
+    selector = _extract_selector(query)
+    if not selector:
+        return None
+    window = {"query": selector, "start": str(int(start * 1e9)), "end": str(int(end * 1e9))}
+    try:
+        resp = await client.request("GET", "/loki/api/v1/index/stats", params=window)
+        if not resp.is_success:
+            return None
+        stats = _unwrap_loki_response(resp)
+    except (httpx.HTTPError, RuntimeError):
+        return None
+    if not isinstance(stats, dict) or "bytes" not in stats:
+        return None
+
+    est_bytes = int(stats.get("bytes", 0))
+    plan: dict[str, Any] = {
+        "selector": selector,
+        "bytes": est_bytes,
+        "bytes_human": _format_bytes(est_bytes),
+        "chunks": int(stats.get("chunks", 0)),
+        "streams": int(stats.get("streams", 0)),
+        "range_seconds": int(end - start),
+        "shards": 1,
+        "split_seconds": int(end - start),
+        "verdict": "ok",
+    }
+    if est_bytes > LOKI_PLANNER_MAX_BYTES:
+        plan["verdict"] = "reject"
+        return plan
+    if est_bytes <= LOKI_PLANNER_SHARD_BYTES or LOKI_PLANNER_MAX_SHARDS <= 1:
+        return plan
+
+    shards = math.ceil(est_bytes / LOKI_PLANNER_SHARD_BYTES)
+    try:
+        resp = await client.request(
+            "GET",
+            "/loki/api/v1/index/shards",
+            params={**window, "targetBytesPerShard": str(LOKI_PLANNER_SHARD_BYTES)},
+        )
+        if resp.is_success:
+            body = _json_loads(resp.content)
+            body = body.get("data", body) if isinstance(body, dict) else {}
+            if isinstance(body, dict) and isinstance(body.get("shards"), list) and body["shards"]:
+                shards = len(body["shards"])
+    except (httpx.HTTPError, ValueError):
+        pass  # /index/shards is Loki 3.x only — keep the bytes-based estimate
+
+    plan["shards"] = min(shards, LOKI_PLANNER_MAX_SHARDS)
+    plan["split_seconds"] = math.ceil((end - start) / plan["shards"])
+    plan["verdict"] = "shard" if plan["shards"] > 1 else "ok"
+    return plan
+
+
+async def _too_expensive(client: LokiClient, tool_name: str, plan: dict, start: float, end: float) -> str:
+    """Build the 'too expensive — narrow it' answer for a rejected plan."""
+    selector_labels = {m.group(1) for m in _SELECTOR_MATCHER_RE.finditer(plan["selector"])}
+    available: list[str] = []
+    try:
+        resp = await client.request(
+            "GET",
+            "/loki/api/v1/labels",
+            params={"start": str(int(start * 1e9)), "end": str(int(end * 1e9))},
+        )
+        if resp.is_success:
+            labels = _unwrap_loki_response(resp)
+            if isinstance(labels, list):
+                available = [label for label in labels if label not in selector_labels]
+    except (httpx.HTTPError, RuntimeError):
+        pass
+    preferred = [label for label in _SUGGESTED_LABELS if label in available]
+    suggested_labels = (preferred + [label for label in available if label not in preferred])[:5]
+
+    affordable = plan["range_seconds"] * LOKI_PLANNER_MAX_BYTES / max(plan["bytes"], 1)
+    return _format_response(
+        {
+            "error": True,
+            "tool": tool_name,
+            "message": "Query too expensive — narrow it.",
+            "estimate": {k: plan[k] for k in ("selector", "bytes_human", "bytes", "chunks", "streams")},
+            "limit": _format_bytes(LOKI_PLANNER_MAX_BYTES),
+            "suggestions": {
+                "smaller_range": f"start='{_format_duration(affordable * 0.9)}'",
+                "add_labels": suggested_labels,
+            },
+            "hint": (
+                "Add more specific label matchers to the selector and/or shorten the time range. "
+                "Use loki_volume_by_label to find which label values hold the volume."
+            ),
+        },
+        f"Query too expensive: ~{plan['bytes_human']} to scan (limit {_format_bytes(LOKI_PLANNER_MAX_BYTES)})",
+    )
+
+
+async def _run_get(client: LokiClient, tool_name: str, path: str, params: dict[str, str]) -> tuple[Any, str | None]:
+    """GET a Loki endpoint and unwrap it. Returns (result, error) like _run_query_range."""
+    resp = await client.request("GET", path, params=params)
+    if err := _handle_error(resp, tool_name):
+        return None, err
+    return await _unwrap_offloaded(resp), None
+
+
+async def _run_query_range(
+    client: LokiClient,
+    tool_name: str,
+    params: dict[str, str],
+    stream_groups: int = 0,
+) -> tuple[Any, str | None]:
+    """Run /query_range, consulting the planner first when LOKI_QUERY_PLANNER is on.
+
+    Returns (result, error). error is a formatted tool response (HTTP error or
+    planner rejection) and result is None when it is set. Log queries are
+    split into stream groups when stream_groups > 1, or into time shards when
+    the planner sizes them above one shard; either way the pieces run
+    concurrently and are merged back by timestamp.
+    """
+    query = params.get("query", "")
+    now = time.time()
+    end = _timestamp_to_epoch(params.get("end", ""), now)
+    start = _timestamp_to_epoch(params.get("start", ""), end - 3600)
+    plan = None
+    if LOKI_QUERY_PLANNER:
+        plan = await _plan_query(client, query, start, end)
+        if plan and plan["verdict"] == "reject":
+            return None, await _too_expensive(client, tool_name, plan, start, end)
+    if stream_groups > 1 and _is_log_query(query):
+        result, err = await _run_stream_shards(client, tool_name, params, stream_groups, start, end)
+        if result is not None or err:
+            return result, err
+    if plan and plan["verdict"] == "shard" and _is_log_query(query):
+        return await _run_time_shards(client, tool_name, params, plan, start, end)
+
+    resp = await client.request("GET", "/loki/api/v1/query_range", params=params)
+    if err := _handle_error(resp, tool_name):
+        return None, err
+    return await _unwrap_offloaded(resp), None
+
+
+async def _run_time_shards(
+    client: LokiClient,
+    tool_name: str,
+    params: dict[str, str],
+    plan: dict,
+    start: float,
+    end: float,
+) -> tuple[Any, str | None]:
+    """Split [start, end) into plan['shards'] intervals, query them concurrently, merge."""
+    start_ns, end_ns = int(start * 1e9), int(end * 1e9)
+    step_ns = math.ceil((end_ns - start_ns) / plan["shards"])
+    bounds = [(lo, min(lo + step_ns, end_ns)) for lo in range(start_ns, end_ns, step_ns)]
+    responses = await _gather_cancelling(
+        *(
+            _as_bulk(
+                client.request(
+                    "GET",
+                    "/loki/api/v1/query_range",
+                    params={**params, "start": str(lo), "end": str(hi)},
+                )
+            )
+            for lo, hi in bounds
+        )
+    )
+    for resp in responses:
+        if err := _handle_error(resp, tool_name):
+            return None, err
+    merged = _merge_stream_results(
+        [_unwrap_loki_response(resp) for resp in responses],
+        direction=params.get("direction", "backward"),
+        limit=int(params.get("limit", "0") or 0),
+    )
+    merged["plan"] = {k: plan[k] for k in ("bytes_human", "chunks", "streams", "shards", "split_seconds")}
+    return merged, None
+
+
+def _partition_streams(series: list[dict], selector: str, groups: int) -> tuple[str, list[list[str]]] | None:
+    """Split matching streams into groups by their most selective label.
+
+    Picks the label (not already pinned by an equality matcher) with the most
+    distinct values across series, then deals its values into `groups`
+    buckets balanced by stream count. Streams without the label are
+    represented by the empty value. Returns (label, value_groups) or None
+    when the streams cannot be told apart.
+    """
+    pinned = {m.group(1) for m in _SELECTOR_MATCHER_RE.finditer(selector) if m.group(2) == "="}
+    counts: dict[str, dict[str, int]] = {}
+    for labels in series:
+        for key, value in labels.items():
+            if key not in pinned and not key.startswith("__"):
+                counts.setdefault(key, {})
+                counts[key][value] = counts[key].get(value, 0) + 1
+    if not counts:
+        return None
+    label = max(sorted(counts), key=lambda k: len(counts[k]))
+    per_value = dict(counts[label])
+    missing = len(series) - sum(per_value.values())
+    if missing:
+        per_value[""] = missing
+    if len(per_value) < 2:
+        return None
+
+    buckets: list[list[str]] = [[] for _ in range(min(groups, len(per_value)))]
+    sizes = [0] * len(buckets)
+    for value, count in sorted(per_value.items(), key=lambda kv: (-kv[1], kv[0])):
+        i = sizes.index(min(sizes))
+        buckets[i].append(value)
+        sizes[i] += count
+    return label, buckets
+
+
+async def _run_stream_shards(
+    client: LokiClient,
+    tool_name: str,
+    params: dict[str, str],
+    groups: int,
+    start: float,
+    end: float,
+) -> tuple[Any, str | None]:
+    """Query groups of streams concurrently with narrowed selectors.
+
+    Enumerates the selector's streams via /series, partitions them with
+    _partition_streams and runs one query per group. Each group gets the full
+    `limit`, so quiet streams are sampled fairly instead of being crowded out
+    by the busiest one. Returns (None, None) when the streams cannot be
+    partitioned, so the caller falls back to a single query.
+    """
+    query = params["query"]
+    selector = _extract_selector(query)
+    if not selector:
+        return None, None
+    resp = await client.request(
+        "GET",
+        "/loki/api/v1/series",
+        params={"match[]": selector, "start": str(int(start * 1e9)), "end": str(int(end * 1e9))},
+    )
+    if not resp.is_success:
+        return None, None
+    series = _unwrap_loki_response(resp)
+    if not isinstance(series, list):
+        return None, None
+    partition = _partition_streams(series, selector, groups)
+    if partition is None:
+        return None, None
+    label, buckets = partition
+
+    sub_queries = [
+        _narrow_selector(query, selector, [f"{label}=~{_logql_string('|'.join(_regex_escape(v) for v in values))}"])
+        for values in buckets
+    ]
+
+    responses = await _gather_cancelling(
+        *(
+            _as_bulk(client.request("GET", "/loki/api/v1/query_range", params={**params, "query": q}))
+            for q in sub_queries
+        )
+    )
+    for resp in responses:
+        if err := _handle_error(resp, tool_name):
+            return None, err
+    merged = _merge_stream_results(
+        [_unwrap_loki_response(resp) for resp in responses],
+        direction=params.get("direction", "backward"),
+    )
+    merged["sharding"] = {"label": label, "groups": len(buckets), "streams": len(series)}
+    return merged, None
+
+
+# ---------------------------------------------------------------------------
+# LogQL parser
+# ---------------------------------------------------------------------------
+
+
+class LogQLError(ValueError):
+    """A query the local LogQL parser cannot accept: invalid, or not supported locally."""
+
+
+_LOGQL_TOKEN_RE = re.compile(
+    r"""
+    (?P<ws>\s+|\#[^\n]*)
+    |(?P<string>"(?:[^"\\\n]|\\.)*"|`[^`]*`)
+    |(?P<number>[0-9][0-9A-Za-zµ._]*)
+    |(?P<flag>--[A-Za-z][A-Za-z0-9_-]*)
+    |(?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+    |(?P<op>\|=|\|~|\|>|!=|!~|!>|=~|==|>=|<=|[|{}()\[\],=<>+\-*/%^])
+    """,
+    re.VERBOSE,
+)
+_LOGQL_NUMBER_RE = re.compile(r"\d+(\.\d+)?")
+_LOGQL_DURATION_RE = re.compile(r"(\d+(\.\d+)?(ns|us|µs|ms|s|m|h|d|w|y))+")
+_LOGQL_BYTES_RE = re.compile(r"\d+(\.\d+)?([kmgtpe]i?)?b", re.IGNORECASE)
+_GO_ESCAPES = {
+    "n": "\n", "t": "\t", "r": "\r", "\\": "\\", '"': '"', "'": "'", "a": "\a", "b": "\b", "f": "\f", "v": "\v",
+}
+
+_RANGE_AGGREGATIONS = {
+    "rate", "rate_counter", "count_over_time", "bytes_rate", "bytes_over_time", "absent_over_time",
+    "sum_over_time", "avg_over_time", "max_over_time", "min_over_time", "stdvar_over_time",
+    "stddev_over_time", "quantile_over_time", "first_over_time", "last_over_time",
+}
+_UNWRAPPED_AGGREGATIONS = _RANGE_AGGREGATIONS - {
+    "rate", "count_over_time", "bytes_rate", "bytes_over_time", "absent_over_time",
+}
+# Range aggregations Loki allows by/without on (all need unwrap); rate_counter and
+# sum_over_time refuse grouping even when unwrapped.
+_GROUPABLE_AGGREGATIONS = _UNWRAPPED_AGGREGATIONS - {"rate_counter", "sum_over_time"}
+_VECTOR_AGGREGATIONS = {
+    "sum", "avg", "min", "max", "stddev", "stdvar", "count", "topk", "bottomk", "sort", "sort_desc",
+}
+# Binary operators by precedence (lowest first); ^ is right-associative.
+_BINARY_PRECEDENCE = {
+    "or": 1, "and": 2, "unless": 2,
+    "==": 3, "!=": 3, ">": 3, ">=": 3, "<": 3, "<=": 3,
+    "+": 4, "-": 4, "*": 5, "/": 5, "%": 5, "^": 6,
+}
+_LINE_FILTER_OPS = ("|=", "!=", "|~", "!~", "|>", "!>")
+_LABEL_FILTER_OPS = ("=", "!=", "=~", "!~", "==", ">", ">=", "<", "<=")
+# Python-only regex syntax that RE2 (Loki) rejects: lookaround, backreferences,
+# atomic groups, conditionals, comments, possessive quantifiers and \Z.
+_NON_RE2_RE = re.compile(r"\(\?<?[=!]|\(\?[>(#]|\(\?P=|\\[1-9]|\\Z|[*+?}]\+")
+# Inline flag groups, (?flags) and (?flags:...); RE2 only knows the flags i, m, s and U.
+_REGEX_FLAGS_RE = re.compile(r"\(\?([A-Za-z-]*)[:)]")
+_RE2_FLAGS = frozenset("imsU-")
+# Loki's prettifier keeps expressions up to this many characters on one line.
+_LOGQL_LINE_WIDTH = 100
+
+
+def _go_unquote(text: str) -> str:
+    """Decode a LogQL (Go) string literal: "..." with escapes, or `raw`."""
+    if text[0] == "`":
+        return text[1:-1]
+    body = text[1:-1]
+    if "\\" not in body:
+        return body
+    out: list[str] = []
+    i = 0
+    while i < len(body):
+        ch = body[i]
+        if ch != "\\":
+            out.append(ch)
+            i += 1
+            continue
+        esc = body[i + 1]
+        if esc in _GO_ESCAPES:
+            out.append(_GO_ESCAPES[esc])
+            i += 2
+        elif esc in "xuU":
+            width = {"x": 2, "u": 4, "U": 8}[esc]
+            digits = body[i + 2 : i + 2 + width]
+            if len(digits) != width or not all(c in "0123456789abcdefABCDEF" for c in digits):
+                raise LogQLError(f"invalid escape \\{esc}{digits} in string {text}")
+            out.append(chr(int(digits, 16)))
+            i += 2 + width
+        elif esc in "01234567" and len(body) >= i + 4 and all(c in "01234567" for c in body[i + 1 : i + 4]):
+            out.append(chr(int(body[i + 1 : i + 4], 8)))
+            i += 4
+        else:
+            raise LogQLError(f"invalid escape \\{esc} in string {text}")
+    return "".join(out)
+
+
+def _check_regex(value: str) -> str:
+    """Return value if it is a regex both Python and RE2 accept; raise LogQLError otherwise.
+
+    Python and RE2 syntax differ, so this is conservative: a regex it rejects
+    may still be valid for Loki, which then gets the final say.
+    """
+    if _NON_RE2_RE.search(value) or any(set(f) - _RE2_FLAGS for f in _REGEX_FLAGS_RE.findall(value)):
+        raise LogQLError(f"regex {value!r} uses syntax RE2 does not support")
+    try:
+        re.compile(value)
+    except (re.error, OverflowError, RecursionError) as e:
+        raise LogQLError(f"invalid regex {value!r}: {e}") from None
+    return value
+
+
+def _tokenize_logql(query: str) -> list[tuple[str, str, int]]:
+    """Split a query into (kind, value, position) tokens, ending with an "eof" token."""
+    tokens: list[tuple[str, str, int]] = []
+    pos = 0
+    while pos < len(query):
+        m = _LOGQL_TOKEN_RE.match(query, pos)
+        if not m:
+            raise LogQLError(f"unexpected character {query[pos]!r} at position {pos}")
+        kind = m.lastgroup or ""
+        text = m.group()
+        if kind == "string":
+            tokens.append(("string", _go_unquote(text), pos))
+        elif kind == "number":
+            if _LOGQL_NUMBER_RE.fullmatch(text):
+                tokens.append(("number", text, pos))
+            elif _LOGQL_DURATION_RE.fullmatch(text):
+                tokens.append(("duration", text, pos))
+            elif _LOGQL_BYTES_RE.fullmatch(text):
+                tokens.append(("bytes", text, pos))
+            else:
+                raise LogQLError(f"invalid number, duration or size {text!r} at position {pos}")
+        elif kind == "op":
+            tokens.append((text, text, pos))
+        elif kind != "ws":
+            tokens.append((kind, text, pos))
+        pos = m.end()
+    tokens.append(("eof", "", len(query)))
+    return tokens
+
+
+class _LogQLParser:
+    """Recursive-descent parser producing a tuple AST (see _format_logql for node shapes)."""
+
+    def __init__(self, query: str) -> None:
+        self.tokens = _tokenize_logql(query)
+        self.i = 0
+
+    # -- token helpers -------------------------------------------------------
+
+    def peek(self, offset: int = 0) -> tuple[str, str, int]:
+        return self.tokens[min(self.i + offset, len(self.tokens) - 1)]
+
+    def advance(self) -> tuple[str, str, int]:
+        token = self.tokens[self.i]
+        self.i += 1
+        return token
+
+    def at(self, kind: str, value: str | None = None, offset: int = 0) -> bool:
+        token = self.peek(offset)
+        return token[0] == kind and (value is None or token[1] == value)
+
+    def accept(self, kind: str, value: str | None = None) -> tuple[str, str, int] | None:
+        return self.advance() if self.at(kind, value) else None
+
+    def expect(self, kind: str, what: str, value: str | None = None) -> str:
+        token = self.peek()
+        if not self.at(kind, value):
+            found = f"{token[1]!r}" if token[0] != "eof" else "end of query"
+            raise LogQLError(f"expected {what} at position {token[2]}, found {found}")
+        return self.advance()[1]
+
+    # -- entry point ---------------------------------------------------------
+
+    def parse(self) -> tuple:
+        node = self.log_query() if self.at("{") else self.metric_expr(0)
+        self.expect("eof", "end of query")
+        return node
+
+    # -- log queries ---------------------------------------------------------
+
+    def log_query(self) -> tuple:
+        return ("log", self.selector(), self.pipeline())
+
+    def selector(self) -> list[tuple[str, str, str]]:
+        self.expect("{", "'{'")
+        matchers: list[tuple[str, str, str]] = []
+        while not self.at("}"):
+            name = self.expect("ident", "label name")
+            op = self.peek()[0]
+            if op not in ("=", "!=", "=~", "!~"):
+                raise LogQLError(f"expected label matcher operator after {name!r} at position {self.peek()[2]}")
+            self.advance()
+            value = self.expect("string", "quoted label value")
+            matchers.append((name, op, _check_regex(value) if op in ("=~", "!~") else value))
+            if not self.accept(","):
+                break
+        self.expect("}", "'}' or ','")
+        if not any(_matcher_selects(op, value) for _name, op, value in matchers):
+            raise LogQLError(
+                "queries require at least one regexp or equality matcher that does not have an "
+                'empty-compatible value. For instance, app=~".*" does not meet this requirement, '
+                'but app=~".+" will'
+            )
+        return matchers
+
+    def pipeline(self) -> list[tuple]:
+        stages: list[tuple] = []
+        while True:
+            kind = self.peek()[0]
+            if kind in _LINE_FILTER_OPS:
+                self.advance()
+                terms = [self.line_filter_term()]
+                while self.accept("ident", "or"):
+                    terms.append(self.line_filter_term())
+                if kind in ("|~", "!~"):
+                    for term_kind, value in terms:
+                        if term_kind == "str":
+                            _check_regex(value)
+                stages.append(("line", kind, terms))
+            elif kind == "|":
+                self.advance()
+                stages.append(self.stage())
+            else:
+                return stages
+
+    def line_filter_term(self) -> tuple[str, str]:
+        if self.accept("ident", "ip"):
+            self.expect("(", "'('")
+            value = self.expect("string", "quoted IP or CIDR")
+            self.expect(")", "')'")
+            return ("ip", value)
+        return ("str", self.expect("string", "quoted line filter"))
+
+    def stage(self) -> tuple:
+        if not self.at("ident"):
+            return ("filter", self.label_filter_or())
+        name = self.peek()[1]
+        if name in ("json", "logfmt"):
+            self.advance()
+            flags = []
+            while self.at("flag"):
+                flags.append(self.advance()[1])
+            params: list[tuple[str, str | None]] = []
+            while self.at("ident") and not self.at("ident", "or") and not self.at("ident", "and"):
+                label = self.advance()[1]
+                params.append((label, self.expect("string", "quoted expression") if self.accept("=") else None))
+                if not self.accept(","):
+                    break
+            return ("parser", name, flags, params)
+        if name in ("regexp", "pattern", "line_format"):
+            self.advance()
+            value = self.expect("string", f"quoted {name} expression")
+            return (name, _check_regex(value) if name == "regexp" else value)
+        if name in ("unpack", "decolorize"):
+            self.advance()
+            return ("bare", name)
+        if name == "label_format":
+            self.advance()
+            renames: list[tuple[str, str, str]] = []
+            while True:
+                dst = self.expect("ident", "label name")
+                self.expect("=", "'='")
+                if self.at("string"):
+                    renames.append((dst, "str", self.advance()[1]))
+                else:
+                    renames.append((dst, "ident", self.expect("ident", "label name or quoted template")))
+                if not self.accept(","):
+                    return ("label_format", renames)
+        if name in ("drop", "keep"):
+            self.advance()
+            labels: list[tuple[str, str | None, str | None]] = []
+            while True:
+                label = self.expect("ident", "label name")
+                op = self.peek()[0]
+                if op in ("=", "!=", "=~", "!~"):
+                    self.advance()
+                    value = self.expect("string", "quoted label value")
+                    labels.append((label, op, _check_regex(value) if op in ("=~", "!~") else value))
+                else:
+                    labels.append((label, None, None))
+                if not self.accept(","):
+                    return (name, labels)
+        if name == "unwrap":
+            self.advance()
+            conversions = ("bytes", "duration", "duration_seconds")
+            if self.at("ident") and self.peek()[1] in conversions and self.at("(", offset=1):
+                conv = self.advance()[1]
+                self.advance()
+                label = self.expect("ident", "label name")
+                self.expect(")", "')'")
+                return ("unwrap", conv, label)
+            return ("unwrap", None, self.expect("ident", "label name"))
+        return ("filter", self.label_filter_or())
+
+    def label_filter_or(self) -> tuple:
+        left = self.label_filter_and()
+        while self.accept("ident", "or"):
+            left = ("or", left, self.label_filter_and())
+        return left
+
+    def label_filter_and(self) -> tuple:
+        left = self.label_filter_primary()
+        while self.accept("ident", "and") or self.accept(","):
+            left = ("and", left, self.label_filter_primary())
+        return left
+
+    def label_filter_primary(self) -> tuple:
+        if self.accept("("):
+            inner = self.label_filter_or()
+            self.expect(")", "')'")
+            return ("paren", inner)
+        label = self.expect("ident", "label filter")
+        op = self.peek()[0]
+        if op not in _LABEL_FILTER_OPS:
+            raise LogQLError(f"expected comparison operator after {label!r} at position {self.peek()[2]}")
+        self.advance()
+        if self.at("string"):
+            value = self.advance()[1]
+            return ("cmp", label, op, ("str", _check_regex(value) if op in ("=~", "!~") else value))
+        if self.accept("ident", "ip"):
+            self.expect("(", "'('")
+            value = self.expect("string", "quoted IP or CIDR")
+            self.expect(")", "')'")
+            return ("cmp", label, op, ("ip", value))
+        sign = "-" if self.accept("-") else ""
+        if self.peek()[0] in ("number", "duration", "bytes"):
+            if op in ("=~", "!~"):
+                raise LogQLError(f"regex operator {op} needs a quoted value at position {self.peek()[2]}")
+            return ("cmp", label, op, ("num", sign + self.advance()[1]))
+        raise LogQLError(f"expected value after {label}{op} at position {self.peek()[2]}")
+
+    # -- metric queries ------------------------------------------------------
+
+    def metric_expr(self, min_precedence: int) -> tuple:
+        left = self.metric_unary()
+        while True:
+            token = self.peek()
+            op = token[1] if token[0] in ("ident", *_BINARY_PRECEDENCE) else ""
+            precedence = _BINARY_PRECEDENCE.get(op, 0)
+            if token[0] == "ident" and op not in ("or", "and", "unless"):
+                precedence = 0
+            if not precedence or precedence < min_precedence:
+                return left
+            self.advance()
+            modifiers = self.binary_modifiers()
+            right = self.metric_expr(precedence if op == "^" else precedence + 1)
+            left = ("binary", op, modifiers, left, right)
+
+    def binary_modifiers(self) -> str:
+        parts = []
+        if self.accept("ident", "bool"):
+            parts.append("bool")
+        for keywords in (("on", "ignoring"), ("group_left", "group_right")):
+            if self.at("ident") and self.peek()[1] in keywords:
+                keyword = self.advance()[1]
+                labels = self.label_list() if self.at("(") else None
+                parts.append(keyword if labels is None else f"{keyword} ({', '.join(labels)})")
+        return " ".join(parts)
+
+    def label_list(self) -> list[str]:
+        self.expect("(", "'('")
+        labels = []
+        while not self.at(")"):
+            labels.append(self.expect("ident", "label name"))
+            if not self.accept(","):
+                break
+        self.expect(")", "')'")
+        return labels
+
+    def grouping(self) -> tuple[str, list[str]] | None:
+        if self.at("ident") and self.peek()[1] in ("by", "without"):
+            return (self.advance()[1], self.label_list())
+        return None
+
+    def metric_unary(self) -> tuple:
+        if self.at("-") or self.at("+"):
+            sign = self.advance()[1]
+            if self.at("number"):
+                return ("num", ("-" if sign == "-" else "") + self.advance()[1])
+            raise LogQLError(f"unary {sign} is only supported on numbers (position {self.peek()[2]})")
+        if self.at("number"):
+            return ("num", self.advance()[1])
+        if self.accept("("):
+            inner = self.metric_expr(0)
+            self.expect(")", "')'")
+            return ("paren", inner)
+        if self.at("{"):
+            raise LogQLError(
+                f"log query at position {self.peek()[2]} must be wrapped in a range aggregation "
+                "such as rate(... [5m]) to be used in a metric query"
+            )
+        name = self.expect("ident", "metric expression")
+        if name in _RANGE_AGGREGATIONS:
+            return self.range_aggregation(name)
+        if name in _VECTOR_AGGREGATIONS:
+            return self.vector_aggregation(name)
+        if name == "vector":
+            self.expect("(", "'('")
+            value = self.expect("number", "number")
+            self.expect(")", "')'")
+            return ("call", "vector", [("num", value)])
+        if name == "label_replace":
+            self.expect("(", "'('")
+            args: list[tuple] = [self.metric_expr(0)]
+            for _ in range(4):
+                self.expect(",", "','")
+                args.append(("str", self.expect("string", "quoted argument")))
+            self.expect(")", "')'")
+            _check_regex(args[4][1])
+            return ("call", "label_replace", args)
+        raise LogQLError(f"unknown function {name!r}")
+
+    def range_aggregation(self, name: str) -> tuple:
+        self.expect("(", "'('")
+        param = None
+        if name == "quantile_over_time":
+            param = self.expect("number", "quantile")
+            self.expect(",", "','")
+        log = self.log_query()
+        self.expect("[", "'[' range")
+        window = self.expect("duration", "range duration")
+        self.expect("]", "']'")
+        offset = self.expect("duration", "offset duration") if self.accept("ident", "offset") else None
+        self.expect(")", "')'")
+        unwrapped = any(stage[0] == "unwrap" for stage in log[2])
+        if unwrapped != (name in _UNWRAPPED_AGGREGATIONS):
+            raise LogQLError(
+                f"{name} {'requires' if name in _UNWRAPPED_AGGREGATIONS else 'does not allow'} an unwrap stage"
+            )
+        grouping = self.grouping()
+        if grouping is not None and name not in _GROUPABLE_AGGREGATIONS:
+            raise LogQLError(f"grouping not allowed for {name} aggregation")
+        return ("range", name, param, log, window, offset, grouping)
+
+    def vector_aggregation(self, name: str) -> tuple:
+        grouping = self.grouping()
+        self.expect("(", "'('")
+        param = None
+        if name in ("topk", "bottomk"):
+            param = self.expect("number", f"{name} parameter")
+            self.expect(",", "','")
+        inner = self.metric_expr(0)
+        self.expect(")", "')'")
+        return ("vector", name, param, inner, grouping or self.grouping())
+
+
+def _matcher_selects(op: str, value: str) -> bool:
+    """Whether a selector matcher rules out the empty value (Loki requires at least one)."""
+    if op == "=":
+        return value != ""
+    if op == "=~":
+        try:
+            return re.fullmatch(value, "") is None
+        except re.error:
+            raise LogQLError(f"unsupported or invalid regex {value!r}") from None
+    return False
+
+
+def _parse_logql(query: str) -> tuple:
+    """Parse a LogQL query into a tuple AST; raises LogQLError (fall back to Loki)."""
+    return _LogQLParser(query).parse()
+
+
+def _format_logql_locally(query: str) -> str | None:
+    """The formatted query if the local parser accepts it and Loki would print it on one line.
+
+    None means ask Loki's format_query: the query is invalid, uses something
+    the parser does not cover, or is long enough for Loki's multi-line layout.
+    """
+    try:
+        formatted = _format_logql(_parse_logql(query))
+    except (LogQLError, RecursionError):
+        return None
+    return formatted if len(formatted) <= _LOGQL_LINE_WIDTH else None
+
+
+def _format_logql(node: tuple, canonical: bool = False) -> str:
+    """Render a LogQL AST as a single-line query.
+
+    canonical=True also sorts selector matchers and grouping labels, so
+    equivalent queries render identically (for cache and coalescing keys).
+    """
+    kind = node[0]
+    q = _logql_string
+    if kind == "log":
+        matchers = sorted(node[1]) if canonical else node[1]
+        text = "{" + ", ".join(f"{name}{op}{q(value)}" for name, op, value in matchers) + "}"
+        return " ".join([text, *(_format_stage(stage) for stage in node[2])])
+    if kind == "range":
+        _kind, name, param, log, window, offset, grouping = node
+        inner = _format_logql(log, canonical) + f" [{window}]" + (f" offset {offset}" if offset else "")
+        text = f"{name}({param + ', ' if param else ''}{inner})"
+        return text + _format_grouping(grouping, canonical)
+    if kind == "vector":
+        _kind, name, param, inner, grouping = node
+        head = name + _format_grouping(grouping, canonical)
+        return f"{head} ({param + ', ' if param else ''}{_format_logql(inner, canonical)})"
+    if kind == "binary":
+        _kind, op, modifiers, left, right = node
+        middle = f" {op} {modifiers} " if modifiers else f" {op} "
+        return _format_logql(left, canonical) + middle + _format_logql(right, canonical)
+    if kind == "paren":
+        return f"({_format_logql(node[1], canonical)})"
+    if kind == "num":
+        return node[1]
+    if kind == "str":
+        return q(node[1])
+    if kind == "call":
+        return f"{node[1]}({', '.join(_format_logql(arg, canonical) for arg in node[2])})"
+    raise LogQLError(f"cannot format node {kind!r}")
+
+
+def _format_grouping(grouping: tuple[str, list[str]] | None, canonical: bool) -> str:
+    if grouping is None:
+        return ""
+    labels = sorted(grouping[1]) if canonical else grouping[1]
+    return f" {grouping[0]} ({', '.join(labels)})"
+
+
+def _format_stage(stage: tuple) -> str:
+    kind = stage[0]
+    q = _logql_string
+    if kind == "line":
+        terms = [f"ip({q(v)})" if t == "ip" else q(v) for t, v in stage[2]]
+        return f"{stage[1]} " + " or ".join(terms)
+    if kind == "parser":
+        _kind, name, flags, params = stage
+        args = [f"{label}={q(expr)}" if expr is not None else label for label, expr in params]
+        return "| " + " ".join([name, *flags]) + (" " + ", ".join(args) if args else "")
+    if kind in ("regexp", "pattern", "line_format"):
+        return f"| {kind} {q(stage[1])}"
+    if kind == "bare":
+        return f"| {stage[1]}"
+    if kind == "label_format":
+        return "| label_format " + ", ".join(
+            f"{dst}={q(value) if how == 'str' else value}" for dst, how, value in stage[1]
+        )
+    if kind in ("drop", "keep"):
+        return f"| {kind} " + ", ".join(
+            label if op is None else f"{label}{op}{q(value or '')}" for label, op, value in stage[1]
+        )
+    if kind == "unwrap":
+        return f"| unwrap {stage[1]}({stage[2]})" if stage[1] else f"| unwrap {stage[2]}"
+    if kind == "filter":
+        return "| " + _format_label_filter(stage[1])
+    raise LogQLError(f"cannot format stage {kind!r}")
+
+
+def _format_label_filter(expr: tuple) -> str:
+    kind = expr[0]
+    if kind in ("and", "or"):
+        return f"{_format_label_filter(expr[1])} {kind} {_format_label_filter(expr[2])}"
+    if kind == "paren":
+        return f"({_format_label_filter(expr[1])})"
+    _kind, label, op, (value_kind, value) = expr
+    rendered = {"str": _logql_string(value), "ip": f"ip({_logql_string(value)})"}.get(value_kind, value)
+    return f"{label}{op}{rendered}"
+
+
+@functools.lru_cache(maxsize=1024)
+def _canonical_logql(query: str) -> str:
+    """Canonical form of a query for cache/coalescing keys (the query itself if it does not parse)."""
+    try:
+        return _format_logql(_parse_logql(query), canonical=True)
+    except (LogQLError, RecursionError):
+        return query
+
+
+# ---------------------------------------------------------------------------
+# Filter pushdown
+# ---------------------------------------------------------------------------
+
+_LABEL_NAMES_TTL = 300.0
+_LABEL_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+async def _stream_label_names(client: LokiClient) -> set[str]:
+    """Index (stream) label names for the current tenant, cached for _LABEL_NAMES_TTL."""
+    tenant = _current_tenant.get() or LOKI_ORG_ID
+    cached = client.label_names.get(tenant)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    resp = await client.request("GET", "/loki/api/v1/labels")
+    if not resp.is_success:
+        return set()
+    names = _unwrap_loki_response(resp)
+    label_names = {n for n in names if isinstance(n, str)} if isinstance(names, list) else set()
+    client.label_names[tenant] = (time.monotonic() + _LABEL_NAMES_TTL, label_names)
+    return label_names
 
-    Distinguishes between Loki API errors (4xx/5xx with JSON body) and
-    connection/transport errors. Returns a formatted error string instead
-    of raising, so the LLM gets actionable feedback instead of a traceback.
+
+async def _severity_source(client: LokiClient, selector: str) -> str:
+    """How severity can be filtered for these streams: 'detected_level', 'line' or '' (unknown).
+
+    detected_level is known to work when it is an index label. Otherwise it is
+    usually structured metadata, which /labels does not list, so the answer
+    learned by an earlier search of the same selector is used (cached for
+    _LABEL_NAMES_TTL).
     """
-    if resp.is_success:
-        return None
+    if "detected_level" in await _stream_label_names(client):
+        return "detected_level"
+    cached = client.level_sources.get((_current_tenant.get() or LOKI_ORG_ID, selector))
+    return cached[1] if cached and cached[0] > time.monotonic() else ""
 
-    # Try to extract Loki's error message from JSON body
-    detail = ""
-    try:
-        body = resp.json()
-        detail = body.get("message", body.get("error", ""))
-    except Exception:
-        detail = resp.text[:500] if resp.text else ""
 
-    error_data = {
-        "error": True,
-        "tool": tool_name,
-        "status_code": resp.status_code,
-        "message": detail or f"HTTP {resp.status_code} {resp.reason_phrase}",
+def _remember_severity_source(client: LokiClient, selector: str, source: str) -> None:
+    tenant = _current_tenant.get() or LOKI_ORG_ID
+    client.level_sources[(tenant, selector)] = (time.monotonic() + _LABEL_NAMES_TTL, source)
+
+
+async def _push_down_filters(
+    client: LokiClient, query: str, filter_query: dict | None
+) -> tuple[str, dict | None, dict]:
+    """Move filter_query filters on stream labels into a log query's selector.
+
+    Only log queries are rewritten (metric queries may aggregate the label
+    away) and only keys Loki lists as index labels whose filters all map to
+    selector matchers (=, !=, =~, !~, in) are pushed; numeric comparisons
+    stay client-side. Returns (query, remaining client-side filters, pushed
+    filters).
+    """
+    if not filter_query or not _is_log_query(query):
+        return query, filter_query, {}
+    selector = _extract_selector(query)
+    if not selector:
+        return query, filter_query, {}
+    candidates = {
+        k: matchers for k, v in filter_query.items()
+        if _LABEL_NAME_RE.match(str(k)) and (matchers := _selector_matchers(str(k), v))
     }
+    if not candidates:
+        return query, filter_query, {}
+    try:
+        label_names = await _stream_label_names(client)
+    except (httpx.HTTPError, RuntimeError):
+        return query, filter_query, {}
+    pushed = {k: filter_query[k] for k in candidates if k in label_names}
+    if not pushed:
+        return query, filter_query, {}
+    query = _narrow_selector(query, selector, [m for k in pushed for m in candidates[k]])
+    remaining = {k: v for k, v in filter_query.items() if k not in pushed}
+    return query, remaining or None, pushed
+
+
+def _selector_matchers(key: str, spec: Any) -> list[str]:
+    """LogQL matchers equivalent to one filter_query entry, or [] if it cannot be pushed."""
+    ops = spec.items() if isinstance(spec, dict) else [("=", spec)]
+    matchers = []
+    for op, operand in ops:
+        if op in ("=", "!=") and isinstance(operand, (str, int, float)) and not isinstance(operand, bool):
+            matchers.append(f"{key}{op}{_logql_string(str(operand))}")
+        elif op in ("=~", "!~") and isinstance(operand, str) and not _NON_RE2_RE.search(operand):
+            matchers.append(f"{key}{op}{_logql_string(operand)}")
+        elif op == "in" and isinstance(operand, (list, tuple)) and operand:
+            matchers.append(f"{key}=~{_logql_string('|'.join(_regex_escape(str(v)) for v in operand))}")
+        else:
+            return []
+    return matchers
 
-    if resp.status_code == 400:
-        error_data["hint"] = "Bad request — check query syntax and parameter values."
-    elif resp.status_code == 404:
-        error_data["hint"] = "Not found — the resource or endpoint does not exist."
-    elif resp.status_code == 422:
-        error_data["hint"] = "Unprocessable — the request was well-formed but semantically invalid."
-    elif resp.status_code == 429:
-        error_data["hint"] = "Rate limited — wait and retry."
-    elif resp.status_code >= 500:
-        error_data["hint"] = "Loki server error — the instance may be overloaded or misconfigured."
 
-    return _format_response(error_data, f"Error from {tool_name}: HTTP {resp.status_code}")
+# ---------------------------------------------------------------------------
+# Line field projection
+# ---------------------------------------------------------------------------
 
+# Separates projected field values in line_format output (ASCII unit separator).
+_FIELD_SEP = "\x1f"
+_LOGFMT_PAIR_RE = re.compile(r'([^\s="]+)=(?:"((?:[^"\\]|\\.)*)"|(\S*))')
 
-def _filter_results(
-    data: Any,
-    fields: str = "",
-    query: dict | None = None,
-    filter_path: str | None = None,
-    filter_label_key: str | None = None,
-) -> Any:
-    """Apply client-side filtering to list results.
 
-    Args:
-        data: The unwrapped API response data.
-        fields: Comma-separated field names to keep (empty = all).
-        query: Dict of key-value pairs; only items where all pairs match are kept.
-        filter_path: Dot path to the list within data (e.g. "result"). None = data is the list.
-        filter_label_key: If items are Loki-style {stream: {labels}, values: [...]},
-                          this is the key holding the label dict (e.g. "stream", "metric").
-                          None = items are flat dicts.
+def _line_fields_pipeline(fields: list[str], parser: str) -> str:
+    """LogQL stages that reduce each line to the requested fields.
+
+    Fields are extracted under temporary labels, joined into the line with
+    _FIELD_SEP by line_format, and the labels dropped again so they do not
+    split the result into one stream per value.
     """
-    if not fields and not query:
-        return data
+    names = [f"mcp_field_{i}" for i in range(len(fields))]
+    extract = ", ".join(f"{name}={_logql_string(field)}" for name, field in zip(names, fields))
+    template = _FIELD_SEP.join("{" + "{." + name + "}" + "}" for name in names)
+    return (
+        f" | {parser} {extract} | line_format {_logql_string(template)}"
+        f" | drop {', '.join(names)}, __error__, __error_details__"
+    )
 
-    # Extract the list to filter
-    items = data
-    if filter_path and isinstance(data, dict):
-        items = data.get(filter_path, data)
 
-    if not isinstance(items, list):
-        return data
+def _parse_line(line: str, parser: str) -> dict | None:
+    """Parse a JSON or logfmt log line into a dict (None if it is neither)."""
+    if parser in ("json", "auto") and line.lstrip().startswith("{"):
+        try:
+            parsed = _json_loads(line)
+        except ValueError:
+            parsed = None
+        if isinstance(parsed, dict):
+            return parsed
+    if parser in ("logfmt", "auto"):
+        pairs = {
+            m.group(1): m.group(2).replace('\\"', '"') if m.group(2) is not None else m.group(3)
+            for m in _LOGFMT_PAIR_RE.finditer(line)
+        }
+        if pairs:
+            return pairs
+    return None
+
+
+def _field_value(parsed: dict, field: str) -> str:
+    """Look up a (dotted) field the way Loki's parsers render it: as a string, "" if missing."""
+    if field in parsed:
+        value = parsed[field]
+    else:
+        value = parsed
+        for part in field.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+    if value is None:
+        return ""
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
 
-    field_set = {f.strip() for f in fields.split(",") if f.strip()} if fields else set()
 
-    filtered = []
-    for item in items:
-        # Get the dict to match/filter against
-        if filter_label_key and isinstance(item, dict):
-            labels = item.get(filter_label_key, {})
-        elif isinstance(item, dict):
-            labels = item
-        else:
-            # Non-dict items (strings, etc.) can't be filtered
-            filtered.append(item)
-            continue
+async def _sniff_line_format(client: LokiClient, params: dict[str, str]) -> str:
+    """Guess a query's line format from one sample line: 'json', 'logfmt' or ''."""
+    try:
+        resp = await client.request("GET", "/loki/api/v1/query_range", params={**params, "limit": "1"})
+    except httpx.HTTPError:
+        return ""
+    if not resp.is_success:
+        return ""
+    result = _unwrap_loki_response(resp)
+    for stream in result.get("result", []) if isinstance(result, dict) else []:
+        for entry in stream.get("values", []):
+            line = entry[1] if len(entry) > 1 else ""
+            if line.lstrip().startswith("{") and _parse_line(line, "json") is not None:
+                return "json"
+            if _parse_line(line, "logfmt") is not None:
+                return "logfmt"
+            return ""
+    return ""
+
+
+async def _with_line_fields(
+    client: LokiClient,
+    params: dict[str, str],
+    line_fields: str,
+    line_parser: str,
+    run: Any,
+) -> tuple[Any, str | None]:
+    """Run a log query, projecting each line down to line_fields.
+
+    With a known parser (given, or sniffed for 'auto') the projection is
+    pushed into the query so Loki only returns the requested fields. If the
+    format is unknown, or Loki rejects the projection stages as a bad request
+    (HTTP 400), full lines are fetched and parsed client-side. Any other
+    error is returned as-is: retrying without the stages would only double
+    the load on an overloaded Loki. Either way each entry's line becomes a
+    {field: value} dict. run() executes the query with params["query"].
+    """
+    fields = [f.strip() for f in line_fields.split(",") if f.strip()]
+    if not fields:
+        return await run()
+    parser = line_parser.lower() or "auto"
+    if parser not in ("auto", "json", "logfmt"):
+        return None, _format_response(
+            {"error": f"Unknown line_parser {line_parser!r}; use 'json', 'logfmt' or 'auto'."}
+        )
+    if not _is_log_query(params["query"]):
+        return None, _format_response({"error": "line_fields only applies to log queries."})
+
+    if parser == "auto":
+        parser = await _sniff_line_format(client, params) or "auto"
+    projection: dict[str, Any] = {"fields": fields, "parser": parser, "mode": "server"}
+    original = params["query"]
+    if parser != "auto":
+        params["query"] = original + _line_fields_pipeline(fields, parser)
+        result, err = await run()
+        params["query"] = original
+        if not err and isinstance(result, dict):
+            for stream in result.get("result", []):
+                for entry in stream.get("values", []):
+                    entry[1] = dict(zip(fields, entry[1].split(_FIELD_SEP)))
+            result["line_fields"] = projection
+            return result, None
+        if err and _error_status(err) != 400:
+            return None, err
+        projection["fallback_reason"] = _error_message(err) if err else "unexpected result"
+
+    result, err = await run()
+    if err:
+        return None, err
+    projection["mode"] = "client"
+    if isinstance(result, dict):
+        for stream in result.get("result", []):
+            for entry in stream.get("values", []):
+                parsed = _parse_line(entry[1], parser) if isinstance(entry[1], str) else None
+                if parsed is not None:
+                    entry[1] = {field: _field_value(parsed, field) for field in fields}
+        result["line_fields"] = projection
+    return result, None
 
-        # Apply query filter
-        if query:
-            if not all(str(labels.get(k, "")) == str(v) for k, v in query.items()):
-                continue
 
-        # Apply field projection
-        if field_set and filter_label_key and isinstance(item, dict):
-            projected_labels = {k: v for k, v in labels.items() if k in field_set}
-            item = {**item, filter_label_key: projected_labels}
-        elif field_set and isinstance(item, dict) and not filter_label_key:
-            item = {k: v for k, v in item.items() if k in field_set}
+# ---------------------------------------------------------------------------
+# Profiling hooks
+# ---------------------------------------------------------------------------
 
-        filtered.append(item)
+_profile_active = False
+_profile_count = 0
+_profile_summaries: deque[dict] = deque(maxlen=20)
 
-    if filter_path and isinstance(data, dict):
-        return {**data, filter_path: filtered}
-    return filtered
+
+def _should_profile(tool_name: str) -> bool:
+    """Decide whether this call of tool_name gets profiled (LOKI_MCP_PROFILE + sampling)."""
+    if not _profiled_tools or _profile_active:
+        return False
+    if tool_name not in _profiled_tools and not _profiled_tools & {"all", "*"}:
+        return False
+    return LOKI_MCP_PROFILE_RATE >= 1.0 or random.random() < LOKI_MCP_PROFILE_RATE
+
+
+def _write_profile(
+    tool_name: str,
+    seq: int,
+    elapsed: float,
+    profiler: cProfile.Profile | None,
+    snapshot: tracemalloc.Snapshot | None,
+    peak_bytes: int,
+) -> dict:
+    """Dump one profiled call to LOKI_MCP_PROFILE_DIR and build its summary.
+
+    Runs in a worker thread: pstats sorting and snapshot statistics are too
+    slow to do on the event loop.
+    """
+    stem = os.path.join(LOKI_MCP_PROFILE_DIR, f"{tool_name}-{int(time.time() * 1000)}-{seq}")
+    summary: dict[str, Any] = {"tool": tool_name, "elapsed_ms": round(elapsed * 1000, 2), "dumps": []}
+    os.makedirs(LOKI_MCP_PROFILE_DIR, exist_ok=True)
+
+    if profiler is not None:
+        profiler.dump_stats(f"{stem}.prof")
+        summary["dumps"].append(f"{stem}.prof")
+        stats = pstats.Stats(profiler).stats  # type: ignore[attr-defined]
+        ranked = sorted(stats.items(), key=lambda kv: kv[1][2], reverse=True)
+        summary["top_functions"] = [
+            {
+                "function": f"{os.path.basename(filename)}:{line}({name})",
+                "calls": nc,
+                "tottime_ms": round(tt * 1000, 3),
+                "cumtime_ms": round(ct * 1000, 3),
+            }
+            for (filename, line, name), (_cc, nc, tt, ct, _callers) in ranked[:LOKI_MCP_PROFILE_TOP]
+        ]
+
+    if snapshot is not None:
+        snapshot.dump(f"{stem}.tracemalloc")
+        summary["dumps"].append(f"{stem}.tracemalloc")
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        summary["peak_kb"] = round(peak_bytes / 1024, 1)
+        summary["top_allocations"] = [
+            {
+                "site": f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                "size_kb": round(stat.size / 1024, 1),
+                "count": stat.count,
+            }
+            for stat in snapshot.statistics("lineno")[:LOKI_MCP_PROFILE_TOP]
+        ]
+    return summary
+
+
+async def _profiled_call(tool_name: str, fn: Any, args: tuple, kwargs: dict) -> Any:
+    """Run one tool call under cProfile and/or tracemalloc.
+
+    Both profilers are process-wide, so anything else running on the event
+    loop during the call is captured too. Only one call is profiled at a time.
+    """
+    global _profile_active, _profile_count
+    _profile_active = True
+    profiler = cProfile.Profile() if "cprofile" in _profile_modes else None
+    trace = "tracemalloc" in _profile_modes and not tracemalloc.is_tracing()
+    snapshot = None
+    peak = 0
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        return await fn(*args, **kwargs)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        elapsed = time.perf_counter() - started
+        if trace:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        _profile_active = False
+        _profile_count += 1
+        try:
+            summary = await asyncio.to_thread(
+                _write_profile, tool_name, _profile_count, elapsed, profiler, snapshot, peak
+            )
+            _profile_summaries.append(summary)
+            print(f"[loki-mcp profile] {json.dumps(summary, default=str)}", file=sys.stderr)
+        except OSError as e:
+            print(f"[loki-mcp profile] failed to write profile for {tool_name}: {e}", file=sys.stderr)
+
+
+def _instrument(fn: Any) -> Any:
+    """Wrap a tool function with the per-call hooks (tool context, deadline, profiling)."""
+
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        token = _current_tool.set(fn.__name__)
+        deadline = time.monotonic() + LOKI_TOOL_TIMEOUT
+        outer = _current_deadline.get()
+        deadline_token = _current_deadline.set(deadline if outer is None else min(outer, deadline))
+        try:
+            if _should_profile(fn.__name__):
+                return await _profiled_call(fn.__name__, fn, args, kwargs)
+            return await fn(*args, **kwargs)
+        finally:
+            _current_deadline.reset(deadline_token)
+            _current_tool.reset(token)
+
+    return wrapper
 
 
 # ---------------------------------------------------------------------------
@@ -344,7 +3096,7 @@ def _filter_results(
 mcp = FastMCP(
     "Loki",
     instructions=(
-        "This server provides 42 tools for interacting with Grafana Loki. "
+        "This server provides 46 tools for interacting with Grafana Loki. "
         "Call loki_search_tools first to find the right tool by keyword before browsing "
         "the full tool list. Call loki_get_overview for system status. "
         "If a tool returns an unexpected error, call loki_report_issue to report it."
@@ -358,6 +3110,7 @@ mcp = FastMCP(
 # --- loki_query_instant (query) ---
 
 @mcp.tool()
+@_instrument
 async def loki_query_instant(
     query: str,
     time: str = "",
@@ -365,6 +3118,8 @@ async def loki_query_instant(
     direction: str = "backward",
     fields: str = "",
     filter_query: dict | None = None,
+    summarize: bool = False,
+    tenants: str = "",
 ) -> str:
     """Run an instant LogQL query at a single point in time. Returns log lines or metric vectors.
 
@@ -374,7 +3129,9 @@ async def loki_query_instant(
         limit: Maximum number of entries to return
         direction: Log ordering. Valid values: 'forward', 'backward'
         fields: Comma-separated field names to include in results (empty = all).
-        filter_query: Dict of key-value pairs to filter results (e.g. {"host": "doc1"}). Only matching items returned.
+        filter_query: Dict of filters; only matching items returned. A value means equality (e.g. {"host": "doc1"}); a dict applies operators =, !=, =~, !~, in, <, <=, >, >= (e.g. {"status": {">=": 500}}).
+        summarize: Metric queries only: return one row of statistics per series (points, min, max, mean, p50, p95, last value and trend, the least-squares change across the range) instead of raw values.
+        tenants: Comma-separated tenant IDs (X-Scope-OrgID) to query concurrently, or '*' for every tenant in LOKI_TENANTS. Results carry a __tenant_id__ label and per-tenant status. Default: LOKI_ORG_ID only.
 
     Known fields: __name__
 
@@ -383,6 +3140,10 @@ async def loki_query_instant(
     if not _module_enabled("query"):
         return _format_response({"error": "Module 'query' is not enabled. Set LOKI_MODULES to include it."})
 
+    try:
+        _compile_filter(filter_query)
+    except ValueError as e:
+        return _format_response({"error": f"Invalid filter_query: {e}"})
     client = await _get_client()
     params = {}
     params["query"] = query
@@ -392,30 +3153,43 @@ async def loki_query_instant(
         params["limit"] = str(limit)
     if direction:
         params["direction"] = direction
-    resp = await client.request(
-        "GET",
-        "/loki/api/v1/query",
-        params=params,
+    if summarize and _is_log_query(params["query"]):
+        return _format_response({"error": "summarize only applies to metric queries."})
+    result, err = await _for_backends(
+        lambda backend: _for_tenants(
+            tenants,
+            lambda: _run_get(backend, "loki_query_instant", "/loki/api/v1/query", params),
+            direction=direction,
+            limit=limit,
+        ),
+        direction=direction,
+        limit=limit,
     )
-    if err := _handle_error(resp, "loki_query_instant"):
+    if err:
         return err
-    result = _unwrap_loki_response(resp)
+    size = _result_bytes(result)
     if fields or filter_query:
-        result = _filter_results(
+        result = await _offload(
+            _filter_results,
             result,
+            size=size,
             fields=fields,
             query=filter_query,
             filter_path="result",
             filter_label_key="metric",
         )
+    if summarize and isinstance(result, dict) and result.get("resultType") in ("matrix", "vector"):
+        summary = _summarize_series(result)["summary"]
+        return _format_response(result, f"Summarized {len(summary['rows'])} series ({summary['points']} points)")
     if isinstance(result, dict) and "result" in result:
         entries = result["result"]
-        return _format_response(result, f"Found {len(entries)} result(s)")
-    return _format_response(result)
+        return await _offload(_format_response, result, f"Found {len(entries)} result(s)", size=size)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_query_range (query) ---
 
 @mcp.tool()
+@_instrument
 async def loki_query_range(
     query: str,
     start: str = "",
@@ -425,6 +3199,12 @@ async def loki_query_range(
     step: str = "",
     fields: str = "",
     filter_query: dict | None = None,
+    stream_groups: int = 0,
+    line_fields: str = "",
+    line_parser: str = "auto",
+    summarize: bool = False,
+    max_points: int = 250,
+    tenants: str = "",
 ) -> str:
     """Run a LogQL query over a time range. Returns log streams or metric matrices.
 
@@ -436,7 +3216,13 @@ async def loki_query_range(
         direction: Log ordering. Valid values: 'forward', 'backward'
         step: Query resolution step width (e.g. '5m'). Only for metric queries.
         fields: Comma-separated field names to include in results (empty = all).
-        filter_query: Dict of key-value pairs to filter results (e.g. {"host": "doc1"}). Only matching items returned.
+        filter_query: Dict of filters; only matching items returned. A value means equality (e.g. {"host": "doc1"}); a dict applies operators =, !=, =~, !~, in, <, <=, >, >= (e.g. {"status": {">=": 500}}).
+        stream_groups: Log queries only: enumerate matching streams via /series, split them into this many groups and query the groups concurrently, fetching `limit` entries per group for fair per-stream sampling (0 = single query).
+        line_fields: Log queries only: comma-separated fields to extract from JSON/logfmt log lines (e.g. 'status,path'; dots reach nested JSON keys). Loki returns only these fields and each line becomes a {field: value} dict.
+        line_parser: Parser for line_fields: 'json', 'logfmt', or 'auto' (sniff one line; parse client-side if the format is unknown).
+        summarize: Metric queries only: return one row of statistics per series (points, min, max, mean, p50, p95, last value and trend, the least-squares change across the range) instead of raw values.
+        max_points: Metric queries only: target points per series. Without `step`, a step giving about this many points is chosen; longer series are downsampled client-side (Largest-Triangle-Three-Buckets) and their values become numbers. 0 disables both.
+        tenants: Comma-separated tenant IDs (X-Scope-OrgID) to query concurrently, or '*' for every tenant in LOKI_TENANTS. Results carry a __tenant_id__ label and per-tenant status. Default: LOKI_ORG_ID only.
 
     Known fields: host, container, unit, job, service_name
 
@@ -445,43 +3231,77 @@ async def loki_query_range(
     if not _module_enabled("query"):
         return _format_response({"error": "Module 'query' is not enabled. Set LOKI_MODULES to include it."})
 
+    try:
+        _compile_filter(filter_query)
+    except ValueError as e:
+        return _format_response({"error": f"Invalid filter_query: {e}"})
     client = await _get_client()
     params = {}
     params["query"] = query
     if start:
         params["start"] = _parse_timestamp(start)
     if end:
-        params["end"] = _parse_timestamp(end)
+        params["end"] = _parse_timestamp(end, round_up=True)
     if limit:
         params["limit"] = str(limit)
     if direction:
         params["direction"] = direction
     if step:
         params["step"] = step
-    resp = await client.request(
-        "GET",
-        "/loki/api/v1/query_range",
-        params=params,
+    if summarize and _is_log_query(params["query"]):
+        return _format_response({"error": "summarize only applies to metric queries."})
+    if not step and max_points > 0 and not _is_log_query(params["query"]):
+        # A grid step sized for max_points instead of Loki's range/250 default.
+        end_ts = _timestamp_to_epoch(params.get("end", ""), time.time())
+        params["step"] = _auto_step(_timestamp_to_epoch(params.get("start", ""), end_ts - 3600), end_ts, max_points)
+    # Filters on stream labels become selector matchers, so Loki does the
+    # filtering and `limit` applies to matching streams only.
+    params["query"], filter_query, pushed = await _push_down_filters(client, params["query"], filter_query)
+    result, err = await _with_line_fields(
+        client,
+        params,
+        line_fields,
+        line_parser,
+        lambda: _for_backends(
+            lambda backend: _for_tenants(
+                tenants,
+                lambda: _run_query_range(backend, "loki_query_range", params, stream_groups=stream_groups),
+                direction=direction,
+                limit=limit,
+            ),
+            direction=direction,
+            limit=limit,
+        ),
     )
-    if err := _handle_error(resp, "loki_query_range"):
+    if err:
         return err
-    result = _unwrap_loki_response(resp)
+    if pushed and isinstance(result, dict):
+        result["pushdown"] = {"filters": pushed, "query": params["query"]}
+    if max_points > 0 and not summarize and isinstance(result, dict) and result.get("resultType") == "matrix":
+        result["downsampling"] = {"step": params.get("step", ""), **_downsample_matrix(result, max_points)}
+    size = _result_bytes(result)
     if fields or filter_query:
-        result = _filter_results(
+        result = await _offload(
+            _filter_results,
             result,
+            size=size,
             fields=fields,
             query=filter_query,
             filter_path="result",
             filter_label_key="stream",
         )
+    if summarize and isinstance(result, dict) and result.get("resultType") in ("matrix", "vector"):
+        summary = _summarize_series(result)["summary"]
+        return _format_response(result, f"Summarized {len(summary['rows'])} series ({summary['points']} points)")
     if isinstance(result, dict) and "result" in result:
         entries = result["result"]
-        return _format_response(result, f"Found {len(entries)} result(s)")
-    return _format_response(result)
+        return await _offload(_format_response, result, f"Found {len(entries)} result(s)", size=size)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_list_labels (query) ---
 
 @mcp.tool()
+@_instrument
 async def loki_list_labels(
     start: str = "",
     end: str = "",
@@ -502,7 +3322,7 @@ async def loki_list_labels(
     if start:
         params["start"] = _parse_timestamp(start)
     if end:
-        params["end"] = _parse_timestamp(end)
+        params["end"] = _parse_timestamp(end, round_up=True)
     resp = await client.request(
         "GET",
         "/loki/api/v1/labels",
@@ -510,12 +3330,14 @@ async def loki_list_labels(
     )
     if err := _handle_error(resp, "loki_list_labels"):
         return err
-    result = _unwrap_loki_response(resp)
-    return _format_response(result)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_list_label_values (query) ---
 
 @mcp.tool()
+@_instrument
 async def loki_list_label_values(
     name: str,
     start: str = "",
@@ -542,7 +3364,7 @@ async def loki_list_label_values(
     if start:
         params["start"] = _parse_timestamp(start)
     if end:
-        params["end"] = _parse_timestamp(end)
+        params["end"] = _parse_timestamp(end, round_up=True)
     if query:
         params["query"] = query
     resp = await client.request(
@@ -552,12 +3374,14 @@ async def loki_list_label_values(
     )
     if err := _handle_error(resp, "loki_list_label_values"):
         return err
-    result = _unwrap_loki_response(resp)
-    return _format_response(result)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_list_series (query) ---
 
 @mcp.tool()
+@_instrument
 async def loki_list_series(
     match: str,
     start: str = "",
@@ -572,7 +3396,7 @@ async def loki_list_series(
         start: Start timestamp
         end: End timestamp
         fields: Comma-separated field names to include in results (empty = all).
-        filter_query: Dict of key-value pairs to filter results (e.g. {"host": "doc1"}). Only matching items returned.
+        filter_query: Dict of filters; only matching items returned. A value means equality (e.g. {"host": "doc1"}); a dict applies operators =, !=, =~, !~, in, <, <=, >, >= (e.g. {"status": {">=": 500}}).
 
     Known fields: host, container, unit, job, service_name
 
@@ -581,13 +3405,17 @@ async def loki_list_series(
     if not _module_enabled("query"):
         return _format_response({"error": "Module 'query' is not enabled. Set LOKI_MODULES to include it."})
 
+    try:
+        _compile_filter(filter_query)
+    except ValueError as e:
+        return _format_response({"error": f"Invalid filter_query: {e}"})
     client = await _get_client()
     params = {}
     params["match[]"] = match
     if start:
         params["start"] = _parse_timestamp(start)
     if end:
-        params["end"] = _parse_timestamp(end)
+        params["end"] = _parse_timestamp(end, round_up=True)
     resp = await client.request(
         "GET",
         "/loki/api/v1/series",
@@ -595,20 +3423,24 @@ async def loki_list_series(
     )
     if err := _handle_error(resp, "loki_list_series"):
         return err
-    result = _unwrap_loki_response(resp)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
     if fields or filter_query:
-        result = _filter_results(
+        result = await _offload(
+            _filter_results,
             result,
+            size=size,
             fields=fields,
             query=filter_query,
             filter_path=None,
             filter_label_key=None,
         )
-    return _format_response(result)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_index_stats (index) ---
 
 @mcp.tool()
+@_instrument
 async def loki_index_stats(
     query: str,
     start: str = "",
@@ -632,7 +3464,7 @@ async def loki_index_stats(
     if start:
         params["start"] = _parse_timestamp(start)
     if end:
-        params["end"] = _parse_timestamp(end)
+        params["end"] = _parse_timestamp(end, round_up=True)
     resp = await client.request(
         "GET",
         "/loki/api/v1/index/stats",
@@ -640,12 +3472,14 @@ async def loki_index_stats(
     )
     if err := _handle_error(resp, "loki_index_stats"):
         return err
-    result = _unwrap_loki_response(resp)
-    return _format_response(result)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_index_volume (index) ---
 
 @mcp.tool()
+@_instrument
 async def loki_index_volume(
     query: str,
     start: str = "",
@@ -664,7 +3498,7 @@ async def loki_index_volume(
         limit: Maximum number of volumes to return
         targetLabels: Comma-separated labels to aggregate by (e.g. 'host,container')
         fields: Comma-separated field names to include in results (empty = all).
-        filter_query: Dict of key-value pairs to filter results (e.g. {"host": "doc1"}). Only matching items returned.
+        filter_query: Dict of filters; only matching items returned. A value means equality (e.g. {"host": "doc1"}); a dict applies operators =, !=, =~, !~, in, <, <=, >, >= (e.g. {"status": {">=": 500}}).
 
     Known fields: host, container, unit, job, service_name
 
@@ -673,13 +3507,17 @@ async def loki_index_volume(
     if not _module_enabled("index"):
         return _format_response({"error": "Module 'index' is not enabled. Set LOKI_MODULES to include it."})
 
+    try:
+        _compile_filter(filter_query)
+    except ValueError as e:
+        return _format_response({"error": f"Invalid filter_query: {e}"})
     client = await _get_client()
     params = {}
     params["query"] = query
     if start:
         params["start"] = _parse_timestamp(start)
     if end:
-        params["end"] = _parse_timestamp(end)
+        params["end"] = _parse_timestamp(end, round_up=True)
     if limit:
         params["limit"] = str(limit)
     if targetLabels:
@@ -691,10 +3529,13 @@ async def loki_index_volume(
     )
     if err := _handle_error(resp, "loki_index_volume"):
         return err
-    result = _unwrap_loki_response(resp)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
     if fields or filter_query:
-        result = _filter_results(
+        result = await _offload(
+            _filter_results,
             result,
+            size=size,
             fields=fields,
             query=filter_query,
             filter_path="result",
@@ -702,12 +3543,13 @@ async def loki_index_volume(
         )
     if isinstance(result, dict) and "result" in result:
         entries = result["result"]
-        return _format_response(result, f"Found {len(entries)} result(s)")
-    return _format_response(result)
+        return await _offload(_format_response, result, f"Found {len(entries)} result(s)", size=size)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_index_volume_range (index) ---
 
 @mcp.tool()
+@_instrument
 async def loki_index_volume_range(
     query: str,
     start: str = "",
@@ -728,7 +3570,7 @@ async def loki_index_volume_range(
         step: Query resolution step width (e.g. '5m')
         targetLabels: Comma-separated labels to aggregate by
         fields: Comma-separated field names to include in results (empty = all).
-        filter_query: Dict of key-value pairs to filter results (e.g. {"host": "doc1"}). Only matching items returned.
+        filter_query: Dict of filters; only matching items returned. A value means equality (e.g. {"host": "doc1"}); a dict applies operators =, !=, =~, !~, in, <, <=, >, >= (e.g. {"status": {">=": 500}}).
 
     Known fields: host, container, unit, job, service_name
 
@@ -737,13 +3579,17 @@ async def loki_index_volume_range(
     if not _module_enabled("index"):
         return _format_response({"error": "Module 'index' is not enabled. Set LOKI_MODULES to include it."})
 
+    try:
+        _compile_filter(filter_query)
+    except ValueError as e:
+        return _format_response({"error": f"Invalid filter_query: {e}"})
     client = await _get_client()
     params = {}
     params["query"] = query
     if start:
         params["start"] = _parse_timestamp(start)
     if end:
-        params["end"] = _parse_timestamp(end)
+        params["end"] = _parse_timestamp(end, round_up=True)
     if limit:
         params["limit"] = str(limit)
     if step:
@@ -757,10 +3603,13 @@ async def loki_index_volume_range(
     )
     if err := _handle_error(resp, "loki_index_volume_range"):
         return err
-    result = _unwrap_loki_response(resp)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
     if fields or filter_query:
-        result = _filter_results(
+        result = await _offload(
+            _filter_results,
             result,
+            size=size,
             fields=fields,
             query=filter_query,
             filter_path="result",
@@ -768,12 +3617,13 @@ async def loki_index_volume_range(
         )
     if isinstance(result, dict) and "result" in result:
         entries = result["result"]
-        return _format_response(result, f"Found {len(entries)} result(s)")
-    return _format_response(result)
+        return await _offload(_format_response, result, f"Found {len(entries)} result(s)", size=size)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_detect_patterns (patterns) ---
 
 @mcp.tool()
+@_instrument
 async def loki_detect_patterns(
     query: str,
     start: str = "",
@@ -797,7 +3647,7 @@ async def loki_detect_patterns(
     if start:
         params["start"] = _parse_timestamp(start)
     if end:
-        params["end"] = _parse_timestamp(end)
+        params["end"] = _parse_timestamp(end, round_up=True)
     resp = await client.request(
         "GET",
         "/loki/api/v1/patterns",
@@ -805,12 +3655,14 @@ async def loki_detect_patterns(
     )
     if err := _handle_error(resp, "loki_detect_patterns"):
         return err
-    result = _unwrap_loki_response(resp)
-    return _format_response(result)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_push (ingest) ---
 
 @mcp.tool()
+@_instrument
 async def loki_push(
     streams: list,
     confirm: bool = False,
@@ -849,6 +3701,7 @@ async def loki_push(
 # --- loki_list_rules (rules) ---
 
 @mcp.tool()
+@_instrument
 async def loki_list_rules(
 ) -> str:
     """List all alerting and recording rules across all namespaces.
@@ -867,12 +3720,14 @@ async def loki_list_rules(
     )
     if err := _handle_error(resp, "loki_list_rules"):
         return err
-    result = _unwrap_loki_response(resp)
-    return _format_response(result)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_get_rules_namespace (rules) ---
 
 @mcp.tool()
+@_instrument
 async def loki_get_rules_namespace(
     namespace: str,
 ) -> str:
@@ -895,12 +3750,14 @@ async def loki_get_rules_namespace(
     )
     if err := _handle_error(resp, "loki_get_rules_namespace"):
         return err
-    result = _unwrap_loki_response(resp)
-    return _format_response(result)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_get_rule_group (rules) ---
 
 @mcp.tool()
+@_instrument
 async def loki_get_rule_group(
     namespace: str,
     group: str,
@@ -926,12 +3783,14 @@ async def loki_get_rule_group(
     )
     if err := _handle_error(resp, "loki_get_rule_group"):
         return err
-    result = _unwrap_loki_response(resp)
-    return _format_response(result)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_create_rule_group (rules) ---
 
 @mcp.tool()
+@_instrument
 async def loki_create_rule_group(
     namespace: str,
     rules_yaml: str,
@@ -979,6 +3838,7 @@ async def loki_create_rule_group(
 # --- loki_delete_rule_group (rules) ---
 
 @mcp.tool()
+@_instrument
 async def loki_delete_rule_group(
     namespace: str,
     group: str,
@@ -1026,6 +3886,7 @@ async def loki_delete_rule_group(
 # --- loki_delete_rules_namespace (rules) ---
 
 @mcp.tool()
+@_instrument
 async def loki_delete_rules_namespace(
     namespace: str,
     confirm: bool = False,
@@ -1069,6 +3930,7 @@ async def loki_delete_rules_namespace(
 # --- loki_list_prometheus_rules (rules) ---
 
 @mcp.tool()
+@_instrument
 async def loki_list_prometheus_rules(
     type: str = "",
 ) -> str:
@@ -1093,12 +3955,14 @@ async def loki_list_prometheus_rules(
     )
     if err := _handle_error(resp, "loki_list_prometheus_rules"):
         return err
-    result = _unwrap_loki_response(resp)
-    return _format_response(result)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_create_delete_request (delete) ---
 
 @mcp.tool()
+@_instrument
 async def loki_create_delete_request(
     query: str,
     start: str,
@@ -1151,6 +4015,7 @@ async def loki_create_delete_request(
 # --- loki_list_delete_requests (delete) ---
 
 @mcp.tool()
+@_instrument
 async def loki_list_delete_requests(
     fields: str = "",
     filter_query: dict | None = None,
@@ -1164,6 +4029,10 @@ async def loki_list_delete_requests(
     if not _module_enabled("delete"):
         return _format_response({"error": "Module 'delete' is not enabled. Set LOKI_MODULES to include it."})
 
+    try:
+        _compile_filter(filter_query)
+    except ValueError as e:
+        return _format_response({"error": f"Invalid filter_query: {e}"})
     client = await _get_client()
     params = {}
     resp = await client.request(
@@ -1173,20 +4042,24 @@ async def loki_list_delete_requests(
     )
     if err := _handle_error(resp, "loki_list_delete_requests"):
         return err
-    result = _unwrap_loki_response(resp)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
     if fields or filter_query:
-        result = _filter_results(
+        result = await _offload(
+            _filter_results,
             result,
+            size=size,
             fields=fields,
             query=filter_query,
             filter_path=None,
             filter_label_key=None,
         )
-    return _format_response(result)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_cancel_delete_request (delete) ---
 
 @mcp.tool()
+@_instrument
 async def loki_cancel_delete_request(
     request_id: str,
     confirm: bool = False,
@@ -1231,6 +4104,7 @@ async def loki_cancel_delete_request(
 # --- loki_ready (status) ---
 
 @mcp.tool()
+@_instrument
 async def loki_ready(
 ) -> str:
     """Check if Loki is ready to accept traffic. Returns 'ready' when all components are up.
@@ -1249,6 +4123,7 @@ async def loki_ready(
 # --- loki_metrics (status) ---
 
 @mcp.tool()
+@_instrument
 async def loki_metrics(
 ) -> str:
     """Get Prometheus metrics from this Loki instance. Returns metrics in Prometheus exposition format.
@@ -1267,6 +4142,7 @@ async def loki_metrics(
 # --- loki_config (status) ---
 
 @mcp.tool()
+@_instrument
 async def loki_config(
 ) -> str:
     """Get the current Loki configuration. Shows all runtime settings.
@@ -1285,6 +4161,7 @@ async def loki_config(
 # --- loki_services (status) ---
 
 @mcp.tool()
+@_instrument
 async def loki_services(
 ) -> str:
     """List all internal Loki services and their current states.
@@ -1303,6 +4180,7 @@ async def loki_services(
 # --- loki_buildinfo (status) ---
 
 @mcp.tool()
+@_instrument
 async def loki_buildinfo(
 ) -> str:
     """Get Loki build information including version, revision, branch, and Go version.
@@ -1319,12 +4197,14 @@ async def loki_buildinfo(
     )
     if err := _handle_error(resp, "loki_buildinfo"):
         return err
-    result = _unwrap_loki_response(resp)
-    return _format_response(result)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_get_log_level (status) ---
 
 @mcp.tool()
+@_instrument
 async def loki_get_log_level(
 ) -> str:
     """Get the current log level of the Loki instance.
@@ -1341,12 +4221,14 @@ async def loki_get_log_level(
     )
     if err := _handle_error(resp, "loki_get_log_level"):
         return err
-    result = _unwrap_loki_response(resp)
-    return _format_response(result)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_set_log_level (status) ---
 
 @mcp.tool()
+@_instrument
 async def loki_set_log_level(
     log_level: str,
     confirm: bool = False,
@@ -1390,6 +4272,7 @@ async def loki_set_log_level(
 # --- loki_flush (admin) ---
 
 @mcp.tool()
+@_instrument
 async def loki_flush(
     confirm: bool = False,
 ) -> str:
@@ -1425,6 +4308,7 @@ async def loki_flush(
 # --- loki_prepare_shutdown_status (admin) ---
 
 @mcp.tool()
+@_instrument
 async def loki_prepare_shutdown_status(
 ) -> str:
     """Check the prepare-shutdown status of the ingester.
@@ -1443,12 +4327,14 @@ async def loki_prepare_shutdown_status(
     )
     if err := _handle_error(resp, "loki_prepare_shutdown_status"):
         return err
-    result = _unwrap_loki_response(resp)
-    return _format_response(result)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_prepare_shutdown (admin) ---
 
 @mcp.tool()
+@_instrument
 async def loki_prepare_shutdown(
     confirm: bool = False,
 ) -> str:
@@ -1484,6 +4370,7 @@ async def loki_prepare_shutdown(
 # --- loki_cancel_prepare_shutdown (admin) ---
 
 @mcp.tool()
+@_instrument
 async def loki_cancel_prepare_shutdown(
     confirm: bool = False,
 ) -> str:
@@ -1517,6 +4404,7 @@ async def loki_cancel_prepare_shutdown(
 # --- loki_shutdown_status (admin) ---
 
 @mcp.tool()
+@_instrument
 async def loki_shutdown_status(
 ) -> str:
     """Check the shutdown status of the ingester.
@@ -1535,12 +4423,14 @@ async def loki_shutdown_status(
     )
     if err := _handle_error(resp, "loki_shutdown_status"):
         return err
-    result = _unwrap_loki_response(resp)
-    return _format_response(result)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
+    return await _offload(_format_response, result, size=size)
 
 # --- loki_shutdown (admin) ---
 
 @mcp.tool()
+@_instrument
 async def loki_shutdown(
     confirm: bool = False,
 ) -> str:
@@ -1576,6 +4466,7 @@ async def loki_shutdown(
 # --- loki_format_query (format) ---
 
 @mcp.tool()
+@_instrument
 async def loki_format_query(
     query: str,
 ) -> str:
@@ -1590,6 +4481,9 @@ async def loki_format_query(
         return _format_response({"error": "Module 'format' is not enabled. Set LOKI_MODULES to include it."})
 
     client = await _get_client()
+    # Queries the local parser understands are formatted without a round-trip.
+    if (formatted := _format_logql_locally(query)) is not None:
+        return _format_response(formatted)
     params = {}
     params["query"] = query
     resp = await client.request(
@@ -1599,8 +4493,9 @@ async def loki_format_query(
     )
     if err := _handle_error(resp, "loki_format_query"):
         return err
-    result = _unwrap_loki_response(resp)
-    return _format_response(result)
+    result = await _unwrap_offloaded(resp)
+    size = _result_bytes(result)
+    return await _offload(_format_response, result, size=size)
 
 
 # ===========================================================================
@@ -1609,6 +4504,7 @@ async def loki_format_query(
 
 
 @mcp.tool()
+@_instrument
 async def loki_search_logs(
     host: str = "",
     container: str = "",
@@ -1621,6 +4517,10 @@ async def loki_search_logs(
     end: str = "",
     limit: int = 100,
     direction: str = "backward",
+    stream_groups: int = 0,
+    tenants: str = "",
+    line_fields: str = "",
+    line_parser: str = "auto",
 ) -> str:
     """Search logs by host, container, unit, pattern, and severity — no LogQL needed.
 
@@ -1640,6 +4540,14 @@ async def loki_search_logs(
         end: End time — duration or RFC3339. Default: now.
         limit: Maximum log entries to return (default: 100).
         direction: 'backward' (newest first) or 'forward' (oldest first).
+        stream_groups: Split the matching streams into this many groups (via /series) and query
+            them concurrently, returning up to `limit` lines per group. Use it when one busy
+            stream would otherwise fill the whole limit (0 = single query).
+        tenants: Comma-separated tenant IDs (X-Scope-OrgID) to search concurrently, or '*' for
+            every tenant in LOKI_TENANTS. Lines carry a __tenant_id__ label. Default: LOKI_ORG_ID only.
+        line_fields: Comma-separated fields to extract from JSON/logfmt lines (e.g. 'status,path').
+            Loki returns only these fields and each line becomes a {field: value} dict.
+        line_parser: Parser for line_fields: 'json', 'logfmt' or 'auto' (default: sniff the format).
     """
     if not _module_enabled("query"):
         return _format_response({"error": "Module 'query' is not enabled."})
@@ -1655,41 +4563,59 @@ async def loki_search_logs(
     if labels:
         merged_labels.update(labels)
 
-    if not merged_labels:
-        selector = '{}'
-    else:
-        parts = [f'{k}="{v}"' for k, v in merged_labels.items()]
-        selector = "{" + ", ".join(parts) + "}"
-
-    # Build pipeline
-    pipeline = ""
-    if pattern:
-        pipeline += f' |~ "{pattern}"'
-    if exclude:
-        pipeline += f' !~ "{exclude}"'
-
-    severity_levels = {"debug": 0, "info": 1, "warn": 2, "warning": 2, "error": 3, "critical": 4, "fatal": 5}
-    if severity and severity.lower() in severity_levels:
-        level_num = severity_levels[severity.lower()]
-        level_patterns = [k for k, v in severity_levels.items() if v >= level_num and k != "warning"]
-        if level_patterns:
-            sev_regex = "|".join(level_patterns)
-            pipeline += f' |~ "(?i)({sev_regex})"'
-
-    query = selector + pipeline
+    # Severity filters on Loki's detected_level where the streams have it and
+    # on a line regex where they do not. When that is not yet known for this
+    # selector, detected_level is tried first and, if it finds nothing, the
+    # search is retried as a line regex; a retry that finds lines is
+    # remembered, so later searches go straight to the regex.
+    levels = _severity_at_least(severity) if severity else []
+    client = await _get_client()
+    selector = _build_log_query(merged_labels)
+    level_source = await _severity_source(client, selector) if levels else "detected_level"
+    query = _build_log_query(
+        merged_labels, pattern=pattern, exclude=exclude, levels=levels, level_source=level_source or "detected_level"
+    )
 
     # Execute query
-    client = await _get_client()
     params: dict[str, str] = {"query": query, "limit": str(limit), "direction": direction}
     if start:
         params["start"] = _parse_timestamp(start)
     if end:
-        params["end"] = _parse_timestamp(end)
+        params["end"] = _parse_timestamp(end, round_up=True)
+
+    async def run() -> tuple[Any, str | None]:
+        return await _with_line_fields(
+            client,
+            params,
+            line_fields,
+            line_parser,
+            lambda: _for_backends(
+                lambda backend: _for_tenants(
+                    tenants,
+                    lambda: _run_query_range(backend, "loki_search_logs", params, stream_groups=stream_groups),
+                    direction=direction,
+                    limit=limit,
+                ),
+                direction=direction,
+                limit=limit,
+            ),
+        )
 
-    resp = await client.request("GET", "/loki/api/v1/query_range", params=params)
+    result, err = await run()
+    if levels and not level_source and not err:
+        if _count_lines(result):
+            _remember_severity_source(client, selector, "detected_level")
+        else:
+            query = _build_log_query(
+                merged_labels, pattern=pattern, exclude=exclude, levels=levels, level_source="line"
+            )
+            params["query"] = query
+            result, err = await run()
+            if not err and _count_lines(result):
+                _remember_severity_source(client, selector, "line")
 
     # Issue #4: Friendly error when no labels provided
-    if err := _handle_error(resp, "loki_search_logs"):
+    if err:
         if "at least one" in err.lower() and not merged_labels:
             try:
                 labels_resp = await client.request("GET", "/loki/api/v1/labels")
@@ -1713,16 +4639,14 @@ async def loki_search_logs(
                 ],
             }, "No labels specified — Loki needs at least one label matcher")
         return err
-    result = _unwrap_loki_response(resp)
-    _format_log_values(result)
+    size = _result_bytes(result)
+    result = await _offload(_with_log_values_formatted, result, size=size)
 
     # Format output
     summary = f"Query: {query}"
-    total_lines = 0
+    total_lines = _count_lines(result)
     if isinstance(result, dict) and "result" in result:
-        streams = result["result"]
-        total_lines = sum(len(s.get("values", [])) for s in streams)
-        summary += f"\nStreams: {len(streams)}, Log lines: {total_lines}"
+        summary += f"\nStreams: {len(result['result'])}, Log lines: {total_lines}"
 
     # Issue #3: Zero-result hints
     if total_lines == 0 and merged_labels:
@@ -1742,10 +4666,11 @@ async def loki_search_logs(
         if isinstance(result, dict):
             result["hints"] = hints
 
-    return _format_response(result, summary)
+    return await _offload(_format_response, result, summary, size=size)
 
 
 @mcp.tool()
+@_instrument
 async def loki_error_summary(
     host: str = "",
     labels: dict[str, str] | None = None,
@@ -1776,26 +4701,18 @@ async def loki_error_summary(
     if labels:
         merged_labels.update(labels)
 
-    if merged_labels:
-        parts = [f'{k}="{v}"' for k, v in merged_labels.items()]
-        selector = "{" + ", ".join(parts) + "}"
-    else:
-        selector = "{}"
-    query = selector + ' |~ "(?i)(error|fail|exception|panic|fatal)"'
-    if exclude:
-        query += f' !~ "{exclude}"'
+    query = _build_log_query(merged_labels, pattern_ci="error|fail|exception|panic|fatal", exclude=exclude)
 
     client = await _get_client()
     params: dict[str, str] = {"query": query, "limit": str(limit), "direction": "backward"}
     if start:
         params["start"] = _parse_timestamp(start)
     if end:
-        params["end"] = _parse_timestamp(end)
+        params["end"] = _parse_timestamp(end, round_up=True)
 
-    resp = await client.request("GET", "/loki/api/v1/query_range", params=params)
-    if err := _handle_error(resp, "loki_error_summary"):
+    result, err = await _run_query_range(client, "loki_error_summary", params)
+    if err:
         return err
-    result = _unwrap_loki_response(resp)
 
     # Build summary
     summary_data: dict[str, dict] = {}
@@ -1818,6 +4735,7 @@ async def loki_error_summary(
 
 
 @mcp.tool()
+@_instrument
 async def loki_volume_by_label(
     label: str = "host",
     start: str = "1h",
@@ -1843,7 +4761,7 @@ async def loki_volume_by_label(
     if start:
         params["start"] = _parse_timestamp(start)
     if end:
-        params["end"] = _parse_timestamp(end)
+        params["end"] = _parse_timestamp(end, round_up=True)
 
     resp = await client.request("GET", "/loki/api/v1/index/volume", params=params)
     if err := _handle_error(resp, "loki_volume_by_label"):
@@ -1853,6 +4771,231 @@ async def loki_volume_by_label(
 
 
 @mcp.tool()
+@_instrument
+async def loki_volume_anomalies(
+    label: str = "service_name",
+    labels: dict[str, str] | None = None,
+    window: str = "1h",
+    baseline: str = "24h",
+    step: str = "",
+    method: str = "zscore",
+    threshold: float = 3.0,
+    limit: int = 20,
+) -> str:
+    """Find which label values started logging much more or less than usual.
+
+    Fetches log volume over time for the recent window and the baseline
+    before it concurrently, scores every time bucket of every series against
+    its baseline, and returns only the series and buckets that spiked or
+    dropped, most extreme first.
+
+    Args:
+        label: Label whose values are compared (default: 'service_name'). Common: 'host', 'container'.
+        labels: Dict of label matchers limiting the streams considered (e.g. {"namespace": "prod"}).
+        window: Recent period to check (default: 1h).
+        baseline: Period before the window that defines normal (default: 24h).
+        step: Bucket width (default: about a twelfth of the window).
+        method: 'zscore' (against the baseline mean) or 'ewma' (against an exponentially
+            weighted moving average, which adapts to a lasting change).
+        threshold: Minimum |z-score| for a bucket to count as anomalous (default: 3).
+        limit: Maximum series to return (default: 20).
+
+    Note: Volumes are bytes per bucket. A value absent from the baseline shows up as a
+    spike, one that stopped logging as a drop.
+    """
+    if not _module_enabled("index"):
+        return _format_response({"error": "Module 'index' is not enabled."})
+    if method not in ("zscore", "ewma"):
+        return _format_response({"error": f"Unknown method {method!r}: use 'zscore' or 'ewma'."})
+    window_s = _parse_duration(window)
+    baseline_s = _parse_duration(baseline)
+    step_s = _parse_duration(step or _auto_step(0, window_s or 0, 12))
+    if not window_s or not baseline_s or not step_s:
+        return _format_response({"error": "window, baseline and step must be durations such as '1h' or '15m'."})
+
+    client = await _get_client()
+    step_s = max(1, int(step_s))
+    window_n = max(1, round(window_s / step_s))
+    baseline_n = max(2, round(baseline_s / step_s))
+    # Align buckets to the step so repeated calls send identical ranges.
+    end = math.ceil(time.time() / step_s) * step_s
+    split = end - window_n * step_s
+    start = split - baseline_n * step_s
+    selector = _build_log_query(labels)
+
+    def volume(range_start: float, range_end: float) -> Any:
+        params = {
+            "query": selector,
+            "start": _rfc3339(range_start),
+            "end": _rfc3339(range_end),
+            "step": f"{step_s}s",
+            "targetLabels": label,
+            "limit": "1000",
+        }
+        return _run_get(client, "loki_volume_anomalies", "/loki/api/v1/index/volume_range", params)
+
+    (recent, err), (history, baseline_err) = await _gather_cancelling(volume(split, end), volume(start, split))
+    if err or baseline_err:
+        return err or baseline_err
+
+    # Bucket timestamps mark the end of each step; missing buckets logged nothing.
+    grid = [start + i * step_s for i in range(1, baseline_n + window_n + 1)]
+    history_series = _volume_series(history, label)
+    recent_series = _volume_series(recent, label)
+    names = sorted(set(history_series) | set(recent_series))
+    rows = [
+        [history_series.get(name, {}).get(ts, 0.0) for ts in grid[:baseline_n]]
+        + [recent_series.get(name, {}).get(ts, 0.0) for ts in grid[baseline_n:]]
+        for name in names
+    ]
+    anomalies = []
+    for name, row, scores in zip(names, rows, _anomaly_scores(rows, baseline_n, method)):
+        flagged = [i for i, z in enumerate(scores) if abs(z) >= threshold]
+        if not flagged:
+            continue
+        worst = max(flagged, key=lambda i: abs(scores[i]))
+        baseline_avg = math.fsum(row[:baseline_n]) / baseline_n
+        window_avg = math.fsum(row[baseline_n:]) / window_n
+        top = sorted(sorted(flagged, key=lambda i: -abs(scores[i]))[:10])
+        anomalies.append(
+            {
+                label: name,
+                "direction": "spike" if scores[worst] > 0 else "drop",
+                "max_z": round(scores[worst], 2),
+                "baseline_avg_bytes": round(baseline_avg),
+                "window_avg_bytes": round(window_avg),
+                "ratio": round(window_avg / baseline_avg, 2) if baseline_avg else None,
+                "buckets": [
+                    {
+                        "time": _rfc3339(grid[baseline_n + i]),
+                        "bytes": round(row[baseline_n + i]),
+                        "z": round(scores[i], 2),
+                    }
+                    for i in top
+                ],
+            }
+        )
+    anomalies.sort(key=lambda a: -abs(a["max_z"]))
+    data = {
+        "query": selector,
+        "method": method,
+        "threshold": threshold,
+        "step": _format_duration(step_s),
+        "window": {"start": _rfc3339(split), "end": _rfc3339(end)},
+        "baseline": {"start": _rfc3339(start), "end": _rfc3339(split)},
+        "series_checked": len(names),
+        "anomalies": anomalies[:limit],
+    }
+    return _format_response(data, f"{len(anomalies)} of {len(names)} {label} series anomalous (|z| >= {threshold})")
+
+
+@mcp.tool()
+@_instrument
+async def loki_volume_drilldown(
+    path: str = "host,container",
+    labels: dict[str, str] | None = None,
+    top_k: int = 5,
+    start: str = "1h",
+    end: str = "",
+) -> str:
+    """Drill into log volume label by label (e.g. host, then container, then unit) in one call.
+
+    Finds the top_k values of the first label, then queries the next label
+    within each of them concurrently, and so on down the path. Returns a
+    volume tree with each node's share of its parent, plus the noisiest leaf.
+
+    Args:
+        path: Comma-separated labels to drill through, outermost first (default: 'host,container').
+        labels: Dict of label matchers limiting the streams considered (e.g. {"namespace": "prod"}).
+        top_k: Values kept per node at each level (default: 5).
+        start: Start time (default: 1h ago).
+        end: End time (default: now).
+
+    Note: other_pct is the share of a node's volume outside its top_k children,
+    including streams that lack the next label.
+    """
+    if not _module_enabled("index"):
+        return _format_response({"error": "Module 'index' is not enabled."})
+    levels = [label.strip() for label in path.split(",") if label.strip()]
+    if not levels or top_k < 1:
+        return _format_response({"error": "path needs at least one label and top_k must be at least 1."})
+    requests = sum(top_k**depth for depth in range(len(levels)))
+    if requests > LOKI_DRILLDOWN_MAX_REQUESTS:
+        return _format_response(
+            {
+                "error": f"This drilldown needs up to {requests} volume queries "
+                f"(LOKI_DRILLDOWN_MAX_REQUESTS={LOKI_DRILLDOWN_MAX_REQUESTS}). Use fewer levels or a smaller top_k."
+            }
+        )
+
+    client = await _get_client()
+    base: dict[str, str] = {"limit": "1000"}
+    if start:
+        base["start"] = _parse_timestamp(start)
+    if end:
+        base["end"] = _parse_timestamp(end, round_up=True)
+    sent = 0
+
+    async def volumes(matchers: dict[str, str], label: str) -> tuple[list[tuple[str, float]], str | None]:
+        """(value, bytes) of `label` within the matched streams, largest first."""
+        nonlocal sent
+        sent += 1
+        params = {**base, "query": _build_log_query({**(labels or {}), **matchers}), "targetLabels": label}
+        result, err = await _run_get(client, "loki_volume_drilldown", "/loki/api/v1/index/volume", params)
+        if err:
+            return [], err
+        totals: dict[str, float] = {}
+        for item in result.get("result", []) if isinstance(result, dict) else []:
+            value = item.get("metric", {}).get(label)
+            if value is not None:
+                totals[value] = totals.get(value, 0.0) + float(item.get("value", [0, 0])[1])
+        return sorted(totals.items(), key=lambda kv: -kv[1]), None
+
+    def expand(items: list[tuple[str, float]], label: str, parent: float, matchers: dict[str, str]) -> list:
+        return [
+            (
+                {label: value, "volume": _format_bytes(size), "bytes": size, "pct": round(100 * size / parent, 1)},
+                {**matchers, label: value},
+            )
+            for value, size in items[:top_k]
+        ]
+
+    items, err = await volumes({}, levels[0])
+    if err:
+        return err
+    total = math.fsum(size for _value, size in items)
+    frontier = expand(items, levels[0], total or 1.0, {})
+    tree = [node for node, _matchers in frontier]
+    for label in levels[1:]:
+        answers = await _gather_cancelling(*(volumes(matchers, label) for _node, matchers in frontier))
+        next_frontier = []
+        for (node, matchers), (items, err) in zip(frontier, answers):
+            if err:
+                node["error"] = err.split("\n")[0]
+                continue
+            children = expand(items, label, node["bytes"] or 1.0, matchers)
+            node["children"] = [child for child, _matchers in children]
+            other = round(100 - sum(child["pct"] for child in node["children"]), 1)
+            if other > 0:
+                node["other_pct"] = other
+            next_frontier += children
+        frontier = next_frontier
+
+    noisiest = max(frontier, key=lambda pair: pair[0]["bytes"], default=None)
+    data = {
+        "query": _build_log_query(labels),
+        "path": levels,
+        "total": _format_bytes(total),
+        "requests": sent,
+        "noisiest": {**noisiest[1], "volume": noisiest[0]["volume"]} if noisiest else None,
+        "other_pct": round(100 - sum(node["pct"] for node in tree), 1) if tree else 0.0,
+        "tree": tree,
+    }
+    return _format_response(data, f"Volume drilldown by {' > '.join(levels)} ({_format_bytes(total)} total)")
+
+
+@mcp.tool()
+@_instrument
 async def loki_compare_hosts(
     hosts: str,
     labels: dict[str, str] | None = None,
@@ -1861,18 +5004,24 @@ async def loki_compare_hosts(
     start: str = "1h",
     end: str = "",
     limit: int = 50,
+    timeout: float = 0,
 ) -> str:
     """Compare logs across multiple hosts side-by-side.
 
+    Each host is queried concurrently. Hosts that have not answered by the
+    deadline are listed under "partial" so they can be fetched later.
+
     Args:
         hosts: Comma-separated host names (e.g. 'doc1,igpu,wsl').
         labels: Dict of extra label matchers (e.g. {"container": "nginx", "namespace": "prod"}).
-            Added alongside the host regex selector. Use loki_list_labels to discover available label names.
+            Added to each host's selector. Use loki_list_labels to discover available label names.
         pattern: Regex pattern to include log lines. Uses |~ (include match).
         exclude: Regex pattern to exclude log lines (e.g. 'healthcheck|ping'). Uses !~ (exclude match).
         start: Start time (default: 1h ago).
         end: End time (default: now).
         limit: Maximum entries per host (default: 50).
+        timeout: Seconds to wait before returning partial results (default: the tool deadline).
+            To resume, call again with hosts set to the missing hosts.
     """
     if not _module_enabled("query"):
         return _format_response({"error": "Module 'query' is not enabled."})
@@ -1881,29 +5030,41 @@ async def loki_compare_hosts(
     if not host_list:
         return _format_response({"error": "At least one host is required."})
 
-    host_regex = "|".join(host_list)
-    label_parts = [f'host=~"{host_regex}"']
-    if labels:
-        label_parts.extend(f'{k}="{v}"' for k, v in labels.items())
-    selector = "{" + ", ".join(label_parts) + "}"
-    query = selector
-    if pattern:
-        query += f' |~ "{pattern}"'
-    if exclude:
-        query += f' !~ "{exclude}"'
-
     client = await _get_client()
-    params: dict[str, str] = {"query": query, "limit": str(limit), "direction": "backward"}
+    params: dict[str, str] = {"limit": str(limit), "direction": "backward"}
     if start:
         params["start"] = _parse_timestamp(start)
     if end:
-        params["end"] = _parse_timestamp(end)
+        params["end"] = _parse_timestamp(end, round_up=True)
 
-    resp = await client.request("GET", "/loki/api/v1/query_range", params=params)
-    if err := _handle_error(resp, "loki_compare_hosts"):
-        return err
-    result = _unwrap_loki_response(resp)
-    _format_log_values(result)
+    host_queries = {
+        host: _build_log_query({**(labels or {}), "host": host}, pattern=pattern, exclude=exclude)
+        for host in host_list
+    }
+    done, missing = await _run_sections(
+        {
+            host: functools.partial(_run_query_range, client, "loki_compare_hosts", {**params, "query": host_query})
+            for host, host_query in host_queries.items()
+        },
+        timeout=timeout,
+    )
+    results = []
+    for host, (host_result, err) in done.items():
+        if err:
+            missing[host] = err.split("\n")[0]
+        else:
+            results.append(host_result)
+    if not results:
+        first_err = next((err for _result, err in done.values() if err), None)
+        if first_err and len(done) == len(host_list):
+            return first_err
+        return _format_response(
+            {"error": True, "queries": host_queries, "partial": _partial(missing, "hosts")},
+            f"Error: no host answered in time ({len(missing)} missing)",
+        )
+    result = _combine_results(results)
+    size = _result_bytes(result)
+    result = await _offload(_with_log_values_formatted, result, size=size)
 
     # Group by host
     by_host: dict[str, int] = {}
@@ -1912,64 +5073,71 @@ async def loki_compare_hosts(
             h = stream.get("stream", {}).get("host", "unknown")
             by_host[h] = by_host.get(h, 0) + len(stream.get("values", []))
 
-    return _format_response(
-        {"query": query, "results": result, "lines_per_host": by_host},
-        f"Comparing {len(host_list)} host(s): {', '.join(host_list)}",
-    )
+    data: dict[str, Any] = {"queries": host_queries, "results": result, "lines_per_host": by_host}
+    summary = f"Comparing {len(host_list)} host(s): {', '.join(host_list)}"
+    if missing:
+        data["partial"] = _partial(missing, "hosts")
+        summary += f" (partial: {len(missing)} host(s) missing)"
+    return await _offload(_format_response, data, summary, size=size)
 
 
 @mcp.tool()
-async def loki_get_overview() -> str:
+@_instrument
+async def loki_get_overview(sections: str = "", timeout: float = 0) -> str:
     """System summary: build info, readiness, services, label inventory.
 
-    Calls multiple status endpoints to build a comprehensive overview.
-    No parameters needed.
+    Calls multiple status endpoints concurrently to build a comprehensive
+    overview. Sections that have not answered by the deadline are listed
+    under "partial" instead of failing the whole call.
+
+    Args:
+        sections: Comma-separated sections to fetch (default: all of
+            ready, buildinfo, labels, hosts, containers). Use it to resume
+            only the sections a previous call reported missing.
+        timeout: Seconds to wait before returning partial results (default: the tool deadline).
     """
     client = await _get_client()
-    overview: dict[str, Any] = {}
-
-    # Readiness
-    try:
-        resp = await client.request("GET", "/ready")
-        overview["ready"] = resp.status_code == 200
-        overview["ready_text"] = resp.text.strip()
-    except Exception as e:
-        overview["ready"] = False
-        overview["ready_error"] = str(e)
-
-    # Build info
-    try:
-        resp = await client.request("GET", "/loki/api/v1/status/buildinfo")
-        if resp.status_code == 200:
-            overview["buildinfo"] = _unwrap_loki_response(resp)
-    except Exception:
-        pass
-
-    # Labels
-    try:
-        resp = await client.request("GET", "/loki/api/v1/labels")
-        if resp.status_code == 200:
-            overview["labels"] = _unwrap_loki_response(resp)
-    except Exception:
-        pass
 
-    # Host values
-    try:
-        resp = await client.request("GET", "/loki/api/v1/label/host/values")
-        if resp.status_code == 200:
-            overview["hosts"] = _unwrap_loki_response(resp)
-    except Exception:
-        pass
+    async def ready() -> dict[str, Any]:
+        try:
+            resp = await client.request("GET", "/ready")
+            return {"ready": resp.status_code == 200, "ready_text": resp.text.strip()}
+        except httpx.HTTPError as e:
+            return {"ready": False, "ready_error": str(e)}
+
+    async def fetch(path: str) -> Any:
+        resp = await client.request("GET", path)
+        if resp.status_code != 200:
+            raise RuntimeError(f"HTTP {resp.status_code} from {path}")
+        return _unwrap_loki_response(resp)
+
+    available: dict[str, Any] = {
+        "ready": ready,
+        "buildinfo": functools.partial(fetch, "/loki/api/v1/status/buildinfo"),
+        "labels": functools.partial(fetch, "/loki/api/v1/labels"),
+        "hosts": functools.partial(fetch, "/loki/api/v1/label/host/values"),
+        "containers": functools.partial(fetch, "/loki/api/v1/label/container/values"),
+    }
+    wanted = [name.strip() for name in sections.split(",") if name.strip()] or list(available)
+    unknown = [name for name in wanted if name not in available]
+    if unknown:
+        return _format_response(
+            {"error": f"Unknown section(s): {', '.join(unknown)}", "sections": list(available)}
+        )
 
-    # Container values
-    try:
-        resp = await client.request("GET", "/loki/api/v1/label/container/values")
-        if resp.status_code == 200:
-            overview["containers"] = _unwrap_loki_response(resp)
-    except Exception:
-        pass
+    done, missing = await _run_sections({name: available[name] for name in wanted}, timeout=timeout)
+    overview: dict[str, Any] = {}
+    for name, value in done.items():
+        if name == "ready":
+            overview.update(value)
+        else:
+            overview[name] = value
 
-    return _format_response(overview, "Loki System Overview")
+    summary = "Loki System Overview"
+    if missing:
+        overview["partial"] = _partial(missing, "sections")
+        summary += f" (partial: {len(missing)} section(s) missing)"
+    return _format_response(overview, summary)
 
 
 # --- Tool discovery ---
@@ -2012,15 +5180,20 @@ _ALL_TOOLS: dict[str, str] = {
     "loki_search_logs": "Search logs by host/container/unit/pattern/severity without LogQL. Supports labels dict for any label, include and exclude patterns.",
     "loki_error_summary": "Aggregate errors across containers for a host. Supports labels dict for extra filtering.",
     "loki_volume_by_label": "Find noisiest hosts/containers by log volume",
+    "loki_volume_anomalies": "Label values whose log volume spiked or dropped vs. a baseline",
+    "loki_volume_drilldown": "Drill into log volume label by label (host > container > unit) with top-K per level",
     "loki_compare_hosts": "Compare logs across multiple hosts side-by-side. Supports labels dict, include and exclude patterns.",
     "loki_get_overview": "System summary: build info, readiness, labels, hosts",
     "loki_search_tools": "Search for tools by keyword",
     "loki_report_issue": "Generate a structured bug report",
     "loki_validate_query": "Validate and format a LogQL query",
+    "loki_server_stats": "Server runtime statistics: request coalescing, profiling summaries, slow-query log",
+    "loki_batch": "Run several independent tool calls concurrently in one request",
 }
 
 
 @mcp.tool()
+@_instrument
 async def loki_search_tools(keyword: str) -> str:
     """Search for Loki tools by keyword.
 
@@ -2045,6 +5218,7 @@ async def loki_search_tools(keyword: str) -> str:
 
 
 @mcp.tool()
+@_instrument
 async def loki_report_issue(
     tool_name: str,
     error: str,
@@ -2078,15 +5252,26 @@ async def loki_report_issue(
 
 
 @mcp.tool()
+@_instrument
 async def loki_validate_query(query: str) -> str:
     """Validate and format a LogQL query. Returns the prettified form or an error.
 
+    Short queries the built-in LogQL parser understands are validated
+    locally without contacting Loki; anything else is checked by Loki's
+    format_query.
+
     Args:
         query: LogQL query string to validate.
     """
     if not _module_enabled("format"):
         return _format_response({"error": "Module 'format' is not enabled."})
 
+    if (formatted := _format_logql_locally(query)) is not None:
+        return _format_response(
+            {"valid": True, "original": query, "formatted": formatted, "validated_by": "local"},
+            "Query is valid",
+        )
+
     client = await _get_client()
     resp = await client.request("GET", "/loki/api/v1/format_query", params={"query": query})
 
@@ -2098,7 +5283,7 @@ async def loki_validate_query(query: str) -> str:
         )
     else:
         try:
-            body = resp.json()
+            body = _json_loads(resp.content)
             error_msg = body.get("message", body.get("error", resp.text))
         except Exception:
             error_msg = resp.text
@@ -2108,6 +5293,140 @@ async def loki_validate_query(query: str) -> str:
         )
 
 
+@mcp.tool()
+@_instrument
+async def loki_server_stats() -> str:
+    """Server runtime statistics for this MCP server (not Loki itself).
+
+    Reports Loki client counters (request coalescing), profiling configuration
+    and summaries (top functions by self time, top allocation sites) of the
+    most recently profiled tool calls, and the slow-query log setup.
+    Profiling is enabled with LOKI_MCP_PROFILE, the slow-query log with
+    LOKI_SLOW_QUERY_LOG. No parameters needed.
+    """
+    client = await _get_client()
+    stats: dict[str, Any] = {
+        "client": client.stats(),
+        "backends": {name: backend.stats() for name, backend in _federation.items()},
+        "profiling": {
+            "enabled": bool(_profiled_tools),
+            "tools": sorted(_profiled_tools),
+            "modes": sorted(_profile_modes),
+            "sample_rate": LOKI_MCP_PROFILE_RATE,
+            "dump_dir": LOKI_MCP_PROFILE_DIR,
+            "calls_profiled": _profile_count,
+            "recent": list(_profile_summaries),
+        },
+        "slow_query_log": {
+            "enabled": _slow_query_logger is not None,
+            "path": LOKI_SLOW_QUERY_LOG,
+            "threshold_ms": LOKI_SLOW_QUERY_MS,
+            "threshold_bytes": LOKI_SLOW_QUERY_BYTES,
+            "logged": _slow_query_count,
+        },
+        "time_snapping": {
+            "enabled": bool(_split_interval),
+            "split_interval_seconds": _split_interval,
+        },
+        "offload": {
+            "mode": LOKI_OFFLOAD,
+            "threshold_bytes": LOKI_OFFLOAD_BYTES,
+            "workers": LOKI_OFFLOAD_WORKERS,
+            "offloaded": _offloaded,
+        },
+        "json": {"decode": _JSON_DECODER, "encode": _JSON_ENCODER},
+    }
+    return _format_response(stats, "Loki MCP server stats")
+
+
+def _is_error_output(output: Any) -> bool:
+    """Whether a tool's output is an error it returned rather than raised.
+
+    Tools report failures (HTTP errors, disabled modules, bad arguments) as a
+    JSON object with a top-level "error" key, optionally after a summary line.
+    """
+    if not isinstance(output, str):
+        return False
+    text = output.lstrip()
+    if not text.startswith("{"):
+        text = output.partition("\n\n")[2].lstrip()
+        if not text.startswith("{"):
+            return False
+    try:
+        data = _json_loads(text)
+    except ValueError:
+        return False
+    return isinstance(data, dict) and bool(data.get("error"))
+
+
+def _tool_result_text(result: Any) -> str:
+    """The text of a FastMCP tool result (a ToolResult or a list of content blocks)."""
+    blocks = getattr(result, "content", result)
+    if not isinstance(blocks, list):
+        return str(blocks)
+    return "\n".join(getattr(block, "text", "") for block in blocks)
+
+
+@mcp.tool()
+@_instrument
+async def loki_batch(calls: list[dict]) -> str:
+    """Run several independent tool calls concurrently in one request.
+
+    Each entry names a tool and its arguments, for example
+    [{"tool": "loki_list_labels", "arguments": {}},
+     {"tool": "loki_search_logs", "arguments": {"host": "web1", "pattern": "timeout"}}].
+    Calls run up to LOKI_BATCH_CONCURRENCY at a time within this call's
+    deadline. Results come back in the same order, each with its time
+    from submission and how much of it was spent queued; a failing call,
+    whether it raised or returned an error, reports that error without
+    affecting the others.
+
+    Args:
+        calls: List of {"tool": name, "arguments": {...}} entries (at most LOKI_BATCH_MAX_CALLS).
+    """
+    if not calls:
+        return _format_response({"error": "calls is empty: pass a list of tool/arguments entries."})
+    if len(calls) > LOKI_BATCH_MAX_CALLS:
+        return _format_response(
+            {"error": f"{len(calls)} calls exceeds LOKI_BATCH_MAX_CALLS={LOKI_BATCH_MAX_CALLS}; split the batch."}
+        )
+
+    limit = asyncio.Semaphore(max(1, LOKI_BATCH_CONCURRENCY))
+    started = time.perf_counter()
+
+    async def run(call: Any) -> tuple[bool, str, float]:
+        """(ok, output, queued ms) for one entry."""
+        name = call.get("tool", "") if isinstance(call, dict) else ""
+        tool = await mcp.get_tool(name) if name in _ALL_TOOLS and name != "loki_batch" else None
+        if tool is None:
+            return False, f"Unknown tool {name!r}. Use loki_search_tools to find tool names.", 0.0
+        arguments = call.get("arguments") or {}
+        if not isinstance(arguments, dict):
+            return False, "arguments must be an object of parameter names to values.", 0.0
+        async with limit:
+            queued = (time.perf_counter() - started) * 1000
+            try:
+                # Through FastMCP, so arguments are validated and coerced as for a direct call.
+                output = _tool_result_text(await tool.run(arguments))
+            except Exception as exc:
+                return False, f"{type(exc).__name__}: {exc}", queued
+        return not _is_error_output(output), output, queued
+
+    async def timed(call: Any) -> tuple[bool, str, float, float]:
+        ok, output, queued = await run(call)
+        return ok, output, queued, (time.perf_counter() - started) * 1000
+
+    outcomes = await asyncio.gather(*(timed(call) for call in calls))
+    elapsed = (time.perf_counter() - started) * 1000
+    failed = sum(not outcome[0] for outcome in outcomes)
+    sections = [f"Batch: {len(calls)} call(s), {len(calls) - failed} done, {failed} failed in {elapsed:.0f} ms"]
+    for i, (call, (ok, output, queued, ms)) in enumerate(zip(calls, outcomes), 1):
+        name = call.get("tool", "?") if isinstance(call, dict) else "?"
+        status = "done" if ok else "failed"
+        sections.append(f"[{i}] {name}: {status} ({ms:.0f} ms, {queued:.0f} ms queued)\n{output}")
+    return "\n\n".join(sections)
+
+
 # ---------------------------------------------------------------------------
 # Entry point
 # ---------------------------------------------------------------------------
@@ -64,6 +64,10 @@ def _build_endpoint_context(ep: Endpoint) -> dict:
         "optional_params": [_build_param_context(p) for p in optional_params],
         "path_params": [_build_param_context(p) for p in path_params],
         "query_params": [_build_param_context(p) for p in query_params],
+        # Handled by the server itself, never sent to Loki
+        "client_params": [_build_param_context(p) for p in ep.client_params],
+        # Fans out across tenants (X-Scope-OrgID) when a tenants argument is given
+        "tenant_fanout": any(p.name == "tenants" for p in ep.client_params),
         "response_fields": ep.response_fields,
         "is_text_response": is_text_response,
         "is_form_encoded": is_form_encoded,
@@ -35,6 +35,7 @@ class Endpoint:
     filter_path: str | None = None
     filter_label_key: str | None = None
     known_fields: list[str] = field(default_factory=list)
+    client_params: list[Parameter] = field(default_factory=list)
 
 
 @dataclass
@@ -59,23 +60,25 @@ class LokiInventory:
     modules: dict[str, ModuleInfo]
 
 
+def _load_parameter(p: dict) -> Parameter:
+    return Parameter(
+        name=p["name"],
+        type=p["type"],
+        required=p["required"],
+        description=p.get("description", ""),
+        default=p.get("default"),
+        enum=p.get("enum"),
+    )
+
+
 def load_inventory(inventory_path: Path) -> LokiInventory:
     """Parse endpoint-inventory.json into structured data."""
     raw = json.loads(inventory_path.read_text())
 
     endpoints = []
     for ep in raw.get("endpoints", []):
-        params = [
-            Parameter(
-                name=p["name"],
-                type=p["type"],
-                required=p["required"],
-                description=p.get("description", ""),
-                default=p.get("default"),
-                enum=p.get("enum"),
-            )
-            for p in ep.get("parameters", [])
-        ]
+        params = [_load_parameter(p) for p in ep.get("parameters", [])]
+        client_params = [_load_parameter(p) for p in ep.get("client_params", [])]
         endpoints.append(
             Endpoint(
                 id=ep["id"],
@@ -94,6 +97,7 @@ def load_inventory(inventory_path: Path) -> LokiInventory:
                 filter_path=ep.get("filter_path"),
                 filter_label_key=ep.get("filter_label_key"),
                 known_fields=ep.get("known_fields", []),
+                client_params=client_params,
             )
         )
 
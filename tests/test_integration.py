@@ -376,14 +376,14 @@ class TestHighLevel:
         assert result  # non-empty
 
     def test_search_logs_with_exclude(self, loki_url):
-        """Verify exclude parameter works and !~ appears in query output."""
+        """Verify exclude parameter works; a literal exclude becomes a cheap != filter."""
         srv = _load_server()
         result = _call(srv.loki_search_logs,
             host="test-host-1", pattern=".", exclude="healthcheck", start="1h", limit=10
         )
         # Query appears in the summary line (not JSON-encoded)
         assert "Query:" in result
-        assert '!~ "healthcheck"' in result.split("\n")[0]
+        assert '!= "healthcheck"' in result.split("\n")[0]
 
     def test_search_logs_response_no_stats(self, loki_url):
         """Verify stats blob is stripped from search_logs response."""
@@ -419,17 +419,17 @@ class TestHighLevel:
             host="test-host-1", exclude="healthcheck", start="1h"
         )
         data = json.loads(result.split("\n\n", 1)[1])
-        assert '!~ "healthcheck"' in data["query"]
+        assert '!= "healthcheck"' in data["query"]
 
     def test_compare_hosts_with_exclude(self, loki_url):
-        """Verify exclude parameter works on compare_hosts and !~ appears in query."""
+        """Verify exclude parameter works on compare_hosts and != appears in query."""
         srv = _load_server()
         result = _call(srv.loki_compare_hosts,
             hosts="test-host-1,test-host-2", exclude="ping", start="1h"
         )
         assert "Comparing" in result
         data = json.loads(result.split("\n\n", 1)[1])
-        assert '!~ "ping"' in data["query"]
+        assert all('!= "ping"' in query for query in data["queries"].values())
 
     def test_query_range_keeps_raw_timestamps(self, loki_url):
         """Direct API tool should still return raw nanosecond timestamps."""
@@ -467,6 +467,19 @@ class TestHighLevel:
         assert 'host="test-host-1"' in query_line
         assert 'container="test-container-1"' in query_line
 
+    def test_search_logs_line_fields_json(self, loki_url):
+        """Verify line_fields projects seeded JSON lines server-side."""
+        srv = _load_server()
+        result = _call(srv.loki_search_logs,
+            labels={"format": "json"}, line_fields="status,path", start="1h", limit=5
+        )
+        data = json.loads(result.split("\n\n", 1)[1])
+        assert data["line_fields"] == {"fields": ["status", "path"], "parser": "json", "mode": "server"}
+        for stream in data["result"]:
+            for _ts, line in stream["values"]:
+                assert set(line) == {"status", "path"}
+                assert line["path"].startswith("/api/resource/")
+
     def test_search_logs_no_labels_friendly_error(self, loki_url):
         """Verify no labels gives friendly error, not raw Loki error."""
         srv = _load_server()
@@ -507,7 +520,7 @@ class TestHighLevel:
             start="1h",
         )
         data = json.loads(result.split("\n\n", 1)[1])
-        assert 'container="test-container-1"' in data["query"]
+        assert data["queries"]["test-host-1"] == '{container="test-container-1", host="test-host-1"}'
 
 
 # ===========================================================================
@@ -14,8 +14,8 @@ def test_generated_server_exists():
 def test_tool_count():
     code = GENERATED_SERVER.read_text()
     tools = re.findall(r"^async def (loki_\w+)\(", code, re.MULTILINE)
-    # 34 direct API + 8 high-level = 42 total
-    assert len(tools) == 42, f"Expected 42 tools, found {len(tools)}: {tools}"
+    # 34 direct API + 12 high-level = 46 total
+    assert len(tools) == 46, f"Expected 46 tools, found {len(tools)}: {tools}"
 
 
 def test_all_expected_tools_present():
@@ -43,8 +43,10 @@ def test_all_expected_tools_present():
     # High-level tools
     expected_highlevel = {
         "loki_search_logs", "loki_error_summary", "loki_volume_by_label",
+        "loki_volume_anomalies", "loki_volume_drilldown",
         "loki_compare_hosts", "loki_get_overview",
         "loki_search_tools", "loki_report_issue", "loki_validate_query",
+        "loki_server_stats", "loki_batch",
     }
 
     expected = expected_direct | expected_highlevel
@@ -103,7 +105,7 @@ def test_tool_discovery_dict():
     dict_end = code.index("}", dict_start) + 1
     dict_block = code[dict_start:dict_end]
     tool_entries = re.findall(r'"loki_\w+":', dict_block)
-    assert len(tool_entries) == 42
+    assert len(tool_entries) == 46
 
 
 def test_exclude_parameter_on_search_tools():
@@ -199,3 +201,11 @@ def test_tool_discovery_mentions_labels():
     dict_end = code.index("}", dict_start) + 1
     dict_block = code[dict_start:dict_end]
     assert "labels dict" in dict_block, "_ALL_TOOLS missing 'labels dict' mention"
+
+
+def test_all_tools_instrumented():
+    """Verify every registered tool is wrapped by the per-call _instrument hook."""
+    code = GENERATED_SERVER.read_text()
+    tools = re.findall(r"^async def (loki_\w+)\(", code, re.MULTILINE)
+    instrumented = re.findall(r"^@mcp\.tool\(\)\n@_instrument\nasync def (loki_\w+)\(", code, re.MULTILINE)
+    assert sorted(instrumented) == sorted(tools)
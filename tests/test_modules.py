@@ -13,16 +13,16 @@ def test_load_inventory():
     inv = load_inventory(SPEC_PATH)
     assert inv.loki_version == "3.x"
     assert len(inv.endpoints) == 34
-    assert len(inv.high_level_tools) == 8
+    assert len(inv.high_level_tools) == 12
     assert len(inv.modules) == 9
 
 
 def test_build_context():
     inv = load_inventory(SPEC_PATH)
     ctx = build_context(inv)
-    assert ctx["tool_count"] == 42
+    assert ctx["tool_count"] == 46
     assert len(ctx["endpoints"]) == 34
-    assert len(ctx["high_level_tools"]) == 8
+    assert len(ctx["high_level_tools"]) == 12
 
 
 def test_endpoints_by_module():
@@ -0,0 +1,1710 @@
+"""Unit tests for runtime helpers in the generated server (no Loki needed)."""
+
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def _load_server():
+    """Import a fresh copy of the generated server (picks up env changes)."""
+    if "generated.server" in sys.modules:
+        del sys.modules["generated.server"]
+    import generated.server as mod
+    return mod
+
+
+@pytest.fixture
+def srv():
+    return _load_server()
+
+
+def _run(tool_attr, **kwargs):
+    fn = getattr(tool_attr, "fn", tool_attr)
+    return asyncio.run(fn(**kwargs))
+
+
+def _mock_client(srv, handler):
+    """Point the server's singleton client at an httpx.MockTransport handler."""
+    client = srv.LokiClient()
+    client._client = httpx.AsyncClient(
+        base_url="http://loki.test", transport=httpx.MockTransport(handler)
+    )
+    srv._client = client
+    # No /config lookup for time snapping unless a test opts in, so handlers
+    # only see the requests under test.
+    if srv._split_interval is None:
+        srv._split_interval = 0.0
+    return client
+
+
+def _streams_body(*streams):
+    return {
+        "status": "success",
+        "data": {"resultType": "streams", "result": list(streams), "stats": {}},
+    }
+
+
+# ===========================================================================
+# Profiling hooks
+# ===========================================================================
+
+
+class TestProfiling:
+    def test_profiling_disabled_by_default(self, srv):
+        assert not srv._should_profile("loki_search_tools")
+
+    def test_profiled_call_writes_dumps_and_summary(self, srv, monkeypatch, tmp_path):
+        monkeypatch.setattr(srv, "_profiled_tools", {"loki_search_tools"})
+        monkeypatch.setattr(srv, "_profile_modes", {"cprofile", "tracemalloc"})
+        monkeypatch.setattr(srv, "LOKI_MCP_PROFILE_DIR", str(tmp_path))
+
+        result = _run(srv.loki_search_tools, keyword="query")
+        assert "matching 'query'" in result
+
+        dumps = sorted(p.suffix for p in tmp_path.iterdir())
+        assert dumps == [".prof", ".tracemalloc"]
+        summary = srv._profile_summaries[-1]
+        assert summary["tool"] == "loki_search_tools"
+        assert summary["top_functions"]
+        assert "top_allocations" in summary
+
+    def test_unselected_tool_not_profiled(self, srv, monkeypatch, tmp_path):
+        monkeypatch.setattr(srv, "_profiled_tools", {"loki_query_range"})
+        monkeypatch.setattr(srv, "LOKI_MCP_PROFILE_DIR", str(tmp_path))
+        _run(srv.loki_search_tools, keyword="query")
+        assert not list(tmp_path.iterdir())
+
+    def test_sample_rate_zero_skips(self, srv, monkeypatch):
+        monkeypatch.setattr(srv, "_profiled_tools", {"all"})
+        monkeypatch.setattr(srv, "LOKI_MCP_PROFILE_RATE", 0.0)
+        assert not srv._should_profile("loki_search_tools")
+
+    def test_server_stats_reports_profiling(self, srv):
+        result = _run(srv.loki_server_stats)
+        data = json.loads(result.split("\n\n", 1)[1])
+        assert data["profiling"]["enabled"] is False
+        assert data["profiling"]["recent"] == []
+
+
+# ===========================================================================
+# Slow-query log
+# ===========================================================================
+
+
+class TestSlowQueryLog:
+    def test_disabled_by_default(self, srv):
+        assert srv._slow_query_logger is None
+
+    def test_slow_request_written_as_ndjson(self, monkeypatch, tmp_path):
+        log_path = tmp_path / "slow.ndjson"
+        monkeypatch.setenv("LOKI_SLOW_QUERY_LOG", str(log_path))
+        monkeypatch.setenv("LOKI_SLOW_QUERY_MS", "0")
+        srv = _load_server()
+        _mock_client(srv, lambda request: httpx.Response(200, json=_streams_body()))
+
+        _run(srv.loki_query_range, query='{job="x"}', start="1h", limit=5)
+        srv._close_slow_query_log()
+
+        records = [json.loads(line) for line in log_path.read_text().splitlines()]
+        assert len(records) == 1
+        record = records[0]
+        assert record["tool"] == "loki_query_range"
+        assert record["path"] == "/loki/api/v1/query_range"
+        assert record["query"] == '{job="x"}'
+        assert record["start"].endswith("Z")
+        assert record["status"] == 200
+        assert record["bytes"] > 0
+
+    def test_fast_small_request_not_logged(self, monkeypatch, tmp_path):
+        log_path = tmp_path / "slow.ndjson"
+        monkeypatch.setenv("LOKI_SLOW_QUERY_LOG", str(log_path))
+        srv = _load_server()
+        _mock_client(srv, lambda request: httpx.Response(200, json=_streams_body()))
+
+        _run(srv.loki_query_range, query='{job="x"}')
+        srv._close_slow_query_log()
+        assert not log_path.exists()
+
+
+# ===========================================================================
+# Result merging and query planner
+# ===========================================================================
+
+
+class TestMergeStreams:
+    def test_k_way_merge_respects_direction_and_limit(self, srv):
+        a = {"result": [{"stream": {"host": "a"}, "values": [["30", "a3"], ["10", "a1"]]}]}
+        b = {"result": [{"stream": {"host": "b"}, "values": [["20", "b2"], ["5", "b0"]]}]}
+        merged = srv._merge_stream_results([a, b], direction="backward", limit=3)
+        lines = {s["stream"]["host"]: [v[1] for v in s["values"]] for s in merged["result"]}
+        assert lines == {"a": ["a3", "a1"], "b": ["b2"]}
+
+    def test_same_labels_combined(self, srv):
+        a = {"result": [{"stream": {"host": "a"}, "values": [["1", "x"]]}]}
+        b = {"result": [{"stream": {"host": "a"}, "values": [["2", "y"]]}]}
+        merged = srv._merge_stream_results([a, b], direction="forward")
+        assert merged["result"] == [{"stream": {"host": "a"}, "values": [["1", "x"], ["2", "y"]]}]
+
+
+class TestQueryPlanner:
+    def test_extract_selector(self, srv):
+        assert srv._extract_selector('{job="a}b"} |= "x"') == '{job="a}b"}'
+        assert srv._extract_selector('sum(rate({job="x"}[5m]))') == '{job="x"}'
+        assert srv._extract_selector("not logql") == ""
+
+    def _handler(self, est_bytes, calls):
+        def handler(request):
+            calls.append(request)
+            path = request.url.path
+            if path == "/loki/api/v1/index/stats":
+                return httpx.Response(200, json={"streams": 3, "chunks": 40, "entries": 1, "bytes": est_bytes})
+            if path == "/loki/api/v1/index/shards":
+                return httpx.Response(404, text="404 page not found")
+            if path == "/loki/api/v1/labels":
+                return httpx.Response(200, json={"status": "success", "data": ["host", "namespace"]})
+            start = request.url.params.get("start", "1")
+            return httpx.Response(200, json=_streams_body(
+                {"stream": {"job": "x"}, "values": [[start, f"line@{start}"]]}
+            ))
+        return handler
+
+    def test_planner_off_by_default(self, srv):
+        calls = []
+        _mock_client(srv, self._handler(10, calls))
+        _run(srv.loki_query_range, query='{job="x"}')
+        assert [c.url.path for c in calls] == ["/loki/api/v1/query_range"]
+
+    def test_rejects_runaway_query(self, srv, monkeypatch):
+        monkeypatch.setattr(srv, "LOKI_QUERY_PLANNER", True)
+        monkeypatch.setattr(srv, "LOKI_PLANNER_MAX_BYTES", 1000)
+        calls = []
+        _mock_client(srv, self._handler(10_000, calls))
+        result = _run(srv.loki_search_logs, labels={"job": "x"}, start="7d")
+        data = json.loads(result.split("\n\n", 1)[1])
+        assert data["message"] == "Query too expensive — narrow it."
+        assert data["suggestions"]["add_labels"][:2] == ["namespace", "host"]
+        assert "/loki/api/v1/query_range" not in [c.url.path for c in calls]
+
+    def test_shards_time_range(self, srv, monkeypatch):
+        monkeypatch.setattr(srv, "LOKI_QUERY_PLANNER", True)
+        monkeypatch.setattr(srv, "LOKI_PLANNER_SHARD_BYTES", 100)
+        monkeypatch.setattr(srv, "LOKI_PLANNER_MAX_SHARDS", 4)
+        calls = []
+        _mock_client(srv, self._handler(1000, calls))
+        result = _run(srv.loki_query_range, query='{job="x"}', start="4h", limit=3)
+        data = json.loads(result.split("\n\n", 1)[1])
+        ranges = [c for c in calls if c.url.path == "/loki/api/v1/query_range"]
+        assert len(ranges) == 4
+        assert data["plan"]["shards"] == 4
+        values = data["result"][0]["values"]
+        assert len(values) == 3
+        assert [int(v[0]) for v in values] == sorted((int(v[0]) for v in values), reverse=True)
+
+
+class TestStreamSharding:
+    SERIES = [
+        {"job": "x", "pod": "a", "filename": "/1"},
+        {"job": "x", "pod": "a", "filename": "/2"},
+        {"job": "x", "pod": "b", "filename": "/3"},
+        {"job": "x", "filename": "/4"},
+    ]
+
+    def test_partition_picks_most_selective_label(self, srv):
+        label, buckets = srv._partition_streams(self.SERIES, '{job="x"}', 2)
+        assert label == "filename"
+        assert sorted(v for b in buckets for v in b) == ["/1", "/2", "/3", "/4"]
+        assert len(buckets) == 2
+
+    def test_partition_includes_missing_label_as_empty(self, srv):
+        label, buckets = srv._partition_streams(self.SERIES, '{job="x", filename="/1"}', 3)
+        assert label == "pod"
+        assert sorted(v for b in buckets for v in b) == ["", "a", "b"]
+
+    def test_groups_queried_concurrently_with_per_group_limit(self, srv):
+        queries = []
+
+        def handler(request):
+            if request.url.path == "/loki/api/v1/series":
+                return httpx.Response(200, json={"status": "success", "data": self.SERIES})
+            query = request.url.params["query"]
+            queries.append((query, request.url.params["limit"]))
+            return httpx.Response(200, json=_streams_body(
+                {"stream": {"job": "x", "q": query}, "values": [["2", "new"], ["1", "old"]]}
+            ))
+
+        _mock_client(srv, handler)
+        result = _run(srv.loki_query_range, query='{job="x"} |= "err"', limit=2, stream_groups=2)
+        data = json.loads(result.split("\n\n", 1)[1])
+        assert data["sharding"] == {"label": "filename", "groups": 2, "streams": 4}
+        assert len(queries) == 2
+        for query, limit in queries:
+            assert query.startswith('{job="x", filename=~"')
+            assert query.endswith('|= "err"')
+            assert limit == "2"
+        assert sum(len(s["values"]) for s in data["result"]) == 4
+
+
+# ===========================================================================
+# Single-flight request coalescing
+# ===========================================================================
+
+
+class TestSingleFlight:
+    def _slow_labels(self, calls, delay=0.05):
+        async def handler(request):
+            calls.append(request)
+            await asyncio.sleep(delay)
+            return httpx.Response(200, json={"status": "success", "data": ["host"]})
+        return handler
+
+    def test_identical_gets_share_one_request(self, srv):
+        calls = []
+        client = _mock_client(srv, self._slow_labels(calls))
+
+        async def burst():
+            return await asyncio.gather(*(client.request("GET", "/loki/api/v1/labels") for _ in range(5)))
+
+        responses = asyncio.run(burst())
+        assert len(calls) == 1
+        assert all(r.json()["data"] == ["host"] for r in responses)
+        stats = client.stats()["single_flight"]
+        assert stats["get_requests"] == 5
+        assert stats["coalesced"] == 4
+        assert stats["in_flight"] == 0
+
+    def test_different_params_not_coalesced(self, srv):
+        calls = []
+        client = _mock_client(srv, self._slow_labels(calls))
+
+        async def burst():
+            await asyncio.gather(
+                client.request("GET", "/loki/api/v1/labels", params={"start": "1"}),
+                client.request("GET", "/loki/api/v1/labels", params={"start": "2"}),
+            )
+
+        asyncio.run(burst())
+        assert len(calls) == 2
+
+    def test_cancelled_waiter_does_not_cancel_others(self, srv):
+        calls = []
+        client = _mock_client(srv, self._slow_labels(calls, delay=0.1))
+
+        async def scenario():
+            first = asyncio.ensure_future(client.request("GET", "/loki/api/v1/labels"))
+            second = asyncio.ensure_future(client.request("GET", "/loki/api/v1/labels"))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            resp = await second
+            return first.cancelled(), resp.status_code
+
+        assert asyncio.run(scenario()) == (True, 200)
+        assert len(calls) == 1
+
+    def test_last_waiter_cancelling_cancels_request(self, srv):
+        client = _mock_client(srv, self._slow_labels([], delay=1))
+
+        async def scenario():
+            waiter = asyncio.ensure_future(client.request("GET", "/loki/api/v1/labels"))
+            await asyncio.sleep(0.01)
+            flight = next(iter(client._inflight.values()))
+            waiter.cancel()
+            await asyncio.sleep(0.01)
+            return flight.task.cancelled()
+
+        assert asyncio.run(scenario()) is True
+
+    def test_caller_arriving_after_last_waiter_left_starts_fresh_request(self, srv):
+        calls = []
+
+        async def handler(request):
+            calls.append(request)
+            try:
+                await asyncio.sleep(0.05)
+            except asyncio.CancelledError:
+                await asyncio.sleep(0.05)  # the abandoned request takes a while to unwind
+                raise
+            return httpx.Response(200, json={"status": "success", "data": ["host"]})
+
+        client = _mock_client(srv, handler)
+
+        async def scenario():
+            waiter = asyncio.ensure_future(client.request("GET", "/loki/api/v1/labels"))
+            while not calls:
+                await asyncio.sleep(0.001)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            # The abandoned request is still unwinding: must not join it.
+            return (await client.request("GET", "/loki/api/v1/labels")).status_code
+
+        assert asyncio.run(scenario()) == 200
+        assert len(calls) == 2
+
+    def test_joiner_does_not_inherit_starters_deadline(self, srv):
+        calls = []
+
+        async def handler(request):
+            calls.append(request)
+            await asyncio.sleep(0.05)
+            if request.extensions["timeout"]["read"] < 1:
+                raise httpx.ReadTimeout("cut short by the starter's budget", request=request)
+            return httpx.Response(200, json={"status": "success", "data": ["host"]})
+
+        client = _mock_client(srv, handler)
+
+        async def call(budget):
+            if budget is not None:
+                srv._current_deadline.set(time.monotonic() + budget)
+            return await client.request("GET", "/loki/api/v1/labels")
+
+        async def scenario():
+            starter = asyncio.ensure_future(call(0.5))
+            await asyncio.sleep(0.01)
+            joiner = asyncio.ensure_future(call(None))
+            return await asyncio.gather(starter, joiner, return_exceptions=True)
+
+        starter, joiner = asyncio.run(scenario())
+        assert isinstance(starter, httpx.ReadTimeout)
+        assert joiner.status_code == 200
+        assert len(calls) == 2
+
+    def test_priority_classes_not_coalesced(self, srv):
+        calls = []
+        client = _mock_client(srv, self._slow_labels(calls))
+
+        async def burst():
+            await asyncio.gather(
+                client.request("GET", "/loki/api/v1/labels"),
+                srv._as_bulk(client.request("GET", "/loki/api/v1/labels")),
+            )
+
+        asyncio.run(burst())
+        assert len(calls) == 2
+
+
+# ===========================================================================
+# Multi-tenant fan-out
+# ===========================================================================
+
+
+class TestMultiTenant:
+    def _handler(self, seen):
+        def handler(request):
+            org_id = request.headers.get("X-Scope-OrgID", "")
+            seen.append(org_id)
+            if org_id == "broken":
+                return httpx.Response(500, json={"message": "tenant store unavailable"})
+            ts = {"team-a": "30", "team-b": "20"}.get(org_id, "10")
+            return httpx.Response(200, json=_streams_body(
+                {"stream": {"job": "x"}, "values": [[ts, f"from {org_id}"]]}
+            ))
+        return handler
+
+    def test_default_uses_single_tenant(self, srv):
+        seen = []
+        _mock_client(srv, self._handler(seen))
+        _run(srv.loki_query_range, query='{job="x"}')
+        assert seen == [""]
+
+    def test_fan_out_merges_with_tenant_label(self, srv):
+        seen = []
+        _mock_client(srv, self._handler(seen))
+        result = _run(srv.loki_query_range, query='{job="x"}', tenants="team-a,team-b,broken")
+        data = json.loads(result.split("\n\n", 1)[1])
+        assert sorted(seen) == ["broken", "team-a", "team-b"]
+        assert [s["stream"]["__tenant_id__"] for s in data["result"]] == ["team-a", "team-b"]
+        assert data["tenants"]["team-a"]["status"] == "ok"
+        assert data["tenants"]["broken"]["status"] == "error"
+        assert "elapsed_ms" in data["tenants"]["broken"]
+
+    def test_star_expands_configured_tenants(self, srv, monkeypatch):
+        monkeypatch.setattr(srv, "_tenants", ["team-a", "team-b"])
+        assert srv._resolve_tenants("*") == ["team-a", "team-b"]
+
+    def test_all_tenants_failing_is_an_error(self, srv):
+        _mock_client(srv, self._handler([]))
+        result = _run(srv.loki_query_range, query='{job="x"}', tenants="broken")
+        assert result.startswith("Error: all 1 tenant(s) failed")
+
+
+# ===========================================================================
+# Federated backends
+# ===========================================================================
+
+
+class TestFederation:
+    def _backend(self, srv, name, ts, fail=False):
+        def handler(request):
+            if fail:
+                return httpx.Response(503, json={"message": "cluster down"})
+            return httpx.Response(200, json=_streams_body(
+                {"stream": {"job": "x"}, "values": [[ts, f"from {name}"]]}
+            ))
+        return _mock_client(srv, handler)
+
+    def test_single_url_is_not_federated(self, srv):
+        assert srv._federation == {}
+        assert list(srv._backend_urls) == ["default"]
+
+    def test_named_urls_build_backends(self, monkeypatch):
+        monkeypatch.setenv("LOKI_URL", "eu=http://loki-eu:3100,us=http://loki-us:3100")
+        srv = _load_server()
+        try:
+            assert list(srv._federation) == ["eu", "us"]
+            assert str(srv._federation["us"]._client.base_url) == "http://loki-us:3100"
+            assert srv._client is srv._federation["eu"]
+        finally:
+            monkeypatch.delenv("LOKI_URL")
+            _load_server()
+
+    def test_k_way_merge_across_backends(self, srv, monkeypatch):
+        backends = {
+            "eu": self._backend(srv, "eu", "10"),
+            "us": self._backend(srv, "us", "30"),
+            "ap": self._backend(srv, "ap", "20", fail=True),
+        }
+        monkeypatch.setattr(srv, "_federation", backends)
+        result = _run(srv.loki_query_range, query='{job="x"}', direction="backward")
+        data = json.loads(result.split("\n\n", 1)[1])
+        assert [s["stream"]["__backend__"] for s in data["result"]] == ["us", "eu"]
+        assert data["backends"]["eu"]["status"] == "ok"
+        assert data["backends"]["ap"]["status"] == "error"
+        assert "elapsed_ms" in data["backends"]["us"]
+
+    def test_all_backends_failing_is_an_error(self, srv, monkeypatch):
+        monkeypatch.setattr(srv, "_federation", {"eu": self._backend(srv, "eu", "1", fail=True)})
+        result = _run(srv.loki_search_logs, host="web1", pattern="boom")
+        assert result.startswith("Error: all 1 backend(s) failed")
+
+
+# ===========================================================================
+# Replica load balancing
+# ===========================================================================
+
+
+class TestReplicaBalancing:
+    def _client(self, srv, handler):
+        client = srv.LokiClient("http://qf-1:3100|http://qf-2:3100")
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return client
+
+    def test_single_url_has_one_replica(self, srv):
+        assert [r.url for r in srv.LokiClient("http://loki:3100").replicas] == ["http://loki:3100"]
+
+    def test_least_outstanding_replica_is_chosen(self, srv):
+        client = self._client(srv, lambda request: httpx.Response(200))
+        client.replicas[0].outstanding = 3
+        assert client._pick_replica() is client.replicas[1]
+        assert client._pick_replica(exclude=client.replicas[1]) is client.replicas[0]
+
+    def test_failing_replica_is_ejected_and_readmitted(self, srv):
+        hosts = []
+
+        def handler(request):
+            hosts.append(request.url.host)
+            if request.url.host == "qf-1":
+                return httpx.Response(503, text="unavailable")
+            return httpx.Response(200, json={"status": "success", "data": []})
+
+        client = self._client(srv, handler)
+
+        async def go():
+            for _ in range(10):
+                await client.request("GET", "/loki/api/v1/labels")
+            ejected = client.replicas[0].healthy
+            await client._check_replica(client.replicas[0])
+            await client.close()
+            return ejected
+
+        was_healthy = asyncio.run(go())
+        assert not was_healthy
+        assert hosts.count("qf-1") == srv.LOKI_EJECT_FAILURES + 1
+        assert hosts[-1] == "qf-1"  # the /ready probe
+        assert not client.replicas[0].healthy
+
+    def test_probe_readmits_ready_replica(self, srv):
+        client = self._client(srv, lambda request: httpx.Response(200, text="ready"))
+        client.replicas[1].healthy = False
+        asyncio.run(client._check_replica(client.replicas[1]))
+        assert client.replicas[1].healthy
+        assert client.stats()["replicas"][1]["healthy"] is True
+
+
+# ===========================================================================
+# Hedged requests
+# ===========================================================================
+
+
+class TestHedging:
+    def _client(self, srv, monkeypatch, slow_host="qf-1"):
+        monkeypatch.setattr(srv, "LOKI_HEDGE", True)
+        hosts = []
+
+        async def handler(request):
+            hosts.append(request.url.host)
+            if request.url.host == slow_host:
+                await asyncio.sleep(2)
+            return httpx.Response(200, json={"status": "success", "data": [request.url.host]})
+
+        client = srv.LokiClient("http://qf-1:3100|http://qf-2:3100")
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        client._latencies["/loki/api/v1/labels"] = srv.deque([0.01] * 50)
+        client.replicas[1].outstanding = 5  # make qf-1 the primary
+        return client, hosts
+
+    def test_no_hedge_without_latency_history(self, srv, monkeypatch):
+        client, hosts = self._client(srv, monkeypatch, slow_host="none")
+        client._latencies.clear()
+        assert client._hedge_delay("/loki/api/v1/labels") is None
+        asyncio.run(client.request("GET", "/loki/api/v1/labels"))
+        assert hosts == ["qf-1"]
+
+    def test_slow_primary_is_hedged_to_other_replica(self, srv, monkeypatch):
+        client, hosts = self._client(srv, monkeypatch)
+        client.hedge_eligible = 100
+        started = time.perf_counter()
+        resp = asyncio.run(client.request("GET", "/loki/api/v1/labels"))
+        assert time.perf_counter() - started < 1
+        assert resp.json()["data"] == ["qf-2"]
+        assert hosts == ["qf-1", "qf-2"]
+        assert (client.hedged, client.hedge_wins) == (1, 1)
+        assert client.replicas[0].outstanding == 0  # loser was cancelled
+
+    def test_budget_caps_hedges(self, srv, monkeypatch):
+        monkeypatch.setattr(srv, "LOKI_HEDGE_BUDGET", 0.0)
+        client, hosts = self._client(srv, monkeypatch)
+        client.hedge_eligible = 100
+        asyncio.run(client.request("GET", "/loki/api/v1/labels"))
+        assert hosts == ["qf-1"]
+        assert client.hedged == 0
+
+    def test_fast_endpoints_do_not_set_delay_for_slow_ones(self, srv, monkeypatch):
+        client, hosts = self._client(srv, monkeypatch, slow_host="none")
+        client._latencies["/loki/api/v1/query_range"] = srv.deque([2.0] * 50)
+        assert client._hedge_delay("/loki/api/v1/labels") == 0.01
+        assert client._hedge_delay("/loki/api/v1/query_range") == 2.0
+        assert client._hedge_delay("/loki/api/v1/series") is None
+        client.hedge_eligible = 100
+        asyncio.run(client.request("GET", "/loki/api/v1/query_range", params={"query": '{job="x"}'}))
+        assert hosts == ["qf-1"]
+        assert client.hedged == 0
+        assert set(client.stats()["hedging"]["delay_ms"]) == {"/loki/api/v1/labels", "/loki/api/v1/query_range"}
+
+
+# ===========================================================================
+# Adaptive concurrency limiter
+# ===========================================================================
+
+
+class TestConcurrencyLimiter:
+    def test_interactive_requests_jump_the_queue(self, srv):
+        limiter = srv._Limiter()
+        limiter.limit = 1.0
+        order = []
+
+        async def worker(name, priority):
+            await limiter.acquire(priority)
+            order.append(name)
+            limiter.release()
+
+        async def go():
+            await limiter.acquire("interactive")
+            tasks = [
+                asyncio.ensure_future(worker("bulk-1", "bulk")),
+                asyncio.ensure_future(worker("bulk-2", "bulk")),
+                asyncio.ensure_future(worker("search", "interactive")),
+            ]
+            await asyncio.sleep(0)
+            assert limiter.queued == 3
+            limiter.release()
+            await asyncio.gather(*tasks)
+
+        asyncio.run(go())
+        assert order == ["search", "bulk-1", "bulk-2"]
+        assert (limiter.in_flight, limiter.queued) == (0, 0)
+
+    def test_aimd_adjusts_limit(self, srv):
+        limiter = srv._Limiter()
+        limiter.limit = 8.0
+        limiter.on_overload()
+        assert limiter.limit == 4.0
+        for _ in range(4):
+            limiter.on_success(0.01)
+        assert 4.9 < limiter.limit < 5.1
+
+    def test_latency_spike_counts_as_overload(self, srv):
+        limiter = srv._Limiter()
+        for _ in range(20):
+            limiter.on_success(0.01)
+        before = limiter.limit
+        limiter._last_decrease = 0.0
+        for _ in range(5):
+            limiter.on_success(1.0)
+        assert limiter.limit < before
+        assert limiter.decreases >= 1
+
+    def test_mixed_fast_and_slow_endpoints_do_not_shrink_limit(self, srv):
+        limiter = srv._Limiter()
+        limiter.limit = 8.0
+        for _ in range(5):
+            for _ in range(20):
+                limiter.on_success(0.005, "/loki/api/v1/labels")
+            limiter.on_success(1.5, "/loki/api/v1/query_range")
+        assert limiter.decreases == 0
+        assert limiter.limit > 8.0
+
+    def test_limiter_off_by_default(self, srv):
+        assert srv.LOKI_ADAPTIVE_CONCURRENCY is False
+        statuses = iter([503, 429, 200, 200])
+        client = _mock_client(srv, lambda request: httpx.Response(next(statuses), json={"data": []}))
+        before = client.limiter.limit
+
+        async def go():
+            for i in range(4):
+                await client.request("POST", "/loki/api/v1/push", content=str(i))
+
+        asyncio.run(go())
+        stats = client.limiter.stats()
+        assert (stats["enabled"], stats["decreases"], stats["latency_ms"]) == (False, 0, {})
+        assert client.limiter.limit == before
+
+    def test_full_queue_rejects_and_cancelled_waiters_leave(self, srv, monkeypatch):
+        monkeypatch.setattr(srv, "LOKI_MAX_QUEUE", 1)
+        limiter = srv._Limiter()
+        limiter.limit = 1.0
+
+        async def go():
+            await limiter.acquire("interactive")
+            waiter = asyncio.ensure_future(limiter.acquire("bulk"))
+            await asyncio.sleep(0)
+            with pytest.raises(RuntimeError, match="overloaded"):
+                await limiter.acquire("interactive")
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            limiter.release()
+
+        asyncio.run(go())
+        assert (limiter.in_flight, limiter.queued, limiter.rejected) == (0, 0, 1)
+
+    def test_client_reports_limiter_stats(self, srv, monkeypatch):
+        monkeypatch.setattr(srv, "LOKI_ADAPTIVE_CONCURRENCY", True)
+        client = _mock_client(srv, lambda request: httpx.Response(429, json={"message": "slow down"}))
+        limit = client.limiter.limit
+        asyncio.run(client.request("GET", "/loki/api/v1/labels"))
+        stats = client.stats()["concurrency"]
+        assert stats["limit"] == int(limit * srv._Limiter.BACKOFF)
+        assert stats["in_flight"] == 0
+
+
+# ===========================================================================
+# Deadline propagation and cancellation
+# ===========================================================================
+
+
+class TestDeadlines:
+    def test_remaining_budget_becomes_request_timeout(self, srv, monkeypatch):
+        monkeypatch.setattr(srv, "LOKI_TOOL_TIMEOUT", 5.0)
+        timeouts = []
+
+        def handler(request):
+            timeouts.append(request.extensions["timeout"]["read"])
+            return httpx.Response(200, json={"status": "success", "data": []})
+
+        _mock_client(srv, handler)
+        _run(srv.loki_list_labels)
+        assert 0 < timeouts[0] <= 5.0
+
+    def test_expired_deadline_sends_nothing(self, srv):
+        calls = []
+        client = _mock_client(srv, lambda request: calls.append(request) or httpx.Response(200))
+
+        async def go():
+            srv._current_deadline.set(time.monotonic() - 1)
+            await client.request("GET", "/loki/api/v1/labels")
+
+        with pytest.raises(srv.DeadlineExceeded):
+            asyncio.run(go())
+        assert calls == []
+        assert client.limiter.in_flight == 0
+
+    def test_first_failure_cancels_sibling_shards(self, srv):
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def fail():
+            raise httpx.ConnectError("querier gone")
+
+        with pytest.raises(httpx.ConnectError):
+            asyncio.run(srv._gather_cancelling(slow(), fail()))
+        assert cancelled == [True]
+
+    def test_cancelling_tool_cancels_loki_request(self, srv):
+        cancelled = []
+        started = []
+
+        async def handler(request):
+            started.append(request.url.path)
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(request.url.path)
+                raise
+            return httpx.Response(200)
+
+        client = _mock_client(srv, handler)
+
+        async def go():
+            call = asyncio.ensure_future(srv.loki_query_range(query='{job="x"}'))
+            while not started:
+                await asyncio.sleep(0.01)
+            call.cancel()
+            await asyncio.gather(call, return_exceptions=True)
+            await asyncio.sleep(0)
+
+        asyncio.run(go())
+        assert cancelled == ["/loki/api/v1/query_range"]
+        assert client._inflight == {}
+
+
+# ===========================================================================
+# Partial results
+# ===========================================================================
+
+
+class TestPartialResults:
+    def test_overview_returns_finished_sections(self, srv):
+        async def handler(request):
+            path = request.url.path
+            if path.endswith("/label/host/values"):
+                await asyncio.sleep(5)
+            if path == "/ready":
+                return httpx.Response(200, text="ready")
+            if path.endswith("buildinfo"):
+                return httpx.Response(500, text="boom")
+            return httpx.Response(200, json={"status": "success", "data": ["a"]})
+
+        _mock_client(srv, handler)
+        started = time.perf_counter()
+        result = _run(srv.loki_get_overview, timeout=0.2)
+        assert time.perf_counter() - started < 2
+        assert "partial: 2 section(s) missing" in result
+        data = json.loads(result.split("\n\n", 1)[1])
+        assert data["ready"] is True
+        assert data["labels"] == ["a"]
+        assert "deadline exceeded" in data["partial"]["missing"]["hosts"]
+        assert "HTTP 500" in data["partial"]["missing"]["buildinfo"]
+        assert data["partial"]["resume"] == {"sections": "buildinfo,hosts"}
+
+    def test_overview_resumes_selected_sections(self, srv):
+        paths = []
+
+        def handler(request):
+            paths.append(request.url.path)
+            return httpx.Response(200, json={"status": "success", "data": ["web1"]})
+
+        _mock_client(srv, handler)
+        data = json.loads(_run(srv.loki_get_overview, sections="hosts").split("\n\n", 1)[1])
+        assert paths == ["/loki/api/v1/label/host/values"]
+        assert data == {"hosts": ["web1"]}
+        assert "Unknown section" in _run(srv.loki_get_overview, sections="nope")
+
+    def test_compare_hosts_queries_each_host(self, srv):
+        async def handler(request):
+            query = request.url.params["query"]
+            if 'host="slow"' in query:
+                await asyncio.sleep(5)
+            host = query.split('host="', 1)[1].split('"', 1)[0]
+            return httpx.Response(200, json=_streams_body(
+                {"stream": {"host": host}, "values": [["10", "x"], ["5", "y"]]}
+            ))
+
+        _mock_client(srv, handler)
+        result = _run(srv.loki_compare_hosts, hosts="a,b,slow", exclude="ping", timeout=0.2)
+        data = json.loads(result.split("\n\n", 1)[1])
+        assert data["lines_per_host"] == {"a": 2, "b": 2}
+        assert data["queries"] == {host: f'{{host="{host}"}} != "ping"' for host in ("a", "b", "slow")}
+        assert data["partial"]["resume"] == {"hosts": "slow"}
+
+
+# ===========================================================================
+# Filter pushdown
+# ===========================================================================
+
+
+class TestFilterPushdown:
+    def _handler(self, queries):
+        def handler(request):
+            if request.url.path == "/loki/api/v1/labels":
+                return httpx.Response(200, json={"status": "success", "data": ["host", "job"]})
+            queries.append(request.url.params["query"])
+            return httpx.Response(200, json=_streams_body(
+                {"stream": {"job": "x", "host": "doc1", "level": "error"}, "values": [["10", "a"]]},
+                {"stream": {"job": "x", "host": "doc1", "level": "info"}, "values": [["9", "b"]]},
+            ))
+        return handler
+
+    def test_stream_label_equality_is_pushed(self, srv):
+        queries = []
+        _mock_client(srv, self._handler(queries))
+        result = _run(
+            srv.loki_query_range,
+            query='{job="x"} |= "boom"',
+            filter_query={"host": "doc1", "level": "error"},
+        )
+        data = json.loads(result.split("\n\n", 1)[1])
+        assert queries == ['{job="x", host="doc1"} |= "boom"']
+        assert data["pushdown"]["filters"] == {"host": "doc1"}
+        # level is not an index label, so it is still filtered client-side
+        assert [s["stream"]["level"] for s in data["result"]] == ["error"]
+
+    def test_metric_queries_are_not_rewritten(self, srv):
+        client = _mock_client(srv, self._handler([]))
+        query = 'sum by (host) (rate({job="x"}[5m]))'
+        assert asyncio.run(srv._push_down_filters(client, query, {"host": "doc1"})) == (
+            query, {"host": "doc1"}, {}
+        )
+
+    def test_values_are_escaped_and_label_names_cached(self, srv):
+        calls = []
+
+        def handler(request):
+            calls.append(request.url.path)
+            return httpx.Response(200, json={"status": "success", "data": ["path"]})
+
+        client = _mock_client(srv, handler)
+
+        async def go():
+            first = await srv._push_down_filters(client, '{job="x"}', {"path": 'C:\\logs "a"'})
+            await srv._push_down_filters(client, '{job="x"}', {"path": "/var"})
+            return first
+
+        query, remaining, _pushed = asyncio.run(go())
+        assert query == '{job="x", path="C:\\\\logs \\"a\\""}'
+        assert remaining is None
+        assert calls == ["/loki/api/v1/labels"]
+
+
+# ===========================================================================
+# Filter expressions
+# ===========================================================================
+
+
+class TestFilterEngine:
+    ITEMS = [
+        {"host": "web1", "status": "200", "level": "info"},
+        {"host": "web2", "status": "503", "level": "error"},
+        {"host": "db1", "status": "404", "level": "warn"},
+        {"host": "db2", "level": "debug"},
+    ]
+
+    def _hosts(self, srv, query):
+        return [i["host"] for i in srv._filter_results(self.ITEMS, query=query)]
+
+    def test_plain_values_mean_equality(self, srv):
+        assert self._hosts(srv, {"host": "web1"}) == ["web1"]
+        assert self._hosts(srv, {"status": 503}) == ["web2"]
+
+    def test_operators(self, srv):
+        assert self._hosts(srv, {"status": {">=": 400}}) == ["web2", "db1"]
+        assert self._hosts(srv, {"status": {">=": 400, "<": 500}}) == ["db1"]
+        assert self._hosts(srv, {"host": {"=~": "web.*"}}) == ["web1", "web2"]
+        assert self._hosts(srv, {"host": {"=~": "web"}}) == []  # anchored, like LogQL
+        assert self._hosts(srv, {"host": {"!~": "db.*"}, "level": {"!=": "info"}}) == ["web2"]
+        assert self._hosts(srv, {"level": {"in": ["warn", "debug"]}}) == ["db1", "db2"]
+
+    def test_stream_items_and_projection(self, srv):
+        data = {"result": [{"stream": i, "values": []} for i in self.ITEMS]}
+        out = srv._filter_results(
+            data, fields="host,level", query={"level": {"in": ["error"]}},
+            filter_path="result", filter_label_key="stream",
+        )
+        assert out["result"] == [{"stream": {"host": "web2", "level": "error"}, "values": []}]
+
+    def test_invalid_filters_are_rejected_before_querying(self, srv):
+        calls = []
+        _mock_client(srv, lambda request: calls.append(request) or httpx.Response(200))
+        for bad in ({"status": {"~=": 1}}, {"host": {"=~": "("}}, {"status": {">": "x"}}):
+            result = _run(srv.loki_query_range, query='{job="x"}', filter_query=bad)
+            assert "Invalid filter_query" in result
+        assert calls == []
+
+    def test_pushdown_of_operator_filters(self, srv):
+        client = _mock_client(srv, lambda request: httpx.Response(
+            200, json={"status": "success", "data": ["host", "status"]}
+        ))
+        query, remaining, pushed = asyncio.run(srv._push_down_filters(
+            client,
+            '{job="x"}',
+            {"host": {"in": ["web.1", "web2"]}, "status": {">=": 500}, "level": "error"},
+        ))
+        assert query == '{job="x", host=~"web\\\\.1|web2"}'
+        assert remaining == {"status": {">=": 500}, "level": "error"}
+        assert list(pushed) == ["host"]
+
+
+# ===========================================================================
+# Line field projection
+# ===========================================================================
+
+
+class TestLineFields:
+    LINE = '{"level": "error", "status": 500, "path": "/api/1", "req": {"id": "r1"}}'
+
+    def test_pipeline_extracts_joins_and_drops(self, srv):
+        assert srv._line_fields_pipeline(["status", "req.id"], "json") == (
+            ' | json mcp_field_0="status", mcp_field_1="req.id"'
+            ' | line_format "{{.mcp_field_0}}\\u001f{{.mcp_field_1}}"'
+            " | drop mcp_field_0, mcp_field_1, __error__, __error_details__"
+        )
+
+    def test_server_side_projection(self, srv):
+        queries = []
+
+        def handler(request):
+            query = request.url.params["query"]
+            queries.append(query)
+            line = self.LINE if request.url.params["limit"] == "1" else "500\x1f/api/1"
+            return httpx.Response(200, json=_streams_body(
+                {"stream": {"format": "json"}, "values": [["10", line]]}
+            ))
+
+        _mock_client(srv, handler)
+        result = _run(srv.loki_search_logs, host="h", line_fields="status,path")
+        data = json.loads(result.split("\n\n", 1)[1])
+        assert queries[0] == '{host="h"}'  # the sniff
+        assert "| json mcp_field_0=" in queries[1]
+        assert data["result"][0]["values"][0][1] == {"status": "500", "path": "/api/1"}
+        assert data["line_fields"]["mode"] == "server"
+
+    def test_rejected_projection_falls_back_to_client_parsing(self, srv):
+        def handler(request):
+            if "line_format" in request.url.params["query"]:
+                return httpx.Response(400, json={"message": "parse error: unexpected drop"})
+            return httpx.Response(200, json=_streams_body(
+                {"stream": {"job": "x"}, "values": [["10", 'level=warn msg="disk \\"sda\\" slow" took=3ms']]}
+            ))
+
+        _mock_client(srv, handler)
+        result = _run(
+            srv.loki_query_range, query='{job="x"}', line_fields="level,msg,missing", line_parser="logfmt"
+        )
+        data = json.loads(result.split("\n\n", 1)[1])
+        assert data["result"][0]["values"][0][1] == {"level": "warn", "msg": 'disk "sda" slow', "missing": ""}
+        assert data["line_fields"]["mode"] == "client"
+        assert "parse error" in data["line_fields"]["fallback_reason"]
+
+    @pytest.mark.parametrize("status", [429, 500, 503])
+    def test_overload_errors_are_not_retried_without_projection(self, srv, status):
+        queries = []
+
+        def handler(request):
+            queries.append(request.url.params["query"])
+            return httpx.Response(status, json={"message": "too many outstanding requests"})
+
+        _mock_client(srv, handler)
+        result = _run(srv.loki_query_range, query='{job="x"}', line_fields="level", line_parser="logfmt")
+        assert f"HTTP {status}" in result
+        assert len(queries) == 1 and "line_format" in queries[0]
+
+    def test_client_side_parsing_of_nested_json(self, srv):
+        parsed = srv._parse_line(self.LINE, "auto")
+        assert srv._field_value(parsed, "req.id") == "r1"
+        assert srv._field_value(parsed, "status") == "500"
+        assert srv._parse_line("plain text line", "json") is None
+
+    def test_metric_queries_are_rejected(self, srv):
+        result = _run(srv.loki_query_range, query='rate({job="x"}[5m])', line_fields="status")
+        assert "only applies to log queries" in result
+
+
+# ===========================================================================
+# Query builder
+# ===========================================================================
+
+
+class TestQueryBuilder:
+    def test_canonical_order_and_escaping(self, srv):
+        query = srv._build_log_query(
+            {"host": 'we"b', "app": "x"},
+            pattern=r"\d+ms",
+            exclude="healthcheck|ping",
+        )
+        assert query == r'{app="x", host="we\"b"} != "healthcheck" != "ping" |~ "\\d+ms"'
+
+    def test_literal_pattern_uses_contains_before_regexes(self, srv):
+        query = srv._build_log_query({"job": "x"}, pattern="timeout", exclude="GET /health.*")
+        assert query == '{job="x"} |= "timeout" !~ "GET /health.*"'
+
+    def test_severity_levels(self, srv):
+        levels = srv._severity_at_least("WARNING")
+        assert levels == ["warn", "error", "critical", "fatal"]
+        assert srv._build_log_query({"job": "x"}, levels=levels) == (
+            '{job="x"} | detected_level=~"warn|error|critical|fatal"'
+        )
+        assert srv._build_log_query({"job": "x"}, levels=levels, level_source="line") == (
+            '{job="x"} |~ "(?i)(warn|error|critical|fatal)"'
+        )
+
+    def _severity_handler(self, queries, index_labels=("host",)):
+        def handler(request):
+            if request.url.path == "/loki/api/v1/labels":
+                return httpx.Response(200, json={"status": "success", "data": list(index_labels)})
+            query = request.url.params["query"]
+            queries.append(query)
+            values = [] if "detected_level" in query else [["10", "ERROR disk full"]]
+            return httpx.Response(200, json=_streams_body({"stream": {"host": "h"}, "values": values}))
+        return handler
+
+    def test_search_logs_falls_back_to_line_regex_for_severity(self, srv):
+        queries = []
+        _mock_client(srv, self._severity_handler(queries))
+        result = _run(srv.loki_search_logs, host="h", severity="error")
+        assert queries == [
+            '{host="h"} | detected_level=~"error|critical|fatal"',
+            '{host="h"} |~ "(?i)(error|critical|fatal)"',
+        ]
+        assert result.startswith('Query: {host="h"} |~ "(?i)(error|critical|fatal)"\nStreams: 1, Log lines: 1')
+
+        # The fallback is remembered for this selector: one round trip next time.
+        queries.clear()
+        _run(srv.loki_search_logs, host="h", severity="warn")
+        assert queries == ['{host="h"} |~ "(?i)(warn|error|critical|fatal)"']
+
+    def test_detected_level_index_label_skips_retry(self, srv):
+        queries = []
+        _mock_client(srv, self._severity_handler(queries, index_labels=("host", "detected_level")))
+        # An empty detected_level result is final when the label is indexed.
+        result = _run(srv.loki_search_logs, host="h", severity="fatal")
+        assert queries == ['{host="h"} | detected_level=~"fatal"']
+        assert "Log lines: 0" in result
+
+
+# ===========================================================================
+# LogQL parser
+# ===========================================================================
+
+
+class TestLogQLParser:
+    @pytest.mark.parametrize(
+        "query",
+        [
+            '{app="foo", env=~"prod|stage"} |= "error" != "timeout" | json | level="error" and status>=500',
+            '{a="b"} |= ip("10.0.0.0/8") or "x" | logfmt --strict | drop __error__, x="1" | line_format "{{.msg}}"',
+            '{a="b"} | pattern "<ip> - <_>" | size>20KB or (duration<1.5s and method!="GET")',
+            "sum by (host) (rate({job=\"x\"} |= \"err\" [5m]))",
+            'quantile_over_time(0.99, {job="x"} | logfmt | unwrap duration(latency) [5m]) by (host)',
+            'sum (rate({a="b"} [1m])) / sum (rate({a="b"} [1m] offset 1h)) > bool 2',
+            'topk (5, count_over_time({a="b"} | label_format a=b, c="{{.d}}" [1h]))',
+        ],
+    )
+    def test_formatting_round_trips(self, srv, query):
+        formatted = srv._format_logql(srv._parse_logql(query))
+        assert formatted == query
+        assert srv._format_logql(srv._parse_logql(formatted)) == formatted
+
+    def test_formatting_normalizes_spacing_and_quotes(self, srv):
+        formatted = srv._format_logql(srv._parse_logql('sum by(host)(rate({job=`x\\y`}|="a"[5m]))'))
+        assert formatted == 'sum by (host) (rate({job="x\\\\y"} |= "a" [5m]))'
+
+    @pytest.mark.parametrize(
+        ("query", "message"),
+        [
+            ("{}", "at least one"),
+            ('{a=~".*"}', "at least one"),
+            ('{a="b"', "expected '}'"),
+            ('rate({a="b"})', "range"),
+            ('sum_over_time({a="b"}[5m])', "requires an unwrap"),
+            ('{a="b"} | json |', "expected label filter"),
+        ],
+    )
+    def test_invalid_queries_raise(self, srv, query, message):
+        with pytest.raises(srv.LogQLError, match=message):
+            srv._parse_logql(query)
+
+    @pytest.mark.parametrize(
+        ("query", "message"),
+        [
+            ('{job="x"} |~ "[unclosed"', "invalid regex"),
+            ('{job=~"(?=a).+"}', "RE2"),
+            ('{a="b"} | status =~ "(?<!a)b"', "RE2"),
+            ('{a="b"} | regexp "(?P<x>a)(?P=x)"', "RE2"),
+            ('{a="b"} | drop x=~"a++"', "RE2"),
+            ('rate({job="x"}[5m]) by (host)', "grouping not allowed"),
+            ('count_over_time({job="x"}[5m]) without (host)', "grouping not allowed"),
+            ('sum_over_time({job="x"} | unwrap v [5m]) by (host)', "grouping not allowed"),
+            ('rate_counter({job="x"} | unwrap v [5m]) by (host)', "grouping not allowed"),
+            ('{job=~"(?x) a b"}', "RE2"),
+            ('{job="x"} |~ "(?#c)foo"', "RE2"),
+            ('{job=~"(?a)x"}', "RE2"),
+            ('{job="x"} | msg=~"(?iL:x)"', "RE2"),
+        ],
+    )
+    def test_queries_loki_rejects_are_not_accepted_locally(self, srv, query, message):
+        with pytest.raises(srv.LogQLError, match=message):
+            srv._parse_logql(query)
+        paths = []
+
+        def handler(request):
+            paths.append(request.url.path)
+            return httpx.Response(400, json={"message": "parse error"})
+
+        _mock_client(srv, handler)
+        assert "Query is INVALID" in _run(srv.loki_validate_query, query=query)
+        assert paths == ["/loki/api/v1/format_query"]
+
+    @pytest.mark.parametrize(
+        "query",
+        [
+            '{job=~"(?i)web.+"} |~ "(?s:a.b)" | msg=~"(?im)x+" | drop y=~"(?-m:z)"',
+            'max_over_time({job="x"} | unwrap v [5m]) by (host)',
+        ],
+    )
+    def test_re2_flags_and_groupable_aggregations_accepted(self, srv, query):
+        assert srv._format_logql(srv._parse_logql(query)) == query
+
+    def test_long_queries_are_formatted_by_loki(self, srv):
+        query = '{job="x"} |= "' + "a" * 100 + '"'
+        pretty = '{job="x"}\n  |= "' + "a" * 100 + '"'
+
+        def handler(request):
+            return httpx.Response(200, text=pretty, headers={"content-type": "text/plain"})
+
+        _mock_client(srv, handler)
+        assert srv._format_logql_locally(query) is None
+        assert _run(srv.loki_format_query, query=query).endswith(pretty)
+
+    def test_canonical_form_sorts_matchers_and_grouping(self, srv):
+        assert srv._canonical_logql('sum without(pod, app)(rate({b="1",a="2"}[5m]))') == (
+            'sum without (app, pod) (rate({a="2", b="1"} [5m]))'
+        )
+        assert srv._canonical_logql("not logql") == "not logql"
+
+    def test_equivalent_queries_share_a_flight(self, srv):
+        calls = []
+
+        async def handler(request):
+            calls.append(request.url.params["query"])
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json=_streams_body())
+
+        _mock_client(srv, handler)
+
+        async def both():
+            client = await srv._get_client()
+            await asyncio.gather(
+                client.request("GET", "/loki/api/v1/query_range", params={"query": '{a="1", b="2"}'}),
+                client.request("GET", "/loki/api/v1/query_range", params={"query": '{b="2",a="1"}'}),
+            )
+
+        asyncio.run(both())
+        assert len(calls) == 1
+
+    def test_validate_and_format_answer_locally(self, srv):
+        def handler(request):
+            raise AssertionError("should not reach Loki")
+
+        _mock_client(srv, handler)
+        result = _run(srv.loki_validate_query, query='{job="x"}|="boom"')
+        assert "Query is valid" in result and '"validated_by": "local"' in result
+        assert '{job=\\"x\\"} |= \\"boom\\"' in result
+        assert _run(srv.loki_format_query, query='{job="x"}|="boom"') == '{job="x"} |= "boom"'
+
+    def test_unsupported_constructs_fall_back_to_loki(self, srv):
+        paths = []
+
+        def handler(request):
+            paths.append(request.url.path)
+            return httpx.Response(400, json={"message": "parse error at line 1, col 1: syntax error"})
+
+        _mock_client(srv, handler)
+        result = _run(srv.loki_validate_query, query="this is not logql")
+        assert paths == ["/loki/api/v1/format_query"]
+        assert "Query is INVALID" in result and "syntax error" in result
+
+
+# ===========================================================================
+# Time normalization
+# ===========================================================================
+
+
+class TestTimeNormalization:
+    NOW = 1_700_000_123  # 2023-11-14T22:15:23Z
+
+    @pytest.fixture
+    def frozen(self, srv, monkeypatch):
+        monkeypatch.setattr(srv.time, "time", lambda: self.NOW)
+        monkeypatch.setattr(srv, "_split_interval", 1800.0)
+        return srv
+
+    def test_relative_syntax(self, frozen):
+        srv = frozen
+        parse = srv._parse_timestamp
+        assert parse("now") == "2023-11-14T22:15:23Z"
+        assert parse("today") == "2023-11-14T00:00:00Z"
+        assert parse("yesterday") == "2023-11-13T00:00:00Z"
+        assert parse("now-1h30m") == parse("1h30m") == parse("90m")
+        assert srv._parse_duration("1h0m0s") == 3600
+        assert srv._parse_duration("1x") is None
+
+    def test_snaps_to_a_grid_dividing_the_split_interval(self, frozen):
+        srv = frozen
+        # 1h lookback: largest step <= 6m dividing 30m is 5m.
+        assert srv._parse_timestamp("1h") == "2023-11-14T21:15:00Z"
+        assert srv._parse_timestamp("1h", round_up=True) == "2023-11-14T21:20:00Z"
+        # Long lookbacks snap to the split interval itself.
+        assert srv._parse_timestamp("7d") == "2023-11-07T22:00:00Z"
+        assert srv._parse_timestamp("2023-11-14T21:17:01Z") == "2023-11-14T21:17:01Z"
+
+    def test_snapping_disabled(self, frozen, monkeypatch):
+        monkeypatch.setattr(frozen, "_split_interval", 0.0)
+        assert frozen._parse_timestamp("1h") == "2023-11-14T21:15:23Z"
+
+    def test_split_interval_read_once_from_config(self, srv):
+        paths = []
+
+        def handler(request):
+            paths.append(request.url.path)
+            if request.url.path == "/config":
+                return httpx.Response(200, text="limits_config:\n  split_queries_by_interval: 15m\n")
+            return httpx.Response(200, json=_streams_body())
+
+        _mock_client(srv, handler)
+        srv._split_interval = None
+        _run(srv.loki_query_range, query='{job="x"}', start="1h")
+        _run(srv.loki_query_range, query='{job="x"}', start="1h")
+        assert paths == ["/config", "/loki/api/v1/query_range", "/loki/api/v1/query_range"]
+        assert srv._split_interval == 900
+
+    def test_unreadable_config_uses_default(self, srv):
+        _mock_client(srv, lambda request: httpx.Response(403, text="forbidden"))
+        srv._split_interval = None
+        asyncio.run(srv._get_client())
+        assert srv._split_interval == srv._DEFAULT_SPLIT_INTERVAL
+
+
+# ===========================================================================
+# Metric downsampling
+# ===========================================================================
+
+
+def _matrix_body(*series):
+    return {"status": "success", "data": {"resultType": "matrix", "result": list(series), "stats": {}}}
+
+
+class TestMetricDownsampling:
+    def test_lttb_keeps_endpoints_and_spikes(self, srv):
+        ts = srv.array("d", range(1000))
+        vs = srv.array("d", [100.0 if i == 537 else 1.0 for i in range(1000)])
+        keep = srv._lttb(ts, vs, 50)
+        assert len(keep) == 50 and keep[0] == 0 and keep[-1] == 999
+        assert 537 in keep
+        assert srv._lttb(ts, vs, 2000) == list(range(1000))
+
+    def test_auto_step_ladder_leaves_time_snapping_alone(self, srv, monkeypatch):
+        assert srv._auto_step(0, 12_000, 100) == "2m"
+        assert srv._auto_step(0, 2_000, 100) == "20s"
+        # Relative-time snapping keeps its own grid: 2m is not a snap step.
+        monkeypatch.setattr(srv, "_split_interval", 1800.0)
+        assert srv._snap_step(1200) == 60
+
+    def test_auto_step_and_downsampling(self, srv):
+        seen = {}
+
+        def handler(request):
+            seen.update(request.url.params)
+            values = [[1_700_000_000 + i * 15, str(i % 7)] for i in range(1000)]
+            return httpx.Response(200, json=_matrix_body({"metric": {"host": "a"}, "values": values}))
+
+        _mock_client(srv, handler)
+        result = json.loads(
+            _run(srv.loki_query_range, query='rate({job="x"}[5m])', start="6h", max_points=100).split("\n\n", 1)[1]
+        )
+        assert seen["step"] == "5m"
+        values = result["result"][0]["values"]
+        assert len(values) == 100 and values[0] == [1_700_000_000, 0.0]
+        assert result["downsampling"] == {
+            "step": "5m",
+            "max_points": 100,
+            "series_downsampled": 1,
+            "points_before": 1000,
+            "points_after": 100,
+        }
+
+    def test_explicit_step_and_non_finite_series_are_kept(self, srv):
+        seen = {}
+
+        def handler(request):
+            seen.update(request.url.params)
+            values = [[i, "NaN" if i == 3 else "1"] for i in range(10)]
+            return httpx.Response(200, json=_matrix_body({"metric": {}, "values": values}))
+
+        _mock_client(srv, handler)
+        result = _run(srv.loki_query_range, query='rate({job="x"}[5m])', step="1m", max_points=5)
+        assert seen["step"] == "1m"
+        assert '"NaN"' in result and '"points_after": 10' in result
+
+
+# ===========================================================================
+# Series summaries
+# ===========================================================================
+
+
+class TestSeriesSummary:
+    VALUES = [[1_700_000_000 + i * 60, str(v)] for i, v in enumerate([1, 2, 3, 4, 5, 6, 7, 8, 9, 100])]
+
+    def _summary(self, srv, monkeypatch, engine):
+        if engine == "numpy":
+            monkeypatch.setattr(srv, "np", pytest.importorskip("numpy"))
+        else:
+            monkeypatch.setattr(srv, "np", None)
+        return srv._series_stats(*srv._series_arrays(self.VALUES))
+
+    @pytest.mark.parametrize("engine", ["numpy", "array"])
+    def test_statistics(self, srv, monkeypatch, engine):
+        minimum, maximum, mean, p50, p95, last, trend = self._summary(srv, monkeypatch, engine)
+        assert (minimum, maximum, mean, last) == (1, 100, 14.5, 100)
+        assert p50 == pytest.approx(5.5) and p95 == pytest.approx(59.05)
+        # Least-squares slope over the 9-minute span.
+        assert trend == pytest.approx(53.1818, rel=1e-4)
+
+    def test_query_range_returns_one_row_per_series(self, srv):
+        def handler(request):
+            return httpx.Response(
+                200,
+                json=_matrix_body(
+                    {"metric": {"host": "a"}, "values": self.VALUES},
+                    {"metric": {"host": "b"}, "values": [[1, "NaN"], [2, "3"]]},
+                ),
+            )
+
+        _mock_client(srv, handler)
+        result = _run(srv.loki_query_range, query='rate({job="x"}[1m])', summarize=True)
+        summary_line, body = result.split("\n\n", 1)
+        assert summary_line == "Summarized 2 series (12 points)"
+        data = json.loads(body)
+        assert "result" not in data
+        assert data["summary"]["columns"][:3] == ["series", "points", "min"]
+        assert data["summary"]["rows"][0][:4] == ['{host="a"}', 10, 1.0, 100.0]
+        assert data["summary"]["rows"][1] == ['{host="b"}', 1, 3.0, 3.0, 3.0, 3.0, 3.0, 3.0, 0.0]
+
+    def test_vector_and_log_queries(self, srv):
+        body = {
+            "status": "success",
+            "data": {"resultType": "vector", "result": [{"metric": {}, "value": [1, "42"]}]},
+        }
+        _mock_client(srv, lambda request: httpx.Response(200, json=body))
+        assert '"{}",\n        1,\n        42.0' in _run(srv.loki_query_instant, query="vector(42)", summarize=True)
+        assert "only applies to metric queries" in _run(srv.loki_query_instant, query='{job="x"}', summarize=True)
+
+
+# ===========================================================================
+# Volume anomalies
+# ===========================================================================
+
+
+class TestVolumeAnomalies:
+    ROWS = [[100.0] * 24 + [100.0, 1000.0, 100.0], [50.0, 60.0] * 12 + [55.0, 50.0, 60.0]]
+
+    @pytest.mark.parametrize("engine", ["numpy", "array"])
+    @pytest.mark.parametrize("method", ["zscore", "ewma"])
+    def test_scores(self, srv, monkeypatch, engine, method):
+        monkeypatch.setattr(srv, "np", pytest.importorskip("numpy") if engine == "numpy" else None)
+        spiky, noisy = srv._anomaly_scores(self.ROWS, 24, method)
+        assert len(spiky) == 3
+        assert spiky[1] > 50 and abs(spiky[0]) < 1
+        assert max(abs(z) for z in noisy) < 3
+
+    def test_tool_reports_spikes_drops_and_new_series(self, srv):
+        def handler(request):
+            params = request.url.params
+            start = datetime.fromisoformat(params["start"]).timestamp()
+            end = datetime.fromisoformat(params["end"]).timestamp()
+            step = int(params["step"].rstrip("s"))
+            recent = end - start <= 3600
+            volumes = {"web": 1000, "db": 500, "cron": 200}
+            if recent:
+                volumes = {"web": 10_000, "db": 500, "batch": 300}
+            grid = range(int(start), int(end) + 1, step)
+            series = [
+                {"metric": {"service_name": name}, "values": [[ts, str(v)] for ts in grid]}
+                for name, v in volumes.items()
+            ]
+            return httpx.Response(200, json=_matrix_body(*series))
+
+        _mock_client(srv, handler)
+        result = _run(srv.loki_volume_anomalies, window="1h", baseline="6h")
+        summary, body = result.split("\n\n", 1)
+        assert summary == "3 of 4 service_name series anomalous (|z| >= 3.0)"
+        data = json.loads(body)
+        assert data["step"] == "5m" and data["query"] == "{}"
+        found = {a["service_name"]: a for a in data["anomalies"]}
+        assert set(found) == {"web", "batch", "cron"}
+        assert found["web"]["direction"] == "spike" and found["web"]["ratio"] == 10.0
+        assert len(found["web"]["buckets"]) == 10
+        assert found["batch"]["ratio"] is None
+        assert found["cron"]["direction"] == "drop" and found["cron"]["ratio"] == 0.0
+
+    def test_rejects_bad_arguments(self, srv):
+        assert "Unknown method" in _run(srv.loki_volume_anomalies, method="mad")
+        assert "must be durations" in _run(srv.loki_volume_anomalies, window="soon")
+
+
+# ===========================================================================
+# Volume drilldown
+# ===========================================================================
+
+
+class TestVolumeDrilldown:
+    VOLUMES = {
+        ("{}", "host"): {"web": 800, "db": 150, "cron": 50},
+        ('{host="web"}', "container"): {"api": 600, "nginx": 100},
+        ('{host="db"}', "container"): {"postgres": 150},
+    }
+
+    def _handler(self, requests):
+        def handler(request):
+            params = request.url.params
+            requests.append((params["query"], params["targetLabels"]))
+            label = params["targetLabels"]
+            volumes = self.VOLUMES.get((params["query"], label), {})
+            result = [{"metric": {label: k}, "value": [1, str(v)]} for k, v in volumes.items()]
+            return httpx.Response(200, json={"status": "success", "data": {"resultType": "vector", "result": result}})
+
+        return handler
+
+    def test_tree_with_percentages(self, srv):
+        requests = []
+        _mock_client(srv, self._handler(requests))
+        result = _run(srv.loki_volume_drilldown, path="host,container", top_k=2)
+        data = json.loads(result.split("\n\n", 1)[1])
+        assert requests[0] == ("{}", "host")
+        assert sorted(requests[1:]) == [('{host="db"}', "container"), ('{host="web"}', "container")]
+        web, db = data["tree"]
+        assert (web["host"], web["pct"], web["other_pct"]) == ("web", 80.0, 12.5)
+        assert [(c["container"], c["pct"]) for c in web["children"]] == [("api", 75.0), ("nginx", 12.5)]
+        assert db["children"][0]["pct"] == 100.0 and "other_pct" not in db
+        assert data["noisiest"] == {"host": "web", "container": "api", "volume": "600 B"}
+        assert data["requests"] == 3 and data["other_pct"] == 5.0
+
+    def test_request_budget(self, srv, monkeypatch):
+        monkeypatch.setattr(srv, "LOKI_DRILLDOWN_MAX_REQUESTS", 10)
+        result = _run(srv.loki_volume_drilldown, path="host,container,unit", top_k=5)
+        assert "needs up to 31 volume queries" in result
+
+
+# ===========================================================================
+# Batch tool
+# ===========================================================================
+
+
+class TestBatch:
+    def test_runs_concurrently_and_keeps_order(self, srv, monkeypatch):
+        monkeypatch.setattr(srv, "LOKI_BATCH_CONCURRENCY", 3)
+        active = peak = 0
+
+        async def handler(request):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.05)
+            active -= 1
+            return httpx.Response(200, json={"status": "success", "data": [request.url.path.rsplit("/", 1)[-1]]})
+
+        _mock_client(srv, handler)
+        result = _run(
+            srv.loki_batch,
+            calls=[
+                {"tool": "loki_list_labels", "arguments": {}},
+                {"tool": "loki_list_label_values", "arguments": {"name": "host"}},
+                {"tool": "loki_list_labels", "arguments": {"start": "2h"}},
+                {"tool": "loki_list_labels", "arguments": {"bogus": 1}},
+                {"tool": "loki_batch", "arguments": {"calls": []}},
+            ],
+        )
+        assert result.startswith("Batch: 5 call(s), 3 done, 2 failed in ")
+        headers = [line.split(" (")[0] for line in result.splitlines() if line[:1] == "[" and line[1:2].isdigit()]
+        assert headers == [
+            "[1] loki_list_labels: done",
+            "[2] loki_list_label_values: done",
+            "[3] loki_list_labels: done",
+            "[4] loki_list_labels: failed",
+            "[5] loki_batch: failed",
+        ]
+        assert '"values"' in result and "ValidationError" in result and "Unknown tool 'loki_batch'" in result
+        assert peak == 3
+
+    def test_returned_errors_count_as_failed(self, srv, monkeypatch):
+        monkeypatch.setattr(srv, "_enabled_modules", {"query", "index"})
+
+        def handler(request):
+            if request.url.path == "/loki/api/v1/labels":
+                return httpx.Response(500, json={"message": "internal error"})
+            return httpx.Response(200, json={"status": "success", "data": ["a"]})
+
+        _mock_client(srv, handler)
+        result = _run(
+            srv.loki_batch,
+            calls=[
+                {"tool": "loki_list_labels", "arguments": {}},
+                {"tool": "loki_list_label_values", "arguments": {"name": "host"}},
+                {"tool": "loki_list_delete_requests", "arguments": {}},
+            ],
+        )
+        assert result.startswith("Batch: 3 call(s), 1 done, 2 failed in ")
+        headers = [line for line in result.splitlines() if line[:1] == "[" and line[1:2].isdigit()]
+        assert [h.split(" (")[0] for h in headers] == [
+            "[1] loki_list_labels: failed",
+            "[2] loki_list_label_values: done",
+            "[3] loki_list_delete_requests: failed",
+        ]
+        assert all(h.endswith(" ms queued)") for h in headers)
+        assert "HTTP 500" in result and "not enabled" in result
+
+    def test_arguments_are_validated_and_coerced_like_direct_calls(self, srv):
+        limits = []
+
+        def handler(request):
+            if "limit" in request.url.params:
+                limits.append(request.url.params["limit"])
+            return httpx.Response(200, json=_streams_body())
+
+        _mock_client(srv, handler)
+        result = _run(
+            srv.loki_batch,
+            calls=[
+                {"tool": "loki_search_logs", "arguments": {"host": "h", "limit": "7"}},
+                {"tool": "loki_search_logs", "arguments": {"host": "h", "limit": "many"}},
+            ],
+        )
+        assert result.startswith("Batch: 2 call(s), 1 done, 1 failed in ")
+        assert limits == ["7"]
+        assert "[2] loki_search_logs: failed" in result and "ValidationError" in result
+
+    def test_error_detection_reads_the_json(self, srv):
+        assert srv._is_error_output('{"message": "x", "error": "boom"}')
+        assert srv._is_error_output('Error from t: HTTP 500\n\n{"status_code": 500, "error": true}')
+        assert not srv._is_error_output('Query: {a="b"}\n\n{"result": [], "error": null}')
+        assert not srv._is_error_output("Query is valid")
+
+    def test_time_includes_queueing(self, srv, monkeypatch):
+        monkeypatch.setattr(srv, "LOKI_BATCH_CONCURRENCY", 1)
+
+        async def handler(request):
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json={"status": "success", "data": []})
+
+        _mock_client(srv, handler)
+        calls = [{"tool": "loki_list_labels", "arguments": {"start": f"{i + 1}h"}} for i in range(2)]
+        headers = [line for line in _run(srv.loki_batch, calls=calls).splitlines() if line.startswith("[2]")]
+        total, queued = (int(part.split()[0]) for part in headers[0].split("(")[1].split(", "))
+        assert queued >= 40 and total >= queued + 40
+
+    def test_limits(self, srv, monkeypatch):
+        monkeypatch.setattr(srv, "LOKI_BATCH_MAX_CALLS", 2)
+        assert "calls is empty" in _run(srv.loki_batch, calls=[])
+        assert "exceeds LOKI_BATCH_MAX_CALLS=2" in _run(srv.loki_batch, calls=[{"tool": "loki_ready"}] * 3)
+
+
+# ===========================================================================
+# CPU offload
+# ===========================================================================
+
+
+class TestOffload:
+    def _big_handler(self, request):
+        values = [[str(1_700_000_000_000_000_000 + i), f"line {i} " + "x" * 80] for i in range(3000)]
+        return httpx.Response(200, json=_streams_body({"stream": {"host": "a"}, "values": values}))
+
+    def _query(self, srv):
+        return _run(srv.loki_query_range, query='{job="x"}', limit=3000, filter_query={"host": "a"}, fields="host")
+
+    def test_small_results_stay_inline(self, srv):
+        _mock_client(srv, lambda request: httpx.Response(200, json=_streams_body()))
+        _run(srv.loki_query_range, query='{job="x"}')
+        assert srv._offloaded == 0 and srv._executor is None
+
+    @pytest.mark.parametrize("mode", ["thread", "process"])
+    def test_large_results_are_offloaded_with_identical_output(self, srv, monkeypatch, mode):
+        _mock_client(srv, self._big_handler)
+        monkeypatch.setattr(srv, "LOKI_OFFLOAD", "off")
+        expected = self._query(srv)
+        monkeypatch.setattr(srv, "LOKI_OFFLOAD", mode)
+        try:
+            assert self._query(srv) == expected
+            # Decode, filter and format each ran in the executor.
+            assert srv._offloaded == 3
+            futures = srv.concurrent.futures
+            executor_type = futures.ProcessPoolExecutor if mode == "process" else futures.ThreadPoolExecutor
+            assert isinstance(srv._executor, executor_type)
+        finally:
+            if srv._executor is not None:
+                srv._executor.shutdown()
+
+
+class TestJsonBackend:
+    BACKENDS = ["stdlib", "orjson", "msgspec"]
+
+    def _use(self, srv, monkeypatch, backend):
+        if backend != "stdlib" and getattr(srv, backend) is None:
+            pytest.skip(f"{backend} is not installed")
+        monkeypatch.setattr(srv, "_JSON_DECODER", backend)
+        monkeypatch.setattr(srv, "_JSON_ENCODER", backend)
+
+    def _handler(self, request):
+        body = _streams_body(
+            {"stream": {"host": "a"}, "values": [["1700000000000000000", "GET /café 200 ✓ 日本"]]},
+            {"stream": {"host": "b"}, "values": [["1700000001000000000", '{"level":"error","n":3}']]},
+        )
+        body["data"]["stats"] = {"summary": {"totalBytesProcessed": 123}}
+        return httpx.Response(200, json=body)
+
+    @pytest.mark.parametrize("backend", BACKENDS)
+    def test_output_matches_stdlib(self, srv, monkeypatch, backend):
+        _mock_client(srv, self._handler)
+        self._use(srv, monkeypatch, "stdlib")
+        expected = _run(srv.loki_query_range, query='{job="x"}', fields="level")
+        self._use(srv, monkeypatch, backend)
+        assert _run(srv.loki_query_range, query='{job="x"}', fields="level") == expected
+        assert "totalBytesProcessed" not in expected
+        assert "GET /café 200 ✓ 日本" in expected
+
+    @pytest.mark.parametrize("backend", BACKENDS)
+    def test_non_query_bodies_and_errors(self, srv, monkeypatch, backend):
+        self._use(srv, monkeypatch, backend)
+        labels = httpx.Response(200, json={"status": "success", "data": ["host", "job"]})
+        assert srv._unwrap_loki_response(labels) == ["host", "job"]
+        garbage = httpx.Response(200, content=b"not json", headers={"content-type": "application/json"})
+        assert srv._unwrap_loki_response(garbage) == "not json"
+        with pytest.raises(ValueError):
+            srv._json_loads(b"{")
+
+    @pytest.mark.parametrize("backend", BACKENDS)
+    def test_encoder_falls_back_for_unsupported_values(self, srv, monkeypatch, backend):
+        self._use(srv, monkeypatch, backend)
+        data = {"path": os.path.normpath, 3: "int key", "values": [1.5, None, True], "line": "naïve"}
+        assert srv._json_dumps(data) == json.dumps(data, indent=2, default=str, ensure_ascii=False)
+        data["big"] = 2**70
+        assert srv._json_dumps(data) == json.dumps(data, indent=2, default=str, ensure_ascii=False)
+
+    def test_backend_selection(self, srv, monkeypatch):
+        monkeypatch.setattr(srv, "LOKI_JSON", "stdlib")
+        assert srv._json_backend(("orjson",)) == "stdlib"
+        monkeypatch.setattr(srv, "LOKI_JSON", "msgspec")
+        monkeypatch.setattr(srv, "msgspec", None)
+        assert srv._json_backend(("orjson",)) == "stdlib"
+        monkeypatch.setattr(srv, "LOKI_JSON", "auto")
+        monkeypatch.setattr(srv, "orjson", None)
+        assert srv._json_backend(("msgspec", "orjson")) == "stdlib"